@@ -0,0 +1,207 @@
+"""
+Records the raw api responses of a run to a directory, and replays
+them later instead of going to the network, e.g. to re-run a sync
+after a bug fix without downloading everything again.
+
+A recording directory has one compressed file per response, with the
+decoded body, and an index.jsonl file with one line per response:
+{
+    "url": "https://api.kraken.com/0/public/AssetPairs",
+    "status": 200,
+    "headers": {"Content-Type": "application/json", "ETag": "..."},
+    "file": "000001-api.kraken.com.zlib",
+    "recorded": "2019-05-08T12:00:00+00:00"
+}
+
+The compression, zlib (default) or lzma, is chosen when recording and
+is the file extension, replaying picks it up from there.
+
+Only 200 responses are recorded. Recording again to the same directory
+adds to it, replaying serves the last recorded response of every url
+(query string included), whatever the request headers (e.g. ETag
+conditions), so commands should handle all data when replaying.
+"""
+import io
+import json
+import lzma
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+
+from django.core.management.base import CommandError
+from django.utils import timezone
+
+from common import http_client
+
+
+INDEX_FILE_NAME = 'index.jsonl'
+# {file extension: (compress, decompress)}
+COMPRESSIONS = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+# Headers that describe the body as sent, not as recorded (decoded)
+SKIPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'}
+
+
+class ReplayMissingError(requests.RequestException):
+    pass
+
+
+class RecordingAdapter(BaseAdapter):
+    """
+    requests transport adapter that sends the requests with adapter,
+    and saves the 200 responses to directory, compressed with zlib or
+    lzma.
+    """
+
+    def __init__(self, directory, adapter, compression='zlib'):
+        super().__init__()
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.directory = directory
+        self.adapter = adapter
+        self.compression = compression
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._count = len(read_index(directory))
+
+    def send(self, request, **kwargs):
+        response = self.adapter.send(request, **kwargs)
+        if response.status_code == 200:
+            # Reads the complete body, also of streamed responses
+            self.save_response(request.url, response, response.content)
+        return response
+
+    def save_response(self, url, response, body):
+        compress, _ = COMPRESSIONS[self.compression]
+        compressed_body = compress(body)
+        with self._lock:
+            self._count += 1
+            file_name = f'{self._count:06d}-{urlsplit(url).netloc}.{self.compression}'
+            with open(os.path.join(self.directory, file_name), 'wb') as body_file:
+                body_file.write(compressed_body)
+            entry = {
+                'url': url,
+                'status': response.status_code,
+                'headers': {
+                    name: value for name, value in response.headers.items()
+                    if name.lower() not in SKIPPED_HEADERS
+                },
+                'file': file_name,
+                'recorded': timezone.now().isoformat(),
+            }
+            with open(os.path.join(self.directory, INDEX_FILE_NAME), 'a') as index_file:
+                index_file.write(json.dumps(entry) + '\n')
+
+    def close(self):
+        self.adapter.close()
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    requests transport adapter that answers requests with the last
+    response recorded in directory for their url. Raises
+    ReplayMissingError for urls without a recorded response.
+    """
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        self.entries = {entry['url']: entry for entry in read_index(directory)}
+
+    def send(self, request, **kwargs):
+        entry = self.entries.get(request.url)
+        if entry is None:
+            raise ReplayMissingError(
+                f"No recorded response for {request.url} in {self.directory}",
+                request=request)
+
+        _, decompress = COMPRESSIONS[entry['file'].rsplit('.', 1)[1]]
+        with open(os.path.join(self.directory, entry['file']), 'rb') as body_file:
+            body = decompress(body_file.read())
+
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = 'OK'
+        response.headers.update(entry['headers'])
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def read_index(directory):
+    """
+    Returns the entries of the recording in directory, in recording
+    order, or an empty list if nothing was recorded there.
+    """
+    try:
+        with open(os.path.join(directory, INDEX_FILE_NAME)) as index_file:
+            return [json.loads(line) for line in index_file if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+@contextmanager
+def api_recording(record_directory=None, replay_directory=None, compression='zlib'):
+    """
+    Records the responses of the shared http client to
+    record_directory, compressed with compression (see COMPRESSIONS),
+    or replays them from replay_directory, while in the with block.
+    Does nothing if neither is given.
+    """
+    if record_directory and replay_directory:
+        raise CommandError("Use either --record or --replay, not both")
+    if replay_directory and not read_index(replay_directory):
+        raise CommandError(f"No recorded responses in {replay_directory}")
+
+    if record_directory:
+        adapter = RecordingAdapter(
+            record_directory, http_client.get_session().get_adapter('https://'),
+            compression)
+    elif replay_directory:
+        adapter = ReplayAdapter(replay_directory)
+    else:
+        yield
+        return
+    with http_client.use_adapter(adapter):
+        yield
+
+
+class ApiRecordingCommandMixin:
+    """
+    Adds the options --record DIR, --record-compression and --replay
+    DIR to a command that fetches api data (see api_recording). Replaying implies handling
+    all data, commands check options['replay'] for that.
+    """
+
+    def create_parser(self, prog_name, subcommand, **kwargs):
+        parser = super().create_parser(prog_name, subcommand, **kwargs)
+        parser.add_argument(
+            '--record', metavar='DIR',
+            help="Save the raw api responses to this directory")
+        parser.add_argument(
+            '--record-compression', choices=sorted(COMPRESSIONS), default='zlib',
+            help="Compression of the responses saved with --record "
+                 "(default: zlib)")
+        parser.add_argument(
+            '--replay', metavar='DIR',
+            help="Use the api responses saved with --record in this "
+                 "directory instead of the network")
+        return parser
+
+    def execute(self, *args, **options):
+        with api_recording(
+                options.get('record'), options.get('replay'),
+                options.get('record_compression', 'zlib')):
+            return super().execute(*args, **options)
@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class CommonConfig(AppConfig):
     name = 'common'
+
+    def ready(self):
+        from common.sqlite import set_sqlite_pragmas
+
+        connection_created.connect(set_sqlite_pragmas)
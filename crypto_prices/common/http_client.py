@@ -0,0 +1,200 @@
+"""
+Shared HTTP client used by all exchange and coinapi.io api calls.
+
+All requests go through one requests.Session, so connections are
+pooled (per host) and kept alive between calls. Every request gets
+a connect and read timeout, and requests that fail with a connection
+error, a timeout, 429 or 5xx are retried with jittered exponential
+backoff.
+
+The time spent per host is kept in latency_stats, so commands can
+print it at the end of a run.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+
+from common import metrics
+
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class HostLatencyStats:
+    """
+    Keeps the number of requests, failed requests and the total and
+    maximum duration of requests, per host.
+
+    For streamed responses the duration is the time until the
+    response headers were received.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._local = threading.local()
+
+    def record(self, host, duration, failed=False):
+        self._local.duration = self.return_thread_duration() + duration
+        with self._lock:
+            host_stats = self._stats.setdefault(
+                host, {'requests': 0, 'failed': 0, 'total': 0.0, 'max': 0.0})
+            host_stats['requests'] += 1
+            host_stats['failed'] += int(failed)
+            host_stats['total'] += duration
+            host_stats['max'] = max(host_stats['max'], duration)
+
+    def as_dict(self):
+        """
+        Returns the stats per host, including the average duration.
+        """
+        with self._lock:
+            return {
+                host: dict(
+                    host_stats,
+                    average=host_stats['total'] / host_stats['requests'])
+                for host, host_stats in self._stats.items()
+            }
+
+    def return_thread_duration(self):
+        """
+        Returns the total duration of all requests made by the current
+        thread (not affected by reset).
+        """
+        return getattr(self._local, 'duration', 0.0)
+
+    def format_lines(self):
+        return [
+            f"{host}: {host_stats['requests']} requests "
+            f"({host_stats['failed']} failed), "
+            f"avg {host_stats['average']:.3f}s, max {host_stats['max']:.3f}s, "
+            f"total {host_stats['total']:.3f}s"
+            for host, host_stats in sorted(self.as_dict().items())
+        ]
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+latency_stats = HostLatencyStats()
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the shared session, creates it on first use.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+            adapter = HTTPAdapter(
+                pool_connections=settings.HTTP_POOL_CONNECTIONS,
+                pool_maxsize=settings.HTTP_POOL_MAXSIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+    return _session
+
+
+@contextmanager
+def use_adapter(adapter):
+    """
+    Sends all requests of the shared session through the given requests
+    transport adapter while in the with block, e.g. to serve recorded
+    responses.
+    """
+    session = get_session()
+    original_adapters = dict(session.adapters)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    try:
+        yield adapter
+    finally:
+        session.adapters.clear()
+        session.adapters.update(original_adapters)
+
+
+def get(url, headers=None, params=None, stream=False):
+    """
+    Sends a GET request using the shared session, returns the response.
+
+    Retries on connection errors, timeouts, 429 and 5xx responses,
+    up to settings.HTTP_MAX_RETRIES times. Raises the last error (or
+    requests.HTTPError for an error response) when out of retries.
+    """
+    session = get_session()
+    timeout = (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT)
+    host = urlsplit(url).netloc
+    max_retries = settings.HTTP_MAX_RETRIES
+
+    for attempt in range(max_retries + 1):
+        start = time.perf_counter()
+        try:
+            response = session.get(
+                url, headers=headers, params=params, timeout=timeout,
+                stream=stream)
+        except (requests.ConnectionError, requests.Timeout):
+            record_request(host, time.perf_counter() - start, True)
+            if attempt == max_retries:
+                raise
+            time.sleep(return_backoff_delay(attempt))
+            continue
+
+        record_request(
+            host, time.perf_counter() - start, response.status_code >= 400)
+        if response.status_code in RETRY_STATUS_CODES and attempt < max_retries:
+            delay = return_backoff_delay(
+                attempt, response.headers.get('Retry-After'))
+            response.close()
+            time.sleep(delay)
+            continue
+
+        response.raise_for_status()
+        return response
+
+
+def record_request(host, duration, failed):
+    latency_stats.record(host, duration, failed)
+    metrics.api_request_duration.labels(host).observe(duration)
+    if failed:
+        metrics.api_request_failures.labels(host).inc()
+
+
+def get_json(url, headers=None, params=None):
+    """
+    Sends a GET request using get(), returns the parsed json body.
+    """
+    return get(url, headers=headers, params=params).json()
+
+
+def return_backoff_delay(attempt, retry_after=None):
+    """
+    Returns the number of seconds to wait before retry number
+    attempt + 1.
+
+    Uses the server's Retry-After value (in seconds) when given,
+    otherwise a random delay between 0 and
+    HTTP_BACKOFF_FACTOR * 2 ** attempt ("full jitter"). Both are
+    capped at HTTP_BACKOFF_MAX.
+    """
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), settings.HTTP_BACKOFF_MAX)
+        except ValueError:
+            pass
+
+    ceiling = min(settings.HTTP_BACKOFF_FACTOR * 2 ** attempt,
+                  settings.HTTP_BACKOFF_MAX)
+    return random.uniform(0, ceiling)
@@ -0,0 +1,507 @@
+"""
+Shows where the time of a management command run goes.
+
+A run is split into pipeline stages: fetch (http requests), parse
+(decoding api responses), normalize (turning them into model data) and
+write (saving to the db). Code marks its stages with stage(), as a
+context manager or decorator, or with iter_stage() for the items of a
+lazily consumed iterator. They do nothing unless PipelineStats is
+recording.
+
+Per stage, PipelineStats keeps the number of times it was entered, the
+wall time, the number and duration of SQL queries, the duration of
+http requests and the rest, the Python time. Time in a nested stage
+only counts for the inner stage, time outside of any stage counts for
+'other'. Stages are tracked per thread, so stages running in parallel
+threads add up to more than the wall time of the run.
+
+With trace_memory, PipelineStats also keeps the peak memory per stage
+and the top allocation sites, using tracemalloc. CommandProfiler
+profiles a run with cProfile and samples the stacks of all threads,
+for flame graphs.
+
+InstrumentedCommand, the base class of the project's commands, adds
+--stats and --stats-json to print or save the stats of a run,
+--trace-memory to add the memory use to them and --profile to profile
+the run.
+"""
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import ContextDecorator, ExitStack, contextmanager
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection, connections
+from django.test.utils import CaptureQueriesContext
+
+from common import metrics
+from common.http_client import latency_stats
+
+
+STAGES = ('fetch', 'parse', 'normalize', 'write')
+OTHER_STAGE = 'other'
+
+# The PipelineStats that is recording, if any
+_active_stats = None
+# Number of InstrumentedCommands running, commands called by commands
+# included
+_running_commands = 0
+
+# Number of allocation sites reported with trace_memory
+TOP_ALLOCATIONS_COUNT = 10
+# With trace_memory, memory use is snapshotted again when it grew by
+# this factor since the last snapshot
+SNAPSHOT_GROWTH_FACTOR = 1.25
+# Seconds between stack samples of CommandProfiler
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+
+class QueryCounter:
+    """
+    Database execute wrapper that counts the queries and their total
+    duration.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class PipelineStats:
+    """
+    Records the stats per stage (see the module docstring) between
+    start() and stop(), or in a with block. Only one PipelineStats
+    records at a time: starting another one (e.g. for a command called
+    by a command) pauses the current one until the new one stops, its
+    queries aren't counted and its time counts for the current stage.
+
+    With trace_memory, tracemalloc traces the allocations while
+    recording. The peak memory of a stage is the peak traced memory
+    while that stage was entered, in any thread. The top allocation
+    sites are taken from a snapshot at (within SNAPSHOT_GROWTH_FACTOR
+    of) the highest memory use seen on a stage switch.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.wall_time = None
+        self.peak_snapshot = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started = None
+        self._paused_stats = None
+        self._started_tracing = False
+        self._peak_snapshot_size = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        global _active_stats
+        self._paused_stats = _active_stats
+        _active_stats = self
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._started = time.perf_counter()
+        self.enter(OTHER_STAGE)
+
+    def stop(self):
+        global _active_stats
+        self.exit()
+        self.wall_time = time.perf_counter() - self._started
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        if self._count_query in connection.execute_wrappers:
+            connection.execute_wrappers.remove(self._count_query)
+        _active_stats = self._paused_stats
+
+    def return_thread_state(self):
+        state = self._local
+        if not hasattr(state, 'stack'):
+            state.stack = []
+            state.queries = 0
+            state.query_time = 0.0
+            state.mark = (time.perf_counter(), latency_stats.return_thread_duration())
+            # Connections are per thread, count the queries of every
+            # thread that enters a stage
+            connection.execute_wrappers.append(self._count_query)
+        return state
+
+    def _count_query(self, execute, sql, params, many, context):
+        if _active_stats is not self:
+            return execute(sql, params, many, context)
+        state = self.return_thread_state()
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            state.query_time += time.perf_counter() - start
+            state.queries += 1
+
+    def _switch(self, state):
+        """
+        Adds everything since the last stage switch of this thread to
+        the stage it was in.
+        """
+        now = time.perf_counter()
+        http_duration = latency_stats.return_thread_duration()
+        if state.stack:
+            with self._lock:
+                stage_stats = self.stages[state.stack[-1]]
+                stage_stats['wall_time'] += now - state.mark[0]
+                stage_stats['http_time'] += http_duration - state.mark[1]
+                stage_stats['queries'] += state.queries
+                stage_stats['query_time'] += state.query_time
+                if self.trace_memory:
+                    self._record_memory(stage_stats)
+        state.queries = 0
+        state.query_time = 0.0
+        state.mark = (now, http_duration)
+
+    def _record_memory(self, stage_stats):
+        current, peak = tracemalloc.get_traced_memory()
+        stage_stats['peak_memory'] = max(stage_stats.get('peak_memory', 0), peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            # Python 3.9+, before that a stage's peak is the peak so far
+            tracemalloc.reset_peak()
+        if current > self._peak_snapshot_size * SNAPSHOT_GROWTH_FACTOR:
+            self.peak_snapshot = tracemalloc.take_snapshot()
+            self._peak_snapshot_size = current
+
+    def enter(self, name):
+        state = self.return_thread_state()
+        self._switch(state)
+        state.stack.append(name)
+        with self._lock:
+            stage_stats = self.stages.setdefault(name, {
+                'calls': 0, 'wall_time': 0.0, 'queries': 0,
+                'query_time': 0.0, 'http_time': 0.0,
+            })
+            stage_stats['calls'] += 1
+
+    def exit(self):
+        state = self.return_thread_state()
+        self._switch(state)
+        state.stack.pop()
+
+    def as_dict(self):
+        """
+        Returns the stats in the format:
+        {
+            'wall_time': 2.5,  # seconds, None while recording
+            'stages': {
+                'fetch': {
+                    'calls': 3,
+                    'wall_time': 1.9,
+                    'queries': 0,
+                    'query_time': 0.0,
+                    'http_time': 1.8,
+                    'python_time': 0.1,
+                },
+                ...
+            },
+            'total': {...},  # the sum of all stages, without calls
+        }
+        Stages are in pipeline order, followed by other stages.
+
+        With trace_memory, the stages and total also have
+        'peak_memory' (bytes), and there's:
+            'top_allocations': [
+                {'file': '.../utils.py', 'line': 12, 'size': 1234, 'count': 12},
+                ...
+            ],
+
+        python_time is the wall time minus the query and http time,
+        at least 0 (http requests of parallel threads can take longer
+        than the stage).
+        """
+        with self._lock:
+            stages = {name: dict(stage_stats) for name, stage_stats in self.stages.items()}
+        order = list(STAGES) + sorted(set(stages) - set(STAGES))
+        stages = {name: stages[name] for name in order if name in stages}
+
+        total = {'wall_time': 0.0, 'queries': 0, 'query_time': 0.0, 'http_time': 0.0}
+        for stage_stats in stages.values():
+            stage_stats['python_time'] = max(0.0, (
+                stage_stats['wall_time'] - stage_stats['query_time']
+                - stage_stats['http_time']))
+            for key in total:
+                total[key] += stage_stats[key]
+        total['python_time'] = sum(stage_stats['python_time'] for stage_stats in stages.values())
+        stats = {'wall_time': self.wall_time, 'stages': stages, 'total': total}
+
+        if self.trace_memory:
+            total['peak_memory'] = max(
+                (stage_stats.get('peak_memory', 0) for stage_stats in stages.values()),
+                default=0)
+            stats['top_allocations'] = self.return_top_allocations()
+        return stats
+
+    def return_top_allocations(self, count=TOP_ALLOCATIONS_COUNT):
+        if self.peak_snapshot is None:
+            return []
+        return [
+            {
+                'file': statistic.traceback[0].filename,
+                'line': statistic.traceback[0].lineno,
+                'size': statistic.size,
+                'count': statistic.count,
+            }
+            for statistic in self.peak_snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ]).statistics('lineno')[:count]
+        ]
+
+    def format_lines(self):
+        stats = self.as_dict()
+        lines = []
+        for name, stage_stats in list(stats['stages'].items()) + [('total', stats['total'])]:
+            calls = f"{stage_stats['calls']} calls" if 'calls' in stage_stats else ''
+            lines.append(
+                f"{name:<10} {calls:>12} {stage_stats['wall_time']:>8.3f}s, "
+                f"{stage_stats['queries']:>6} queries {stage_stats['query_time']:>8.3f}s, "
+                f"http {stage_stats['http_time']:>8.3f}s, "
+                f"python {stage_stats['python_time']:>8.3f}s"
+                + (f", peak {stage_stats['peak_memory'] / 2 ** 20:.1f}MB"
+                   if 'peak_memory' in stage_stats else ''))
+        if self.trace_memory:
+            lines.append("Top allocation sites at peak memory:")
+            lines.extend(
+                f"{allocation['size'] / 2 ** 20:>8.1f}MB {allocation['count']:>8} blocks "
+                f"{allocation['file']}:{allocation['line']}"
+                for allocation in stats['top_allocations'])
+        return lines
+
+
+class Stage(ContextDecorator):
+    """
+    Counts the with block, or every call of the decorated function, as
+    the given stage of the recording PipelineStats. Use stage() to
+    create one.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stats = None
+
+    def _recreate_cm(self):
+        # A new instance per decorated call, calls can be nested and
+        # run in parallel threads
+        return Stage(self.name)
+
+    def __enter__(self):
+        self.stats = _active_stats
+        if self.stats is not None:
+            self.stats.enter(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.stats is not None:
+            self.stats.exit()
+
+
+def stage(name):
+    return Stage(name)
+
+
+def iter_stage(name, iterable):
+    """
+    Returns the items of iterable, counts the time taken to produce
+    each item as the given stage.
+    """
+    if _active_stats is None:
+        return iterable
+    return _iter_stage(name, iter(iterable))
+
+
+def _iter_stage(name, iterator):
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def return_collapsed_stack(frame, thread_name):
+    """
+    Returns the stack of frame in the collapsed stack format, the
+    functions from the thread down to the frame, separated by ';':
+    MainThread;main (manage.py:7);execute (__init__.py:325);...
+    """
+    functions = []
+    while frame is not None:
+        code = frame.f_code
+        functions.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    functions.append(thread_name)
+    return ';'.join(reversed(functions))
+
+
+class CommandProfiler:
+    """
+    Profiles the with block with cProfile (the calling thread only),
+    and samples the stacks of all threads every interval seconds.
+
+    write() saves the cProfile stats as a pstats file, and the stack
+    samples in the collapsed stack format read by flame graph tools
+    (flamegraph.pl, speedscope, ...), one stack per line followed by
+    its number of samples.
+    """
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.profile = cProfile.Profile()
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(
+            target=self.sample_stacks, name='CommandProfiler', daemon=True)
+
+    def __enter__(self):
+        self._sampler.start()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+        self._stopped.set()
+        self._sampler.join()
+
+    def sample_stacks(self):
+        sampler_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            thread_names = {
+                thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != sampler_id:
+                    self.stacks[return_collapsed_stack(
+                        frame, thread_names.get(thread_id, str(thread_id)))] += 1
+
+    def write(self, pstats_path, collapsed_path):
+        self.profile.dump_stats(pstats_path)
+        with open(collapsed_path, 'w') as collapsed_file:
+            for stack, count in sorted(self.stacks.items()):
+                collapsed_file.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def query_budget(max_queries, using=DEFAULT_DB_ALIAS):
+    """
+    Raises AssertionError, listing the queries, when the with block
+    runs more than max_queries queries. For tests, so N+1 query
+    regressions fail loudly.
+    """
+    with CaptureQueriesContext(connections[using]) as context:
+        yield context
+    if len(context) > max_queries:
+        queries = '\n'.join(
+            f"{number}. {query['sql']}"
+            for number, query in enumerate(context.captured_queries, start=1))
+        raise AssertionError(
+            f"{len(context)} queries executed, the budget is {max_queries}:\n{queries}")
+
+
+class InstrumentedCommand(BaseCommand):
+    """
+    BaseCommand with the options:
+    --stats, to print the PipelineStats of the run,
+    --stats-json, to write them to a json file,
+    --trace-memory, to add the peak memory per stage and the top
+    allocation sites to them (printed without --stats-json),
+    --profile, to write a pstats file and a collapsed stack file.
+
+    Also sets the last success metric when the command finishes
+    without error, and saves the metrics (see common/metrics.py) under
+    the command's name, unless it was called by another command or
+    save_metrics_snapshot is False.
+    """
+    # False for commands whose runs aren't real work, e.g. benchmarks,
+    # so their metrics don't end up in the Prometheus endpoint
+    save_metrics_snapshot = True
+
+    def create_parser(self, prog_name, subcommand, **kwargs):
+        parser = super().create_parser(prog_name, subcommand, **kwargs)
+        parser.add_argument(
+            '--stats', action='store_true',
+            help="Print the time and queries per pipeline stage")
+        parser.add_argument(
+            '--stats-json', metavar='FILE',
+            help="Write the time and queries per pipeline stage to this json file")
+        parser.add_argument(
+            '--trace-memory', action='store_true',
+            help="Trace memory use with tracemalloc, report the peak per "
+                 "pipeline stage and the top allocation sites")
+        parser.add_argument(
+            '--profile', metavar='FILE',
+            help="Profile the run, write the pstats to FILE and the "
+                 "collapsed stacks, for flame graphs, to FILE.collapsed")
+        return parser
+
+    def execute(self, *args, **options):
+        global _running_commands
+        _running_commands += 1
+        try:
+            output = self.execute_instrumented(*args, **options)
+            metrics.last_success.labels().set(time.time())
+        finally:
+            _running_commands -= 1
+            if not _running_commands and self.save_metrics_snapshot:
+                self.save_metrics()
+        return output
+
+    def save_metrics(self):
+        job = self.__module__.rsplit('.', 1)[-1]
+        try:
+            metrics.registry.save_snapshot(job)
+        except DatabaseError as error:
+            self.stderr.write(f"Saving the metrics failed: {error}")
+
+    def execute_instrumented(self, *args, **options):
+        record_stats = (options.get('stats') or options.get('stats_json')
+                        or options.get('trace_memory'))
+        if not (record_stats or options.get('profile')):
+            return super().execute(*args, **options)
+
+        stats = PipelineStats(trace_memory=options['trace_memory'])
+        profiler = CommandProfiler() if options['profile'] else None
+        with ExitStack() as stack:
+            if record_stats:
+                stack.enter_context(stats)
+            if profiler is not None:
+                stack.enter_context(profiler)
+            output = super().execute(*args, **options)
+
+        if profiler is not None:
+            collapsed_path = f"{options['profile']}.collapsed"
+            profiler.write(options['profile'], collapsed_path)
+            self.stdout.write(
+                f"Profile written to {options['profile']} and {collapsed_path}")
+        if options['stats'] or (options['trace_memory'] and not options['stats_json']):
+            for line in stats.format_lines():
+                self.stdout.write(line)
+        if options['stats_json']:
+            with open(options['stats_json'], 'w') as stats_file:
+                json.dump(stats.as_dict(), stats_file, indent=4)
+        return output
@@ -0,0 +1,309 @@
+"""
+Metrics of the ingestion jobs: counters, gauges and histograms, served
+in the Prometheus text format by the metrics view.
+
+The jobs run in their own processes (cron, supervisor), not in the web
+server. Every process updates the metrics of the shared registry in
+memory, which only takes a lock and an addition. The commands save
+the registry to a MetricsSnapshot row per job when they finish, and
+the poll_exchange_rates command every METRICS_SNAPSHOT_INTERVAL
+seconds. Counters and histograms are added to the saved values, so
+they keep counting over cron runs; gauges are overwritten. The metrics
+view renders all snapshots, with the job as label.
+"""
+import bisect
+import json
+import threading
+import time
+
+from common.sqlite import write_atomic
+
+
+# Latency buckets, in seconds
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LAST_SUCCESS_NAME = 'crypto_prices_last_success_timestamp_seconds'
+LAST_SUCCESS_AGE_NAME = 'crypto_prices_last_success_age_seconds'
+
+
+class Metric:
+    """
+    A metric with a value per combination of label values. Use
+    labels() to get the value of one combination, e.g.
+    rows_inserted.labels('Currency').inc(10), or labels() without
+    arguments for metrics without labels. Keep the returned child
+    around on the hot path, it skips the label lookup.
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        # {label values: child}
+        self._children = {}
+
+    def labels(self, *labelvalues):
+        labelvalues = tuple(str(value) for value in labelvalues)
+        child = self._children.get(labelvalues)
+        if child is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError(
+                    f"{self.name} takes the labels {self.labelnames}, got {labelvalues}")
+            with self._lock:
+                child = self._children.setdefault(labelvalues, self.create_child())
+        return child
+
+    def create_child(self):
+        raise NotImplementedError
+
+    def return_values(self):
+        """
+        Returns {label values: value}, see the child's return_value.
+        """
+        with self._lock:
+            children = list(self._children.items())
+        return {labelvalues: child.return_value() for labelvalues, child in children}
+
+
+class CounterChild:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def return_value(self):
+        return self.value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def create_child(self):
+        return CounterChild()
+
+
+class GaugeChild(CounterChild):
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        self.value = value
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def create_child(self):
+        return GaugeChild()
+
+
+class HistogramChild:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # Not cumulative, the last one is for values above all buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.sum += value
+
+    def return_value(self):
+        """
+        Returns {'buckets': [count per bucket, not cumulative], 'sum': ...}
+        """
+        with self._lock:
+            return {'buckets': list(self.bucket_counts), 'sum': self.sum}
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def create_child(self):
+        return HistogramChild(self.buckets)
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = {}
+        # The values as last saved, to save only what changed since
+        self._saved_values = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def as_dict(self):
+        """
+        Returns the metrics in the format saved in MetricsSnapshot:
+        {
+            'crypto_prices_rows_inserted_total': {
+                'type': 'counter',
+                'documentation': 'Rows inserted, per model',
+                'labelnames': ['model'],
+                # label values as json lists
+                'values': {'["Currency"]': 12, ...},
+                'buckets': [0.01, ...],  # histograms only
+            },
+            ...
+        }
+        """
+        data = {}
+        for name, metric in self.metrics.items():
+            values = metric.return_values()
+            if not values:
+                continue
+            data[name] = {
+                'type': metric.type,
+                'documentation': metric.documentation,
+                'labelnames': list(metric.labelnames),
+                'values': {
+                    json.dumps(list(labelvalues)): value
+                    for labelvalues, value in values.items()
+                },
+            }
+            if metric.type == 'histogram':
+                data[name]['buckets'] = list(metric.buckets)
+        return data
+
+    def save_snapshot(self, job):
+        """
+        Adds the changes since the last save to the MetricsSnapshot of
+        job (see the module docstring).
+        """
+        from common.models import MetricsSnapshot
+
+        data = self.as_dict()
+        with write_atomic():
+            snapshot, _ = MetricsSnapshot.objects.select_for_update().get_or_create(job=job)
+            saved_data = snapshot.get_data()
+            for name, metric_data in data.items():
+                saved_metric_data = saved_data.setdefault(name, dict(metric_data, values={}))
+                saved_values = saved_metric_data['values']
+                for labels, value in metric_data['values'].items():
+                    previous = self._saved_values.get((job, name, labels))
+                    if metric_data['type'] == 'gauge' or labels not in saved_values:
+                        saved_values[labels] = value
+                    elif metric_data['type'] == 'counter':
+                        saved_values[labels] += value - (previous or 0)
+                    else:
+                        saved_value = saved_values[labels]
+                        previous = previous or {'buckets': [0] * len(value['buckets']), 'sum': 0.0}
+                        saved_value['buckets'] = [
+                            saved + current - before for saved, current, before
+                            in zip(saved_value['buckets'], value['buckets'], previous['buckets'])]
+                        saved_value['sum'] += value['sum'] - previous['sum']
+                    self._saved_values[(job, name, labels)] = value
+            snapshot.set_data(saved_data)
+            snapshot.save()
+
+
+def escape_label_value(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        f'{name}="{escape_label_value(value)}"' for name, value in labels) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def return_prometheus_text(snapshots, now=None):
+    """
+    Takes (job, data) tuples, data in the format of
+    MetricsRegistry.as_dict, returns the metrics in the Prometheus
+    text format, with a job label.
+
+    Also adds the age of every job's last success, from
+    crypto_prices_last_success_timestamp_seconds.
+    """
+    now = time.time() if now is None else now
+    # {name: (metric data, [(job, metric data), ...])}
+    metrics = {}
+    for job, data in snapshots:
+        for name, metric_data in data.items():
+            metrics.setdefault(name, (metric_data, []))[1].append((job, metric_data))
+
+    last_success = metrics.get(LAST_SUCCESS_NAME)
+    if last_success is not None:
+        metrics[LAST_SUCCESS_AGE_NAME] = (
+            {'type': 'gauge', 'documentation': "Seconds since the job last finished without error"},
+            [
+                (job, dict(metric_data, values={
+                    labels: now - value for labels, value in metric_data['values'].items()}))
+                for job, metric_data in last_success[1]
+            ])
+
+    lines = []
+    for name, (first_data, job_data) in sorted(metrics.items()):
+        lines.append(f"# HELP {name} {first_data['documentation']}")
+        lines.append(f"# TYPE {name} {first_data['type']}")
+        for job, metric_data in job_data:
+            labelnames = metric_data.get('labelnames', [])
+            for labels_json, value in sorted(metric_data['values'].items()):
+                labels = [('job', job)] + list(zip(labelnames, json.loads(labels_json)))
+                if metric_data['type'] != 'histogram':
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                    continue
+                cumulative = 0
+                for upper_bound, count in zip(metric_data['buckets'] + [float('inf')], value['buckets']):
+                    cumulative += count
+                    bucket_labels = labels + [('le', format_value(float(upper_bound)))]
+                    lines.append(f"{name}_bucket{format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(value['sum'])}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+rows_inserted = registry.counter(
+    'crypto_prices_rows_inserted_total', "Rows inserted, per model", ['model'])
+api_request_duration = registry.histogram(
+    'crypto_prices_api_request_duration_seconds',
+    "Duration of api requests (until the headers are received), per host",
+    ['host'])
+api_request_failures = registry.counter(
+    'crypto_prices_api_request_failures_total',
+    "Api requests that failed or got an error response, per host", ['host'])
+writer_queue_depth = registry.gauge(
+    'crypto_prices_writer_queue_depth',
+    "ExchangeRates waiting in the poller's queue to be saved")
+last_poll = registry.gauge(
+    'crypto_prices_last_poll_timestamp_seconds',
+    "Unix time of the last successful poll, per exchange", ['exchange'])
+last_success = registry.gauge(
+    LAST_SUCCESS_NAME, "Unix time the job last finished without error")
@@ -1,3 +1,27 @@
+import json
+
 from django.db import models
 
-# Create your models here.
+
+class MetricsSnapshot(models.Model):
+    """
+    The metrics of one job (e.g. a management command) as saved by
+    MetricsRegistry.save_snapshot, see common/metrics.py.
+    """
+    job = models.CharField(max_length=255, unique=True)
+    data = models.TextField(blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.job
+
+    def get_data(self):
+        if not self.data:
+            return {}
+        return json.loads(self.data)
+
+    def set_data(self, data):
+        self.data = json.dumps(data)
+
+    class Meta:
+        ordering = ['job']
@@ -0,0 +1,64 @@
+"""
+SQLite tuning for the ingestion jobs, which write to the same database
+file from several processes (the poller, cron syncs) while the web
+server reads it.
+
+set_sqlite_pragmas runs on every new SQLite connection and sets the
+pragmas in settings.SQLITE_PRAGMAS, by default:
+- journal_mode=WAL: readers read a snapshot and never wait for the
+  writer, and a writer doesn't wait for readers. Only writers still
+  take turns, waiting up to the connection's timeout (see
+  DATABASES['default']['OPTIONS']) instead of failing with "database
+  is locked" right away.
+- synchronous=NORMAL: with WAL only checkpoints are synced to disk,
+  not every commit. A power cut can lose the last commits, but never
+  corrupts the database.
+- mmap_size and cache_size: reads are served from memory.
+
+Many small transactions are what makes SQLite slow (each commit is a
+write of the WAL), so the commands write in as few transactions as
+they can: bulk_create inside one atomic block, and the poller writes
+all queued rates of its producers from a single db thread.
+
+The timeout only helps a transaction that waits for the write lock
+before it reads. Django starts atomic blocks with a deferred BEGIN, so
+a block that reads first holds a read snapshot, and if another process
+commits before the block's first write, that write fails right away
+with "database is locked" (SQLITE_BUSY_SNAPSHOT), whatever the
+timeout. Write transactions that read first therefore use write_atomic,
+which takes the write lock at the start of the block, like
+BEGIN IMMEDIATE.
+"""
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+
+def set_sqlite_pragmas(sender, connection, **kwargs):
+    """
+    connection_created receiver, connected in CommonConfig.ready.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@contextmanager
+def write_atomic(using=None):
+    """
+    transaction.atomic that takes the write lock before anything is
+    read (see the module docstring). Does nothing extra on other
+    db backends.
+    """
+    with transaction.atomic(using=using):
+        connection = transaction.get_connection(using)
+        if connection.vendor == 'sqlite':
+            # A write that changes no rows, but takes the write lock
+            # (waiting for the timeout) as the first statement. Any
+            # table will do, the lock is for the whole database.
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM django_migrations WHERE 0')
+        yield
@@ -1,3 +1,460 @@
-from django.test import TestCase
+import json
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import requests
+
+from django.contrib.auth.models import Group
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from common import http_client, metrics
+from common.api_recordings import ReplayMissingError, api_recording, read_index
+from common.instrumentation import PipelineStats, iter_stage, query_budget, return_collapsed_stack, stage
+from common.metrics import MetricsRegistry, return_prometheus_text
+from common.models import MetricsSnapshot
+from common.sqlite import write_atomic
+from common.utils import iter_json_array
+from cryptodata.management.commands.utils.benchmark_utils import return_fixture_payloads, serve_fixtures
+from cryptodata.models import Currency, CurrencyExchangePK
+
+
+class IterJsonArrayTestCase(SimpleTestCase):
+    def setUp(self):
+        self.items = [
+            {"asset_id": "BTC", "name": "Bitcoin", "data_trade_count": 4196037957},
+            {"asset_id": "EUR", "name": "Euro \u20ac", "type_is_crypto": 0},
+            [1, 2.5, None],
+            123,
+        ]
+        self.data = b'[\n  {"asset_id": "BTC", "name": "Bitcoin", ' \
+            b'"data_trade_count": 4196037957},\n' \
+            b'  {"asset_id": "EUR", "name": "Euro \xe2\x82\xac", "type_is_crypto": 0},' \
+            b' [1, 2.5, null], 123\n]\n'
+
+    def split(self, data, size):
+        return [data[i:i + size] for i in range(0, len(data), size)]
+
+    def test_iter_json_array(self):
+        """
+        Tests that all items are yielded, whatever the chunk size.
+
+        Small chunk sizes split items, numbers and multi byte
+        characters over several chunks.
+        """
+        for size in (1, 2, 7, 64, len(self.data)):
+            items = list(iter_json_array(self.split(self.data, size)))
+            self.assertEqual(items, self.items)
+
+    def test_iter_json_array_empty(self):
+        self.assertEqual(list(iter_json_array([b' [ ] '])), [])
+
+    def test_iter_json_array_invalid(self):
+        """
+        Tests that a non array payload (e.g. an api error message)
+        or a truncated array raises ValueError.
+        """
+        with self.assertRaises(ValueError):
+            list(iter_json_array([b'{"error": "Invalid API key"}']))
+        with self.assertRaises(ValueError):
+            list(iter_json_array(self.split(self.data[:-10], 5)))
+
+    def test_iter_json_array_commas(self):
+        """
+        Tests that missing, leading, trailing and repeated commas raise
+        ValueError, also when split over chunks.
+        """
+        for data in [b'[1 2]', b'[,1]', b'[1,]', b'[1,,2]', b'[,]', b'[{"a": 1}{"a": 2}]']:
+            for size in (1, len(data)):
+                with self.assertRaises(ValueError, msg=data):
+                    list(iter_json_array(self.split(data, size)))
+        self.assertEqual(list(iter_json_array(self.split(b'[1 , 2,\n3]', 1))), [1, 2, 3])
+
+
+@override_settings(HTTP_MAX_RETRIES=2)
+class HttpClientTestCase(SimpleTestCase):
+    url = 'https://api.example.com/0/public/Assets'
+
+    def setUp(self):
+        http_client.latency_stats.reset()
+        self.session = mock.Mock()
+        patchers = [
+            mock.patch.object(
+                http_client, 'get_session', return_value=self.session),
+            mock.patch.object(http_client.time, 'sleep'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def return_response(self, status_code, headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers.update(headers or {})
+        response._content = b'{"result": {}}'
+        response.raw = mock.Mock()
+        return response
+
+    def test_get_retries(self):
+        """
+        Tests that connection errors, 429 and 5xx responses are
+        retried, and that every attempt is recorded in latency_stats.
+        """
+        self.session.get.side_effect = [
+            requests.ConnectionError(),
+            self.return_response(429, {'Retry-After': '2'}),
+            self.return_response(200),
+        ]
+        self.assertEqual(http_client.get_json(self.url), {'result': {}})
+
+        self.assertEqual(self.session.get.call_count, 3)
+        http_client.time.sleep.assert_called_with(2.0)
+        stats = http_client.latency_stats.as_dict()['api.example.com']
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['failed'], 2)
+
+    def test_get_out_of_retries(self):
+        self.session.get.side_effect = [
+            self.return_response(503) for _ in range(3)]
+        with self.assertRaises(requests.HTTPError):
+            http_client.get(self.url)
+        self.assertEqual(self.session.get.call_count, 3)
+
+    def test_get_client_error_not_retried(self):
+        self.session.get.side_effect = [self.return_response(404)]
+        with self.assertRaises(requests.HTTPError):
+            http_client.get(self.url)
+        self.assertEqual(self.session.get.call_count, 1)
+
+
+class PipelineStatsTestCase(TestCase):
+    def test_stages(self):
+        """
+        Tests that queries and http time count for the innermost stage
+        only, and that time outside of any stage counts as 'other'.
+        """
+        with PipelineStats() as stats:
+            with stage('fetch'):
+                http_client.latency_stats.record('api.example.com', 0.5)
+                with stage('parse'):
+                    list(iter_stage('normalize', [1, 2, 3]))
+            with stage('write'):
+                Group.objects.create(name='group')
+                Group.objects.count()
+            Group.objects.count()
+
+        stages = stats.as_dict()['stages']
+        self.assertEqual(
+            list(stages), ['fetch', 'parse', 'normalize', 'write', 'other'])
+        self.assertEqual(stages['fetch']['http_time'], 0.5)
+        self.assertEqual(stages['parse']['http_time'], 0.0)
+        self.assertEqual(stages['normalize']['calls'], 4)
+        self.assertEqual(stages['write']['queries'], 2)
+        self.assertEqual(stages['other']['queries'], 1)
+        self.assertEqual(stats.as_dict()['total']['queries'], 3)
+
+    def test_not_recording(self):
+        items = [1, 2]
+        self.assertIs(iter_stage('parse', items), items)
+        with stage('write'):
+            Group.objects.count()
+
+    def test_query_budget(self):
+        with query_budget(1):
+            Group.objects.count()
+        with self.assertRaisesRegex(AssertionError, "2 queries executed, the budget is 1"):
+            with query_budget(1):
+                Group.objects.count()
+                Group.objects.count()
+
+    def test_command_stats(self):
+        with tempfile.TemporaryDirectory() as directory:
+            stats_path = os.path.join(directory, 'stats.json')
+            stdout = StringIO()
+            call_command(
+                'rollup_candles', stats=True, stats_json=stats_path,
+                stdout=stdout)
+            with open(stats_path) as stats_file:
+                stats = json.load(stats_file)
+
+        self.assertIn('other', stats['stages'])
+        self.assertGreater(stats['total']['queries'], 0)
+        self.assertIn('total', stdout.getvalue())
+
+    def test_trace_memory(self):
+        with PipelineStats(trace_memory=True) as stats:
+            with stage('parse'):
+                data = [str(number) * 10 for number in range(10000)]
+            del data
+
+        stats = stats.as_dict()
+        self.assertGreater(stats['stages']['parse']['peak_memory'], 10000 * 10)
+        self.assertEqual(
+            stats['total']['peak_memory'],
+            max(stage_stats['peak_memory'] for stage_stats in stats['stages'].values()))
+        self.assertEqual(stats['top_allocations'][0]['file'], __file__)
+
+    def test_command_profile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            profile_path = os.path.join(directory, 'rollup.prof')
+            call_command('rollup_candles', profile=profile_path, stdout=StringIO())
+
+            self.assertTrue(pstats.Stats(profile_path).total_calls)
+            with open(f'{profile_path}.collapsed') as collapsed_file:
+                for line in collapsed_file:
+                    stack, count = line.rsplit(' ', 1)
+                    self.assertTrue(stack.split(';')[0])
+                    self.assertGreater(int(count), 0)
+
+    def test_return_collapsed_stack(self):
+        stack = return_collapsed_stack(sys._getframe(), 'MainThread')
+        functions = stack.split(';')
+        self.assertEqual(functions[0], 'MainThread')
+        self.assertTrue(functions[-1].startswith('test_return_collapsed_stack (tests.py:'))
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.rows = self.registry.counter('rows_total', "Rows", ['model'])
+        self.depth = self.registry.gauge('queue_depth', "Queue depth")
+        self.latency = self.registry.histogram(
+            'latency_seconds', "Latency", ['host'], buckets=(0.1, 1))
+
+    def test_save_snapshot(self):
+        """
+        Tests that counters and histograms add up over several saves
+        and processes (registries), and that gauges are overwritten.
+        """
+        self.rows.labels('Currency').inc(2)
+        self.depth.labels().set(5)
+        self.latency.labels('api.kraken.com').observe(0.5)
+        self.registry.save_snapshot('sync')
+        self.rows.labels('Currency').inc(3)
+        self.registry.save_snapshot('sync')
+
+        next_run = MetricsRegistry()
+        next_run.counter('rows_total', "Rows", ['model']).labels('Currency').inc(10)
+        next_run.gauge('queue_depth', "Queue depth").labels().set(1)
+        next_run.histogram(
+            'latency_seconds', "Latency", ['host'], buckets=(0.1, 1)
+        ).labels('api.kraken.com').observe(2)
+        next_run.save_snapshot('sync')
+
+        data = MetricsSnapshot.objects.get(job='sync').get_data()
+        self.assertEqual(data['rows_total']['values'], {'["Currency"]': 15})
+        self.assertEqual(data['queue_depth']['values'], {'[]': 1})
+        self.assertEqual(
+            data['latency_seconds']['values']['["api.kraken.com"]'],
+            {'buckets': [0, 1, 1], 'sum': 2.5})
+
+    def test_return_prometheus_text(self):
+        self.rows.labels('Currency').inc(2)
+        self.latency.labels('api.kraken.com').observe(0.5)
+        data = self.registry.as_dict()
+        data[metrics.LAST_SUCCESS_NAME] = {
+            'type': 'gauge', 'documentation': "Last success",
+            'labelnames': [], 'values': {'[]': 100.0}}
+        text = return_prometheus_text([('sync', data)], now=130.0)
+
+        self.assertIn('# TYPE rows_total counter\nrows_total{job="sync",model="Currency"} 2\n', text)
+        self.assertIn('latency_seconds_bucket{job="sync",host="api.kraken.com",le="0.1"} 0\n', text)
+        self.assertIn('latency_seconds_bucket{job="sync",host="api.kraken.com",le="1.0"} 1\n', text)
+        self.assertIn('latency_seconds_bucket{job="sync",host="api.kraken.com",le="+Inf"} 1\n', text)
+        self.assertIn('latency_seconds_count{job="sync",host="api.kraken.com"} 1\n', text)
+        self.assertIn('crypto_prices_last_success_age_seconds{job="sync"} 30.0\n', text)
+
+    def test_view(self):
+        call_command('rollup_candles', stdout=StringIO())
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn(
+            'crypto_prices_last_success_timestamp_seconds{job="rollup_candles"}',
+            response.content.decode())
+
+
+class ApiRecordingTestCase(TestCase):
+    url = 'https://api.kraken.com/0/public/Assets'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.payloads = return_fixture_payloads(1)
+        self.session = http_client.get_session()
+
+    def test_record_and_replay(self):
+        for compression in ['zlib', 'lzma']:
+            with self.subTest(compression=compression):
+                directory = os.path.join(self.directory, compression)
+                with serve_fixtures(self.payloads), api_recording(
+                        record_directory=directory, compression=compression):
+                    self.session.get(self.url)
+                    self.session.get('https://example.com/')
+                entries = read_index(directory)
+                # The 404 isn't recorded
+                self.assertEqual([entry['url'] for entry in entries], [self.url])
+                self.assertTrue(entries[0]['file'].endswith(f'.{compression}'))
+
+                original_adapter = self.session.get_adapter('https://')
+                with api_recording(replay_directory=directory):
+                    response = self.session.get(self.url)
+                    self.assertEqual(response.json(), self.payloads[self.url])
+                    with self.assertRaises(ReplayMissingError):
+                        self.session.get('https://api.kraken.com/0/public/AssetPairs')
+                self.assertIs(self.session.get_adapter('https://'), original_adapter)
+
+    def test_invalid_options(self):
+        with self.assertRaises(CommandError):
+            with api_recording(self.directory, self.directory):
+                pass
+        with self.assertRaises(CommandError):
+            with api_recording(replay_directory=self.directory):
+                pass
+
+    def test_command(self):
+        """
+        A replayed run saves the same data as the recorded one, also
+        when the recorded run already saved it (replay implies --full).
+        """
+        with serve_fixtures(self.payloads):
+            call_command(
+                'save_coinapi_assets', record=self.directory, record_compression='lzma',
+                stdout=StringIO())
+        currency_count = Currency.objects.count()
+        self.assertGreater(currency_count, 0)
+        self.assertTrue(read_index(self.directory)[0]['file'].endswith('.lzma'))
+
+        Currency.objects.all().delete()
+        call_command('save_coinapi_assets', replay=self.directory, stdout=StringIO())
+        self.assertEqual(Currency.objects.count(), currency_count)
+
+    def test_exchange_currencies_command(self):
+        """
+        Replaying, and --full, handle all currencies again, not only the
+        ones that are new since the last run.
+        """
+        with serve_fixtures(self.payloads):
+            call_command('save_coinapi_assets', stdout=StringIO())
+            call_command(
+                'old_get_exchange_available_currencies', record=self.directory, stdout=StringIO())
+        key_count = CurrencyExchangePK.objects.count()
+        self.assertGreater(key_count, 0)
+
+        CurrencyExchangePK.objects.all().delete()
+        call_command(
+            'old_get_exchange_available_currencies', replay=self.directory, stdout=StringIO())
+        self.assertEqual(CurrencyExchangePK.objects.count(), key_count)
+
+        CurrencyExchangePK.objects.all().delete()
+        with serve_fixtures(self.payloads):
+            call_command('old_get_exchange_available_currencies', full=True, stdout=StringIO())
+        self.assertEqual(CurrencyExchangePK.objects.count(), key_count)
+
+
+class SqlitePragmasTestCase(SimpleTestCase):
+    def test_pragmas(self):
+        """
+        New connections use WAL and the other pragmas of
+        settings.SQLITE_PRAGMAS (the test database is in memory,
+        without a journal file, so use a file database).
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict = dict(
+                connection.settings_dict, NAME=os.path.join(directory, 'test.sqlite3'))
+            file_connection = DatabaseWrapper(settings_dict)
+            try:
+                with file_connection.cursor() as cursor:
+                    pragmas = {}
+                    for name in ['journal_mode', 'synchronous', 'cache_size']:
+                        cursor.execute(f'PRAGMA {name}')
+                        pragmas[name] = cursor.fetchone()[0]
+            finally:
+                file_connection.close()
+
+        # synchronous 1 is NORMAL
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'cache_size': -65536})
+
+
+class WriteAtomicTestCase(SimpleTestCase):
+    """
+    Two writers to one file database, like the poller and a sync
+    command in separate processes (the test database is in memory).
+    """
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_dict = dict(
+            connection.settings_dict, NAME=os.path.join(directory, 'test.sqlite3'),
+            OPTIONS={'timeout': 5})
+        patcher = mock.patch.dict(connections.databases, {'writers': settings_dict})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.close_connection)
+        with connections['writers'].cursor() as cursor:
+            # write_atomic takes the write lock on this table
+            cursor.execute('CREATE TABLE django_migrations (id integer PRIMARY KEY)')
+            cursor.execute('CREATE TABLE test_rows (writer text)')
+        self.errors = []
+
+    def close_connection(self):
+        # Connections are per thread
+        connections['writers'].close()
+        del connections._connections.writers
+
+    def write_other(self):
+        try:
+            with transaction.atomic(using='writers'):
+                with connections['writers'].cursor() as cursor:
+                    cursor.execute("INSERT INTO test_rows VALUES ('other')")
+        except Exception as error:
+            self.errors.append(error)
+        finally:
+            self.close_connection()
+
+    def write_after_read(self, atomic):
+        """
+        Reads, lets the other writer write, then writes.
+        """
+        other = threading.Thread(target=self.write_other)
+        with atomic(using='writers'):
+            with connections['writers'].cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM test_rows')
+                other.start()
+                # Returns early only if the other writer didn't wait
+                other.join(0.5)
+                cursor.execute("INSERT INTO test_rows VALUES ('main')")
+        other.join()
+
+    def return_writers(self):
+        with connections['writers'].cursor() as cursor:
+            cursor.execute('SELECT writer FROM test_rows')
+            return sorted(writer for writer, in cursor.fetchall())
+
+    def test_write_atomic(self):
+        """
+        The other writer waits until the transaction is committed,
+        then both writes succeed.
+        """
+        self.write_after_read(write_atomic)
+        self.assertEqual(self.errors, [])
+        self.assertEqual(self.return_writers(), ['main', 'other'])
+
+    def test_atomic_read_first(self):
+        """
+        Shows why write_atomic is needed: with a deferred BEGIN, a
+        write after another writer's commit fails without waiting.
+        """
+        with self.assertRaises(OperationalError):
+            self.write_after_read(transaction.atomic)
+        self.assertEqual(self.errors, [])
+        self.assertEqual(self.return_writers(), ['other'])
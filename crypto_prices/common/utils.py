@@ -1,3 +1,7 @@
+import codecs
+import json
+
+
 def check_if_dict_in_list(pk_key, test_pk_value, list_):
     """
     Takes a list of dictionaries, and the key and value of the value
@@ -29,3 +33,70 @@ def determine_str_or_int(variable):
         return 'int'
     else:
         return None
+
+
+def iter_json_array(chunks):
+    """
+    Takes an iterable of bytes chunks that together form one JSON
+    array, yields the items of that array one at a time.
+
+    Only the undecoded remainder of the current chunk is kept in
+    memory, so the complete array is never loaded at once.
+
+    Raises ValueError if the data isn't a (complete) JSON array,
+    including missing, leading or trailing commas.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    # What comes next: '[', the first item or ']', an item, or ',' or ']'
+    expected = 'array'
+
+    for chunk in chunks:
+        buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\n\r':
+                position += 1
+            if position == len(buffer):
+                break
+            character = buffer[position]
+
+            if expected == 'array':
+                if character != '[':
+                    raise ValueError(
+                        f"Expected a JSON array, got: {buffer[position:position + 80]}")
+                expected = 'first item'
+                position += 1
+                continue
+
+            if expected == 'separator':
+                if character == ']':
+                    return
+                if character != ',':
+                    raise ValueError(
+                        f"Expected ',' or ']', got: {buffer[position:position + 80]}")
+                expected = 'item'
+                position += 1
+                continue
+
+            if character == ']' and expected == 'first item':
+                return
+            if character in ',]':
+                raise ValueError(
+                    f"Expected a JSON value, got: {buffer[position:position + 80]}")
+
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Item continues in the next chunk
+                break
+            if end == len(buffer):
+                # A number could continue in the next chunk
+                break
+            yield item
+            position = end
+            expected = 'separator'
+
+    raise ValueError("JSON array ended unexpectedly")
@@ -1,3 +1,21 @@
-from django.shortcuts import render
+from django.http import HttpResponse
 
-# Create your views here.
+from common.metrics import registry, return_prometheus_text
+from common.models import MetricsSnapshot
+
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def metrics(request):
+    """
+    Returns the metrics saved by the jobs, and those of this process
+    (as job "web"), in the Prometheus text format.
+    """
+    snapshots = [
+        (snapshot.job, snapshot.get_data())
+        for snapshot in MetricsSnapshot.objects.all()
+    ]
+    snapshots.append(('web', registry.as_dict()))
+    return HttpResponse(
+        return_prometheus_text(snapshots), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -81,9 +81,23 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': {
+            # Seconds a writer waits for another process's write to
+            # finish, before failing with "database is locked"
+            'timeout': 30,
+        },
     }
 }
 
+# Pragmas set on every new SQLite connection, see common/sqlite.py
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 2 ** 20,
+    # Negative means kibibytes instead of pages
+    'cache_size': -64 * 2 ** 10,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -133,3 +147,37 @@ EXCHANGES = [
 
 # api key for coinapi.io
 COINAPI_KEY = os.environ['COINAPI_KEY']
+
+# HTTP client used for all api calls, see common/http_client.py
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 30
+HTTP_MAX_RETRIES = 4
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_BACKOFF_MAX = 30
+HTTP_POOL_CONNECTIONS = 10
+HTTP_POOL_MAXSIZE = 10
+
+# Seconds between two polls of an exchange's ticker endpoint,
+# see the poll_exchange_rates command
+EXCHANGE_POLL_INTERVALS = {
+    'Binance': 5,
+    'Bittrex': 10,
+    'Kraken': 10,
+}
+
+# In-process cache of the latest bid/ask per pair, see
+# pricedata/latest_prices.py
+LATEST_PRICE_CACHE_TTL = 2
+LATEST_PRICE_CACHE_SIZE = 100000
+
+# Currency conversion, see pricedata/conversion.py. Currencies (ticker
+# symbols) every currency can be converted to, exchanges whose pairs
+# are preferred (most preferred first), and seconds between checks
+# whether the trading pairs changed.
+CONVERSION_QUOTE_CURRENCIES = ['EUR', 'USD']
+CONVERSION_EXCHANGE_PREFERENCE = ['Kraken', 'Binance', 'Bittrex']
+CONVERSION_INDEX_CHECK_INTERVAL = 60
+
+# Seconds between two saves of the metrics by long running jobs (the
+# poll_exchange_rates command), see common/metrics.py
+METRICS_SNAPSHOT_INTERVAL = 15
@@ -14,8 +14,12 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path
+
+from common import views as common_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics/', common_views.metrics, name='metrics'),
+    path('prices/', include('pricedata.urls')),
 ]
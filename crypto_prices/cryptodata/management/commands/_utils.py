@@ -1,4 +1,5 @@
 import random
+from concurrent.futures import ThreadPoolExecutor
 
 from cryptodata.models import CurrencyExchangePK
 
@@ -23,6 +24,38 @@ def return_currency_instance_from_exchange_pk(exchange_pk, exchange_instance):
     return None
 
 
+class CurrencyExchangePKResolver:
+    """
+    Resolves the keys (pks) an exchange uses for its currencies to
+    Currency instances.
+
+    The complete key -> Currency mapping of the exchange is loaded
+    with one query on creation, after that lookups are answered from
+    a dict. Keys that can't be resolved are collected in
+    unresolved_keys, so they can be reported all at once.
+    """
+
+    def __init__(self, exchange_instance):
+        self.exchange_instance = exchange_instance
+        self.unresolved_keys = set()
+        exchange_pk_instances = CurrencyExchangePK.objects.filter(
+            exchange=exchange_instance).select_related('currency')
+        self.currencies = {
+            exchange_pk_instance.key: exchange_pk_instance.currency
+            for exchange_pk_instance in exchange_pk_instances
+        }
+
+    def resolve(self, exchange_pk):
+        """
+        Returns the currency instance for exchange_pk, or None if
+        none can be found.
+        """
+        currency_instance = self.currencies.get(exchange_pk)
+        if currency_instance is None:
+            self.unresolved_keys.add(exchange_pk)
+        return currency_instance
+
+
 def return_randomized_indexes_for_model(model):
     model_instances = model.objects.all()
     model_instances_count = model_instances.count()
@@ -31,3 +64,22 @@ def return_randomized_indexes_for_model(model):
         range(model_instances_count-1), model_instances_count-1)
 
     return random_indexes
+
+
+def fetch_exchanges_data(fetch_function, exchange_names, concurrency=1):
+    """
+    Calls fetch_function(exchange_name) for each exchange, returns
+    the results in a dict with the exchange names as keys, in the
+    order of exchange_names.
+
+    With a concurrency above 1 the exchanges are fetched in parallel,
+    using that many threads. fetch_function should only do network
+    calls, not touch the db, so the results can be written to the db
+    afterwards in exactly the same way as when fetched one by one.
+    """
+    if concurrency <= 1:
+        return {name: fetch_function(name) for name in exchange_names}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = executor.map(fetch_function, exchange_names)
+        return dict(zip(exchange_names, results))
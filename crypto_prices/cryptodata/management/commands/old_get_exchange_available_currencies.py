@@ -1,41 +1,144 @@
-import csv
-import json
-import os
-
-import requests
-
 from django.conf import settings
-from django.core.management.base import BaseCommand
 
-from cryptodata.models import Currency, CurrencyExchangePK, Exchange, TickerSymbol
+from common import http_client, metrics
+from common.api_recordings import ApiRecordingCommandMixin
+from common.instrumentation import InstrumentedCommand, stage
+from common.sqlite import write_atomic
+from cryptodata.management.commands.utils.api_snapshot_utils import clear_snapshot_validators, fetch_json_if_changed, return_api_snapshots
+from cryptodata.management.commands.utils.currency_name_utils import CurrencyNameResolver
+from cryptodata.management.commands.utils.sync_currencies_utils import sync_exchange_currencies
+from cryptodata.models import Exchange
 
-from ._utils import determine_str_or_int
+from ._utils import fetch_exchanges_data
 
 
-class Command(BaseCommand):
+class Command(ApiRecordingCommandMixin, InstrumentedCommand):
     help = """
     Fetches all available currencies from the exchanges listed in
     settings.EXCHANGES, and saves them to the database, including the 
-    CurrencyExchangePK and TickerSymbol of each currency.
+    CurrencyExchangePK and ticker symbol of each currency.
+
+    Currencies whose name can't be determined are skipped and
+    reported, see --unresolved-names and --currency-names.
+
+    Only currencies that are new since the last run are handled, and
+    exchanges whose data didn't change at all are skipped.
+
+    Use --record DIR to save the exchanges' responses, and --replay DIR
+    to use them again instead of the network (always handling all
+    currencies).
     """
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help="Number of exchanges to fetch in parallel (default: 1)")
+        parser.add_argument(
+            '--unresolved-names', metavar='FILE',
+            help="Write the currencies whose name is unknown to this csv")
+        parser.add_argument(
+            '--currency-names', metavar='FILE',
+            help="Csv with currency names, as written by --unresolved-names "
+                 "with the names filled in")
+        parser.add_argument(
+            '--full', action='store_true',
+            help="Handle all currencies, also those handled on earlier runs")
+
     def handle(self, *args, **options):
-        for exchange_name in settings.EXCHANGES:
-            self.handle_exchange(exchange_name)
+        self.currency_name_resolver = CurrencyNameResolver(
+            options['currency_names'])
+        snapshots = return_api_snapshots(
+            [self.return_snapshot_source(exchange_name)
+             for exchange_name in settings.EXCHANGES],
+            options['full'] or options['replay'])
+
+        def fetch_exchange_data(exchange_name):
+            snapshot = snapshots[self.return_snapshot_source(exchange_name)]
+            return self.return_available_currency_data(exchange_name, snapshot)
+        all_exchanges_currencies_data = fetch_exchanges_data(
+            fetch_exchange_data, settings.EXCHANGES, options['concurrency'])
 
-    def handle_exchange(self, exchange_name):
+        for exchange_name in settings.EXCHANGES:
+            self.handle_exchange(
+                exchange_name, all_exchanges_currencies_data[exchange_name],
+                snapshots[self.return_snapshot_source(exchange_name)])
+
+        unresolved = self.currency_name_resolver.unresolved
+        if unresolved:
+            unresolved_symbols = ', '.join(
+                f"{ticker_symbol} ({exchange_name})"
+                for exchange_name, ticker_symbol in sorted(unresolved))
+            self.stdout.write(
+                f"Skipped currencies with unknown name: {unresolved_symbols}")
+        if options['unresolved_names']:
+            self.currency_name_resolver.write_unresolved_names(
+                options['unresolved_names'])
+
+        for line in http_client.latency_stats.format_lines():
+            self.stdout.write(line)
+
+    def handle_exchange(self, exchange_name, all_currencies_data, snapshot):
         """
         Adds exchange to db, if it doesn't exist already. And adds
-        all of the exchange's available currencies to the db,
-        including the CurrencyExchangePK and TickerSymbol.
+        the exchange's available currencies (as fetched with
+        return_available_currency_data) that are new since the
+        snapshot to the db, including the CurrencyExchangePK and
+        ticker symbol.
+
+        Saves the keys of all handled currencies in the snapshot. All
+        of it in one transaction, with a fixed number of queries (see
+        sync_exchange_currencies).
         """
-        exchange_instance = self.add_update_exchange_model(exchange_name)
-        self.add_exchange_available_currencies_to_db(exchange_instance)
+        if all_currencies_data is None:
+            self.stdout.write(
+                f"{exchange_name}: unchanged since last sync, skipped")
+            return
+
+        previous_keys = snapshot.get_keys()
+        current_keys = {
+            self.return_currency_data_key(exchange_name, currency_data)
+            for currency_data in all_currencies_data
+        }
+        formatted_currencies_data, added_keys = self.return_exchange_currencies_data(
+            exchange_name, all_currencies_data, previous_keys)
+        with write_atomic():
+            exchange_instance = self.add_update_exchange_model(exchange_name)
+            _, new_currencies = sync_exchange_currencies(
+                exchange_instance, formatted_currencies_data)
+            for ticker_symbol, currency_name in new_currencies:
+                self.currency_name_resolver.add(ticker_symbol, currency_name)
+
+            synced_keys = (previous_keys & current_keys) | added_keys
+            if synced_keys != current_keys:
+                # Retry the currencies with an unknown name on the next run
+                clear_snapshot_validators(snapshot)
+            snapshot.set_keys(synced_keys)
+            snapshot.save()
+
+        self.stdout.write(
+            f"{exchange_name}: {len(added_keys)} new, "
+            f"{len(previous_keys - current_keys)} no longer listed")
+
+    def return_currency_data_key(self, exchange_name, currency_data):
+        if exchange_name == 'Binance':
+            return currency_data['symbol']
+        if exchange_name == 'Bittrex':
+            return currency_data['Currency']
+        if exchange_name == 'Kraken':
+            return currency_data
 
-    def add_exchange_available_currencies_to_db(self, exchange_instance):
+    @stage('normalize')
+    def return_exchange_currencies_data(self, exchange_name, all_currencies_data, skip_keys=()):
         """
-        Method responsible for adding the data of all currencies
-        available on specific exchange to the database.
+        Method responsible for formatting the data of all currencies
+        available on specific exchange, to be saved with
+        sync_exchange_currencies.
+
+        Currencies whose key (see return_currency_data_key) is in
+        skip_keys are skipped, as are currencies with an unknown
+        name. Returns the formatted data (see
+        return_formatted_currency_data) and the keys of the currencies
+        that aren't skipped.
 
         BINANCE SPECIFIC INFO:
         As you will see in the code below, Binance data is handled
@@ -49,10 +152,13 @@ class Command(BaseCommand):
         which does not apply to Bittrex and Kraken, I need to split up
         the data for each asset, and than handle it.
         """
-        exchange_name = exchange_instance.name
-        all_currencies_data = self.return_available_currency_data(
-            exchange_name)
+        formatted_currencies_data = []
+        added_keys = set()
         for currency_data in all_currencies_data:
+            key = self.return_currency_data_key(exchange_name, currency_data)
+            if key in skip_keys:
+                continue
+
             if exchange_name == 'Binance':
                 # For binance, one instance of currency_data will
                 # cointain two different currencies to add.
@@ -62,36 +168,25 @@ class Command(BaseCommand):
                 # versions -> put them in list together.
                 formatted_and_split_data = self.return_binance_formatted_data(
                     currency_data)
-                # 2) call self.add_currency on each (use for loop)
-                for binance_currency_data in formatted_and_split_data:
-                    self.add_currency(all_currencies_data,
-                                      binance_currency_data, exchange_instance, exchange_name)
+                # 2) keep the currencies with a known name, the pair
+                # counts as added only if both are known
+                known_currencies_data = [
+                    binance_currency_data
+                    for binance_currency_data in formatted_and_split_data
+                    if binance_currency_data['currency_name']
+                ]
+                formatted_currencies_data.extend(known_currencies_data)
+                if len(known_currencies_data) == len(formatted_and_split_data):
+                    added_keys.add(key)
             else:
-                self.add_currency(all_currencies_data,
-                                  currency_data, exchange_instance, exchange_name)
+                formatted_crrncy_data = self.return_formatted_currency_data(
+                    all_currencies_data, currency_data, exchange_name)
+                # Unknown names are reported at the end of the run
+                if formatted_crrncy_data['currency_name']:
+                    formatted_currencies_data.append(formatted_crrncy_data)
+                    added_keys.add(key)
 
-    def add_currency(self, all_currencies_data, currency_data, exchange_instance, exchange_name):
-        if exchange_name == 'Binance':
-            formatted_crrncy_data = currency_data
-        else:
-            formatted_crrncy_data = self.return_formatted_currency_data(
-                all_currencies_data, currency_data, exchange_name)
-
-        currency_name = formatted_crrncy_data['currency_name']
-        currency_instance = self.add_update_currency_to_db(
-            currency_name, exchange_instance
-        )
-
-        currency_exchange_pk = formatted_crrncy_data['currency_exchange_pk']
-        self.add_update_currency_exchange_pk_to_db(
-            currency_instance,
-            exchange_instance,
-            currency_exchange_pk
-        )
-
-        ticker_symbol = formatted_crrncy_data['ticker_symbol']
-        self.add_update_ticker_symbol_to_db(
-            currency_name, currency_instance, ticker_symbol)
+        return formatted_currencies_data, added_keys
 
     def return_formatted_currency_data(self, all_currencies_data, currency_data, exchange_name):
         """
@@ -145,10 +240,18 @@ class Command(BaseCommand):
             'ticker_symbol': ticker_symbol,
         }
 
-    def return_available_currency_data(self, exchange_name):
+    def return_snapshot_source(self, exchange_name):
+        return f'currencies:{exchange_name}'
+
+    def return_available_currency_data(self, exchange_name, snapshot):
+        """
+        Returns the raw currencies data of the exchange, or None if it
+        didn't change since the snapshot was saved.
+        """
         url = self.get_exchange_url(exchange_name)
-        response = requests.get(url)
-        parsed_response = json.loads(response.text)
+        parsed_response = fetch_json_if_changed(url, snapshot)
+        if parsed_response is None:
+            return None
 
         if exchange_name == 'Binance':
             currency_data = parsed_response['symbols']
@@ -167,106 +270,14 @@ class Command(BaseCommand):
 
     def get_currency_name(self, exchange_name, ticker_symbol, currency_exchange_pk=None):
         """
-        Returns currency name.
-
-        First tries to get it from the DB, based on ticker symbol,
-        if not found, tries to get it from the user
-        """
-
-        ticker_symbol_instance_queryset = TickerSymbol.objects.filter(
-            symbol=ticker_symbol)
-
-        if ticker_symbol_instance_queryset.exists():
-            ticker_symbol_instance = ticker_symbol_instance_queryset[0]
-            currency_name = ticker_symbol_instance.currency.name
-            return currency_name
-        if exchange_name == 'Binance':
-            name = self.get_binance_currency_name(currency_exchange_pk)
-            if name:
-                return name
-        if exchange_name == 'Kraken':
-            name = self.get_kraken_currency_name(currency_exchange_pk)
-            if name:
-                return name
-
-        return self.get_currency_name_from_user(exchange_name, ticker_symbol)
-
-    def get_binance_currency_name(self, currency_exchange_pk):
-        if currency_exchange_pk == 'BQX':
-            return 'Ethos'
-        if currency_exchange_pk == 'MATIC':
-            return 'Matic Network'
-        if currency_exchange_pk == 'VET':
-            return 'Vechain'
-        if currency_exchange_pk == 'YOYO':
-            return 'YOYOW'
-
-        return None
-
-    def get_kraken_currency_name(self, currency_exchange_pk):
-        file_path = os.path.join(
-            settings.BASE_DIR, 'cryptodata/management/commands/utils/kraken_asset_code_to_name.csv')
-
-        with open(file_path) as csv_file:
-            csv_reader = csv.reader(csv_file, delimiter=',')
-            next(csv_reader)
-            for row in csv_reader:
-                asset_code = row[0]
-                asset_name = row[1]
-                if asset_code == currency_exchange_pk:
-                    return asset_name
-
-        return None
-
-    def get_currency_name_from_user(self, exchange_name, ticker_symbol):
-
-        while True:
-            user_input = input(f"""\n
-            {exchange_name} doesn't provide a name for the currency
-            with the following ticker symbol:
-
-            {ticker_symbol}
-
-            please provide the name of the currency:
-
-            input name > 
-            """)
-            if user_input:
-                return user_input
-            else:
-                print("\nNo input detected, please try again.\n")
+        Returns currency name, or None if it can't be determined.
 
-    def add_update_currency_to_db(self, currency_name, exchange_instance):
+        See CurrencyNameResolver.resolve.
         """
-        Adds or updates one currency in db.
-        """
-        currency_instance_queryset = Currency.objects.filter(
-            name=currency_name)
-
-        if currency_instance_queryset.exists():
-            currency_instance = currency_instance_queryset[0]
-        else:
-            currency_instance = Currency()
-            currency_instance.name = currency_name
-            currency_instance.save()
-
-        currency_instance.exchanges.add(exchange_instance)
-
-        return currency_instance
-
-    def add_update_currency_exchange_pk_to_db(self, currency_instance, exchange_instance, key):
-        # Should filter on key + related exchange combo
-        currency_exchange_pk_instance_queryset = CurrencyExchangePK.objects.filter(
-            key=key).filter(exchange__exact=exchange_instance)
-
-        if not currency_exchange_pk_instance_queryset.exists():
-            new_instance = CurrencyExchangePK()
-            new_instance.currency = currency_instance
-            new_instance.exchange = exchange_instance
-            new_instance.key = key
-            new_instance.key_type = determine_str_or_int(key).upper()
-            new_instance.save()
+        return self.currency_name_resolver.resolve(
+            exchange_name, ticker_symbol, currency_exchange_pk)
 
+    @stage('write')
     def add_update_exchange_model(self, exchange_name):
         """
         Checks if instance for current exchange exists, if not it adds it.
@@ -279,15 +290,6 @@ class Command(BaseCommand):
             instance = Exchange()
             instance.name = exchange_name
             instance.save()
+            metrics.rows_inserted.labels('Exchange').inc()
 
         return instance
-
-    def add_update_ticker_symbol_to_db(self, currency_name, currency_instance, ticker_symbol):
-        ticker_symbol_queryset = TickerSymbol.objects.filter(
-            symbol=ticker_symbol)
-
-        if not ticker_symbol_queryset.exists():
-            new_instance = TickerSymbol()
-            new_instance.currency = currency_instance
-            new_instance.symbol = ticker_symbol
-            new_instance.save()
@@ -1,46 +1,119 @@
-import json
-import requests
-
 from django.conf import settings
-from django.core.management.base import BaseCommand
 
-from cryptodata.models import Currency, Exchange, TradingPair, TradingPairExchangePK
+from common import http_client
+from common.api_recordings import ApiRecordingCommandMixin
+from common.instrumentation import InstrumentedCommand, stage
+from cryptodata.management.commands.utils.api_snapshot_utils import clear_snapshot_validators, fetch_json_if_changed, return_api_snapshots
+from cryptodata.management.commands.utils.sync_trading_pairs_utils import sync_exchange_trading_pairs
+from cryptodata.models import Exchange
 
-from ._utils import determine_str_or_int, return_currency_instance_from_exchange_pk
+from ._utils import CurrencyExchangePKResolver, fetch_exchanges_data
 
 
-class Command(BaseCommand):
+class Command(ApiRecordingCommandMixin, InstrumentedCommand):
     help = """
     Fetches all available trading pairs for each of the
     exchanges in the Django main settings, and saves each
     trading pair to the database.
 
     Besides the pair, also saves the pair's key that is being
-    used for the exchange's api.
+    used for the exchange's api. Pairs and keys that an exchange no
+    longer lists are removed from that exchange.
+
+    Exchanges whose data didn't change since the last run are skipped.
+
+    Use --record DIR to save the exchanges' responses, and --replay DIR
+    to use them again instead of the network (always syncing all
+    exchanges).
     """
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help="Number of exchanges to fetch in parallel (default: 1)")
+        parser.add_argument(
+            '--full', action='store_true',
+            help="Sync all exchanges, also when their data didn't change")
+
     def handle(self, *args, **kwargs):
+        snapshots = return_api_snapshots(
+            [self.return_snapshot_source(exchange_name)
+             for exchange_name in settings.EXCHANGES],
+            kwargs['full'] or kwargs['replay'])
+
+        # Fetch raw trading pairs data of all exchanges (that changed)
+        def fetch_exchange_data(exchange_name):
+            snapshot = snapshots[self.return_snapshot_source(exchange_name)]
+            return self.return_api_pair_data(exchange_name, snapshot)
+        all_exchanges_raw_data = fetch_exchanges_data(
+            fetch_exchange_data, settings.EXCHANGES, kwargs['concurrency'])
 
         for exchange_name in settings.EXCHANGES:
+            all_pair_raw_data = all_exchanges_raw_data[exchange_name]
+            if all_pair_raw_data is None:
+                self.stdout.write(
+                    f"{exchange_name}: unchanged since last sync, skipped")
+                continue
+
             exchange_instance = Exchange.objects.get(name=exchange_name)
-            # Fetch raw trading pairs data of current exchange
-            all_pair_raw_data = self.return_api_pair_data(exchange_name)
-            # Loop over each pair (raw data)
-            for raw_pair_data in all_pair_raw_data:
-                # Standardize data format
-                formatted_pair_data = self.standardize_pair_data_format(
-                    all_pair_raw_data, exchange_name, raw_pair_data)
-                # Save / update TradingPair to DB
-                trading_pair_instance = self.save_trading_pair(
-                    formatted_pair_data)
-                # Save / update TradingPairExchangePK to DB
-                self.save_trading_pair_exchange_pk(
-                    exchange_instance, formatted_pair_data, trading_pair_instance)
-
-    def return_api_pair_data(self, exchange_name):
+            exchange_resolver = CurrencyExchangePKResolver(exchange_instance)
+            formatted_pairs_data = []
+            skipped_keys = []
+            with stage('normalize'):
+                # Loop over each pair (raw data)
+                for raw_pair_data in all_pair_raw_data:
+                    # Standardize data format
+                    formatted_pair_data = self.standardize_pair_data_format(
+                        all_pair_raw_data, exchange_resolver, raw_pair_data)
+                    # Pairs with unknown currencies are reported below,
+                    # and kept as they are in the db
+                    if not (formatted_pair_data['currency1_instance'] and
+                            formatted_pair_data['currency2_instance']):
+                        skipped_keys.append(formatted_pair_data['exchange_pk'])
+                        continue
+                    formatted_pairs_data.append(formatted_pair_data)
+
+            # Save / update / prune TradingPair, TradingPair.exchanges
+            # and TradingPairExchangePK in DB
+            counts = sync_exchange_trading_pairs(
+                exchange_instance, formatted_pairs_data, skipped_keys)
+            self.stdout.write(
+                f"{exchange_name}: {counts['pairs_created']} pairs created, "
+                f"{counts['exchange_links_added']} pairs added, "
+                f"{counts['exchange_links_removed']} pairs removed, "
+                f"{counts['exchange_pks_added']} keys added, "
+                f"{counts['exchange_pks_removed']} keys removed")
+
+            if exchange_resolver.unresolved_keys:
+                unresolved_keys = ', '.join(
+                    sorted(exchange_resolver.unresolved_keys))
+                self.stdout.write(
+                    f"{exchange_name}: skipped pairs with unknown currency "
+                    f"keys: {unresolved_keys}")
+
+            snapshot = snapshots[self.return_snapshot_source(exchange_name)]
+            if exchange_resolver.unresolved_keys:
+                # Retry these pairs on the next run
+                clear_snapshot_validators(snapshot)
+            snapshot.set_keys(
+                pair_data['exchange_pk'] for pair_data in formatted_pairs_data)
+            snapshot.save()
+
+        for line in http_client.latency_stats.format_lines():
+            self.stdout.write(line)
+
+    def return_snapshot_source(self, exchange_name):
+        return f'trading_pairs:{exchange_name}'
+
+    def return_api_pair_data(self, exchange_name, snapshot):
+        """
+        Returns the raw trading pairs data of the exchange, or None if
+        it didn't change since the snapshot was saved.
+        """
         endpoint = self.return_api_endpoint(exchange_name)
-        response = requests.get(endpoint)
-        parsed_response = json.loads(response.text)
+        parsed_response = fetch_json_if_changed(endpoint, snapshot)
+        if parsed_response is None:
+            return None
 
         if exchange_name == 'Binance':
             all_pair_raw_data = parsed_response['symbols']
@@ -57,7 +130,7 @@ class Command(BaseCommand):
         if exchange_name == 'Kraken':
             return 'https://api.kraken.com/0/public/AssetPairs'
 
-    def standardize_pair_data_format(self, all_pair_raw_data, exchange_name, raw_data):
+    def standardize_pair_data_format(self, all_pair_raw_data, exchange_resolver, raw_data):
         """
         Formats the raw data into the format shown below,
         then returns the formatted data.
@@ -69,107 +142,60 @@ class Command(BaseCommand):
             'exchange_pk': ...,
         }
         """
-        exchange_instance = Exchange.objects.get(name=exchange_name)
+        exchange_name = exchange_resolver.exchange_instance.name
         if exchange_name == 'Binance':
             formatted_data = self.standardize_binance_data(
-                exchange_instance, raw_data)
+                exchange_resolver, raw_data)
         if exchange_name == 'Bittrex':
             formatted_data = self.standardize_bittrex_data(
-                exchange_instance, raw_data)
+                exchange_resolver, raw_data)
         if exchange_name == 'Kraken':
             pair_key = raw_data
             formatted_data = self.standardize_kraken_data(
-                all_pair_raw_data, exchange_instance, pair_key)
+                all_pair_raw_data, exchange_resolver, pair_key)
 
         return formatted_data
 
-    def standardize_binance_data(self, exchange_instance, raw_data):
+    def standardize_binance_data(self, exchange_resolver, raw_data):
         currency1_exchange_pk = raw_data['baseAsset']
         currency2_exchange_pk = raw_data['quoteAsset']
-        currency1_instance = return_currency_instance_from_exchange_pk(
-            currency1_exchange_pk, exchange_instance)
-        currency2_instance = return_currency_instance_from_exchange_pk(
-            currency2_exchange_pk, exchange_instance)
+        currency1_instance = exchange_resolver.resolve(currency1_exchange_pk)
+        currency2_instance = exchange_resolver.resolve(currency2_exchange_pk)
         exchange_pk = raw_data['symbol']
 
         formatted_data = {
             'currency1_instance': currency1_instance,
             'currency2_instance': currency2_instance,
-            'exchange_instance': exchange_instance,
+            'exchange_instance': exchange_resolver.exchange_instance,
             'exchange_pk': exchange_pk,
         }
         return formatted_data
 
-    def standardize_bittrex_data(self, exchange_instance, raw_data):
+    def standardize_bittrex_data(self, exchange_resolver, raw_data):
         currency1_exchange_pk = raw_data['MarketCurrency']
         currency2_exchange_pk = raw_data['BaseCurrency']
-        currency1_instance = return_currency_instance_from_exchange_pk(
-            currency1_exchange_pk, exchange_instance)
-        currency2_instance = return_currency_instance_from_exchange_pk(
-            currency2_exchange_pk, exchange_instance)
+        currency1_instance = exchange_resolver.resolve(currency1_exchange_pk)
+        currency2_instance = exchange_resolver.resolve(currency2_exchange_pk)
         exchange_pk = raw_data['MarketName']
 
         formatted_data = {
             'currency1_instance': currency1_instance,
             'currency2_instance': currency2_instance,
-            'exchange_instance': exchange_instance,
+            'exchange_instance': exchange_resolver.exchange_instance,
             'exchange_pk': exchange_pk,
         }
         return formatted_data
 
-    def standardize_kraken_data(self, all_pair_raw_data, exchange_instance, pair_key):
+    def standardize_kraken_data(self, all_pair_raw_data, exchange_resolver, pair_key):
         currency1_exchange_pk = all_pair_raw_data[pair_key]['base']
         currency2_exchange_pk = all_pair_raw_data[pair_key]['quote']
-        currency1_instance = return_currency_instance_from_exchange_pk(
-            currency1_exchange_pk, exchange_instance)
-        currency2_instance = return_currency_instance_from_exchange_pk(
-            currency2_exchange_pk, exchange_instance)
+        currency1_instance = exchange_resolver.resolve(currency1_exchange_pk)
+        currency2_instance = exchange_resolver.resolve(currency2_exchange_pk)
         exchange_pk = pair_key
         formatted_data = {
             'currency1_instance': currency1_instance,
             'currency2_instance': currency2_instance,
-            'exchange_instance': exchange_instance,
+            'exchange_instance': exchange_resolver.exchange_instance,
             'exchange_pk': exchange_pk,
         }
         return formatted_data
-
-    def save_trading_pair(self, trading_pair_data):
-        currency1_instance = trading_pair_data['currency1_instance']
-        currency2_instance = trading_pair_data['currency2_instance']
-        exchange_instance = trading_pair_data['exchange_instance']
-        trading_pair = None
-        try:
-            trading_pair = TradingPair.objects.get(
-                currency1=currency1_instance.id, currency2=currency2_instance.id)
-        except TradingPair.DoesNotExist:
-            pass
-
-        if trading_pair:
-            trading_pair.exchanges.add(exchange_instance)
-            return trading_pair
-        else:
-            new_instance = TradingPair()
-            new_instance.currency1 = currency1_instance
-            new_instance.currency2 = currency2_instance
-            new_instance.save()
-            new_instance.exchanges.add(exchange_instance)
-
-            return new_instance
-
-    def save_trading_pair_exchange_pk(self, exchange_instance, trading_pair_data, trading_pair_instance):
-        key = trading_pair_data['exchange_pk']
-        exchange_pk_instance = None
-        try:
-            exchange_pk_instance = TradingPairExchangePK.objects.get(
-                exchange=exchange_instance.id, key=key, trading_pair=trading_pair_instance.id)
-        except TradingPairExchangePK.DoesNotExist:
-            pass
-
-        if not exchange_pk_instance:
-            new_instance = TradingPairExchangePK()
-            new_instance.trading_pair = trading_pair_instance
-            new_instance.exchange = exchange_instance
-            new_instance.key = key
-            key_type = determine_str_or_int(key)
-            new_instance.key_type = key_type.upper()
-            new_instance.save()
@@ -3,12 +3,12 @@ import json
 import requests
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
 
+from common.instrumentation import InstrumentedCommand
 from cryptodata.models import Currency, TickerSymbol
 
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = """
     Adds the currencies available at coinapi.io to the database.
     """
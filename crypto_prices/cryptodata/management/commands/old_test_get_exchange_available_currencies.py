@@ -2,14 +2,14 @@ from unittest import TestCase
 
 from django.conf import settings
 from django.core.management import call_command
-from django.core.management.base import BaseCommand
 
+from common.instrumentation import InstrumentedCommand
 from cryptodata.models import Currency, CurrencyExchangePK, Exchange, TickerSymbol
 
 from ._utils import return_randomized_indexes_for_model
 
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = """
     Since I will be adding new exchanges to the
     get_exchange_available_currencies management command,
@@ -1,13 +1,13 @@
 from django.conf import settings
 from django.core.management import call_command
-from django.core.management.base import BaseCommand
 
+from common.instrumentation import InstrumentedCommand
 from cryptodata.models import TradingPair, TradingPairExchangePK
 
 from ._utils import return_randomized_indexes_for_model
 
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = """
     Tests if save_available_trading_pairs does what is should
     do.
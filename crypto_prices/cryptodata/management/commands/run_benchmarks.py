@@ -0,0 +1,80 @@
+import json
+import platform
+from datetime import datetime
+
+import django
+from django.core.management.base import CommandError
+from django.db import connection
+
+from common.instrumentation import InstrumentedCommand
+from cryptodata.management.commands.utils.benchmark_utils import compare_results, format_result, run_benchmarks
+
+
+class Command(InstrumentedCommand):
+    help = """
+    Benchmarks the ingestion commands (save_coinapi_assets,
+    old_get_exchange_available_currencies and
+    old_save_available_trading_pairs) against recorded api responses,
+    on a throwaway test database, without network access.
+
+    Reports per command and scale the wall time, rows per second,
+    query count and peak memory, and writes them as json to --output,
+    to compare with later runs using --compare.
+
+    The metrics of the benchmarked commands aren't saved, they'd show
+    up as real ingestion otherwise.
+    """
+    save_metrics_snapshot = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales', default='1,10,100',
+            help="Comma separated fixture sizes, multiples of the "
+                 "recorded data (default: 1,10,100)")
+        parser.add_argument(
+            '--output', metavar='FILE',
+            help="Write the results to this json file "
+                 "(default: benchmark-<time>.json)")
+        parser.add_argument(
+            '--compare', metavar='FILE',
+            help="Print the changes compared to an earlier results file")
+        parser.add_argument(
+            '--no-memory', action='store_true',
+            help="Don't measure peak memory, which slows the commands down")
+
+    def handle(self, *args, **options):
+        try:
+            scales = [int(scale) for scale in options['scales'].split(',')]
+        except ValueError:
+            raise CommandError("--scales should be comma separated integers")
+        previous_results = None
+        if options['compare']:
+            with open(options['compare']) as results_file:
+                previous_results = json.load(results_file)['results']
+
+        started = datetime.now()
+        old_database_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = run_benchmarks(
+                scales, measure_memory=not options['no_memory'])
+        finally:
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+
+        for result in results:
+            self.stdout.write(format_result(result))
+        if previous_results is not None:
+            self.stdout.write(f"Compared to {options['compare']}:")
+            for line in compare_results(previous_results, results):
+                self.stdout.write(line)
+
+        output = options['output'] or f"benchmark-{started:%Y%m%d-%H%M%S}.json"
+        with open(output, 'w') as results_file:
+            json.dump({
+                'started': started.isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'results': results,
+            }, results_file, indent=4)
+        self.stdout.write(f"Results written to {output}")
@@ -1,18 +1,43 @@
-from django.core.management.base import BaseCommand
+from common import http_client
+from common.api_recordings import ApiRecordingCommandMixin
+from common.instrumentation import InstrumentedCommand
+from cryptodata.management.commands.utils.api_snapshot_utils import return_api_snapshots
+from cryptodata.management.commands.utils.save_coinapi_assets_utils import bulk_create_currencies, iter_coinapi_currency_data
 
-from cryptodata.management.commands.utils.save_coinapi_assets_utils import create_currency, fetch_coinapi_currency_data
 
-
-class Command(BaseCommand):
+class Command(ApiRecordingCommandMixin, InstrumentedCommand):
     help = """
     Adds the currencies available at coinapi.io to the database.
+
+    Skipped when coinapi reports the assets didn't change since the
+    last run.
+
+    Use --record DIR to save the coinapi response, and --replay DIR to
+    use it again instead of the network (always handling all assets).
     """
+    snapshot_source = 'coinapi_assets'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help="Fetch the assets, also when they didn't change")
 
     def handle(self, *args, **kwargs):
-        # Fetch coinapi data -> return in useful format
-        currencies_data = fetch_coinapi_currency_data()
-        for currency_data in currencies_data:
-            if 'name' not in currency_data:
-                continue
-            # Add Currency instance to db
-            create_currency(currency_data)
+        snapshot = return_api_snapshots(
+            [self.snapshot_source],
+            kwargs['full'] or kwargs['replay'])[self.snapshot_source]
+        # Stream coinapi data, one asset dict at a time
+        currencies_data = iter_coinapi_currency_data(snapshot=snapshot)
+        # Add the missing Currency instances to db in bulk, batches
+        # are written while the download is still in progress
+        counts = bulk_create_currencies(currencies_data)
+        if any(counts.values()):
+            self.stdout.write(
+                f"{counts['inserted']} inserted, {counts['unchanged']} unchanged, "
+                f"{counts['skipped']} skipped")
+            snapshot.save()
+        else:
+            self.stdout.write("Unchanged since last sync, skipped")
+
+        for line in http_client.latency_stats.format_lines():
+            self.stdout.write(line)
@@ -0,0 +1,87 @@
+import hashlib
+import json
+
+from common import http_client
+from common.instrumentation import stage
+from cryptodata.models import ApiSnapshot
+
+
+def return_api_snapshots(sources, full=False):
+    """
+    Returns a dict with an ApiSnapshot for each source, with the
+    sources as keys. Sources that were never synced get a new, unsaved,
+    empty snapshot. If full is True all snapshots are emptied (their
+    validators and keys), so everything is fetched and handled again.
+    """
+    snapshots = {
+        snapshot.source: snapshot
+        for snapshot in ApiSnapshot.objects.filter(source__in=sources)
+    }
+    if full:
+        for snapshot in snapshots.values():
+            clear_snapshot_validators(snapshot)
+            snapshot.set_keys(set())
+    for source in sources:
+        if source not in snapshots:
+            snapshots[source] = ApiSnapshot(source=source)
+    return snapshots
+
+
+def return_conditional_headers(snapshot, headers=None):
+    """
+    Returns headers, extended with the If-None-Match and
+    If-Modified-Since headers for the snapshot's ETag and
+    Last-Modified values.
+    """
+    conditional_headers = dict(headers or {})
+    if snapshot.etag:
+        conditional_headers['If-None-Match'] = snapshot.etag
+    if snapshot.last_modified:
+        conditional_headers['If-Modified-Since'] = snapshot.last_modified
+    return conditional_headers
+
+
+def update_snapshot_validators(snapshot, response):
+    """
+    Copies the response's ETag and Last-Modified values to the
+    snapshot (without saving it).
+    """
+    snapshot.etag = response.headers.get('ETag', '')
+    snapshot.last_modified = response.headers.get('Last-Modified', '')
+
+
+def clear_snapshot_validators(snapshot):
+    """
+    Makes sure the next run fetches and processes the source again,
+    e.g. because some records couldn't be processed this time.
+    """
+    snapshot.etag = ''
+    snapshot.last_modified = ''
+    snapshot.content_hash = ''
+
+
+def fetch_json_if_changed(url, snapshot, headers=None):
+    """
+    Fetches url, returns the parsed json, or None if the data didn't
+    change since the snapshot was saved. Either because the server
+    answered 304 Not Modified, or because the content hash is the same.
+
+    Doesn't touch the db, so it can be used from fetch threads. The
+    snapshot's ETag, Last-Modified and content hash are updated in
+    memory, save the snapshot once the data has been processed.
+    """
+    with stage('fetch'):
+        response = http_client.get(
+            url, headers=return_conditional_headers(snapshot, headers))
+        if response.status_code == 304:
+            return None
+        content = response.content
+
+    with stage('parse'):
+        content_hash = hashlib.sha256(content).hexdigest()
+        unchanged = content_hash == snapshot.content_hash
+        update_snapshot_validators(snapshot, response)
+        snapshot.content_hash = content_hash
+        if unchanged:
+            return None
+        return json.loads(response.text)
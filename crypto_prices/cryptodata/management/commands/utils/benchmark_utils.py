@@ -0,0 +1,277 @@
+"""
+Hermetic benchmarks of the ingestion commands, see the run_benchmarks
+command.
+
+The api responses come from the json files in benchmark_fixtures (in
+the format of the Binance, Bittrex, Kraken and coinapi.io responses),
+served by FixtureAdapter, a requests transport adapter mounted on the
+shared http client session, so nothing goes over the network. For
+scale n the fixtures are blown up synthetically to n times the
+currencies and pairs.
+"""
+import io
+import json
+import os
+import time
+import tracemalloc
+
+import requests
+from requests.adapters import BaseAdapter
+
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection
+
+from common import http_client
+from common.instrumentation import PipelineStats, QueryCounter
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'benchmark_fixtures')
+
+# The commands benchmarked, in the order they depend on each other,
+# with the arguments to process all data on every run
+BENCHMARK_COMMANDS = [
+    ('save_coinapi_assets', ['--full']),
+    ('old_get_exchange_available_currencies', ['--full']),
+    ('old_save_available_trading_pairs', ['--full']),
+]
+
+
+def return_scaled_id(value, copy):
+    """
+    Returns the id of a currency or pair in the given synthetic copy
+    of the fixtures (copy 0 being the original).
+    """
+    return value if copy == 0 else f'{value}{copy}'
+
+
+def scale_coinapi_assets(payload, scale):
+    return [
+        dict(asset, asset_id=return_scaled_id(asset['asset_id'], copy),
+             name=asset['name'] if copy == 0 else f"{asset['name']} {copy}")
+        for copy in range(scale) for asset in payload
+    ]
+
+
+def scale_binance_exchange_info(payload, scale):
+    symbols = []
+    for copy in range(scale):
+        for symbol in payload['symbols']:
+            base = return_scaled_id(symbol['baseAsset'], copy)
+            symbols.append(dict(
+                symbol, baseAsset=base, symbol=base + symbol['quoteAsset']))
+    return dict(payload, symbols=symbols)
+
+
+def scale_bittrex_markets(payload, scale):
+    markets = []
+    for copy in range(scale):
+        for market in payload['result']:
+            market_currency = return_scaled_id(market['MarketCurrency'], copy)
+            markets.append(dict(
+                market, MarketCurrency=market_currency,
+                MarketName=f"{market['BaseCurrency']}-{market_currency}"))
+    return dict(payload, result=markets)
+
+
+def scale_bittrex_currencies(payload, scale):
+    return dict(payload, result=[
+        dict(currency, Currency=return_scaled_id(currency['Currency'], copy),
+             CurrencyLong=currency['CurrencyLong'] if copy == 0 else
+             f"{currency['CurrencyLong']} {copy}")
+        for copy in range(scale) for currency in payload['result']
+    ])
+
+
+def scale_kraken_assets(payload, scale):
+    return dict(payload, result={
+        return_scaled_id(key, copy): dict(
+            asset, altname=return_scaled_id(asset['altname'], copy))
+        for copy in range(scale) for key, asset in payload['result'].items()
+    })
+
+
+def scale_kraken_asset_pairs(payload, scale):
+    pairs = {}
+    for copy in range(scale):
+        for pair in payload['result'].values():
+            base = return_scaled_id(pair['base'], copy)
+            pairs[base + pair['quote']] = dict(pair, base=base)
+    return dict(payload, result=pairs)
+
+
+# {url: (fixture file, function that scales its payload)}
+FIXTURES = {
+    'https://rest.coinapi.io/v1/assets': (
+        'coinapi_assets.json', scale_coinapi_assets),
+    'https://api.binance.com/api/v1/exchangeInfo': (
+        'binance_exchange_info.json', scale_binance_exchange_info),
+    'https://api.bittrex.com/api/v1.1/public/getmarkets': (
+        'bittrex_markets.json', scale_bittrex_markets),
+    'https://api.bittrex.com/api/v1.1/public/getcurrencies': (
+        'bittrex_currencies.json', scale_bittrex_currencies),
+    'https://api.kraken.com/0/public/Assets': (
+        'kraken_assets.json', scale_kraken_assets),
+    'https://api.kraken.com/0/public/AssetPairs': (
+        'kraken_asset_pairs.json', scale_kraken_asset_pairs),
+}
+
+
+def return_fixture_payloads(scale=1):
+    """
+    Returns the parsed fixtures, scaled, in the format {url: payload}.
+    """
+    payloads = {}
+    for url, (file_name, scale_payload) in FIXTURES.items():
+        with open(os.path.join(FIXTURES_DIR, file_name)) as fixture_file:
+            payloads[url] = scale_payload(json.load(fixture_file), scale)
+    return payloads
+
+
+class FixtureAdapter(BaseAdapter):
+    """
+    requests transport adapter that answers requests with the payload
+    of their url (ignoring the query string) as json, or 404 for urls
+    without a payload.
+    """
+
+    def __init__(self, payloads):
+        super().__init__()
+        self.bodies = {
+            url: json.dumps(payload).encode()
+            for url, payload in payloads.items()
+        }
+        self.request_count = 0
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        self.request_count += 1
+        body = self.bodies.get(request.url.split('?')[0])
+        response = requests.Response()
+        response.status_code = 200 if body is not None else 404
+        response.reason = 'OK' if body is not None else 'Not Found'
+        response.headers['Content-Type'] = 'application/json'
+        response.encoding = 'utf-8'
+        response.raw = io.BytesIO(body or b'')
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def serve_fixtures(payloads):
+    """
+    Answers all requests of the shared http client with FixtureAdapter
+    while in the with block.
+    """
+    return http_client.use_adapter(FixtureAdapter(payloads))
+
+
+def count_rows(app_label='cryptodata'):
+    return sum(
+        model.objects.count()
+        for model in apps.get_app_config(app_label).get_models()
+    )
+
+
+def benchmark_command(command_name, args, measure_memory=True):
+    """
+    Runs one command, returns its measurements in the format:
+    {
+        'command': 'save_coinapi_assets',
+        'wall_time': 1.23,  # seconds
+        'rows': 1700,  # rows added to the cryptodata tables
+        'rows_per_second': 1382.1,
+        'queries': 12,
+        'query_time': 0.05,  # seconds
+        'http_requests': 1,
+        'peak_memory': 1234567,  # bytes allocated by Python, or None
+        'stages': {...},  # see PipelineStats.as_dict
+    }
+    """
+    rows_before = count_rows()
+    query_counter = QueryCounter()
+    http_client.latency_stats.reset()
+    if measure_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(query_counter), PipelineStats() as stats:
+            call_command(command_name, *args, stdout=io.StringIO())
+        wall_time = time.perf_counter() - start
+        peak_memory = tracemalloc.get_traced_memory()[1] if measure_memory else None
+    finally:
+        if measure_memory:
+            tracemalloc.stop()
+
+    rows = count_rows() - rows_before
+    return {
+        'command': command_name,
+        'wall_time': wall_time,
+        'rows': rows,
+        'rows_per_second': rows / wall_time if wall_time else None,
+        'queries': query_counter.count,
+        'query_time': query_counter.duration,
+        'http_requests': sum(
+            host_stats['requests']
+            for host_stats in http_client.latency_stats.as_dict().values()),
+        'peak_memory': peak_memory,
+        'stages': stats.as_dict()['stages'],
+    }
+
+
+def run_benchmarks(scales, measure_memory=True):
+    """
+    Runs all BENCHMARK_COMMANDS, for each scale on an empty database,
+    returns the measurements of benchmark_command, with the scale
+    added.
+
+    Flushes the database, so only use it on a test database.
+    """
+    results = []
+    for scale in scales:
+        call_command('flush', interactive=False, verbosity=0)
+        with serve_fixtures(return_fixture_payloads(scale)):
+            for command_name, args in BENCHMARK_COMMANDS:
+                result = benchmark_command(command_name, args, measure_memory)
+                result['scale'] = scale
+                results.append(result)
+    return results
+
+
+def format_result(result):
+    line = (
+        f"{result['command']} x{result['scale']}: "
+        f"{result['wall_time']:.3f}s, {result['rows']} rows "
+        f"({result['rows_per_second'] or 0:.0f}/s), "
+        f"{result['queries']} queries ({result['query_time']:.3f}s)")
+    if result['peak_memory'] is not None:
+        line += f", peak {result['peak_memory'] / 2 ** 20:.1f}MB"
+    return line
+
+
+def compare_results(previous_results, results):
+    """
+    Returns lines with the change of wall time, queries and peak memory
+    of each benchmark, compared to the same command and scale in
+    previous_results.
+    """
+    previous = {
+        (result['command'], result['scale']): result
+        for result in previous_results
+    }
+    lines = []
+    for result in results:
+        previous_result = previous.get((result['command'], result['scale']))
+        if previous_result is None:
+            continue
+        changes = []
+        for key in ['wall_time', 'queries', 'peak_memory']:
+            if result[key] is None or not previous_result.get(key):
+                continue
+            changes.append(
+                f"{key} {(result[key] / previous_result[key] - 1):+.1%}")
+        lines.append(
+            f"{result['command']} x{result['scale']}: {', '.join(changes)}")
+    return lines
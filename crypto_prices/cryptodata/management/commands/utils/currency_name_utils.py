@@ -0,0 +1,111 @@
+import csv
+import os
+
+from django.conf import settings
+
+from cryptodata.models import Currency
+
+
+BINANCE_CURRENCY_NAMES = {
+    'BQX': 'Ethos',
+    'MATIC': 'Matic Network',
+    'VET': 'Vechain',
+    'YOYO': 'YOYOW',
+}
+
+KRAKEN_ASSET_CODE_TO_NAME_FILE = os.path.join(
+    settings.BASE_DIR, 'cryptodata/management/commands/utils/kraken_asset_code_to_name.csv')
+
+UNRESOLVED_NAMES_FIELDS = [
+    'exchange', 'ticker_symbol', 'currency_exchange_pk', 'name']
+
+
+class CurrencyNameResolver:
+    """
+    Resolves the names of currencies that exchanges only give a
+    ticker symbol or key for.
+
+    The known currencies (from the db), the Kraken asset code csv and
+    the hard coded Binance names are loaded once into dicts, so each
+    lookup is a dict lookup. Names that can't be resolved are
+    collected in unresolved instead of asked from the user, they can
+    be written to a csv with write_unresolved_names. After filling in
+    the names in that csv, it can be passed as extra_names_file on the
+    next run.
+    """
+
+    def __init__(self, extra_names_file=None):
+        self.names_by_ticker_symbol = {}
+        for ticker_symbol, name in Currency.objects.order_by(
+                'id').values_list('ticker_symbol', 'name'):
+            self.names_by_ticker_symbol.setdefault(ticker_symbol, name)
+
+        self.names_by_exchange_pk = {
+            'Binance': dict(BINANCE_CURRENCY_NAMES),
+            'Kraken': self.load_kraken_currency_names(),
+        }
+        if extra_names_file:
+            self.load_extra_names(extra_names_file)
+
+        # {(exchange_name, ticker_symbol): currency_exchange_pk}
+        self.unresolved = {}
+
+    def load_kraken_currency_names(self):
+        with open(KRAKEN_ASSET_CODE_TO_NAME_FILE) as csv_file:
+            csv_reader = csv.reader(csv_file, delimiter=',')
+            next(csv_reader)
+            return {row[0]: row[1] for row in csv_reader}
+
+    def load_extra_names(self, file_path):
+        """
+        Adds the names from a csv in the format written by
+        write_unresolved_names. Rows without a name are ignored.
+        """
+        with open(file_path) as csv_file:
+            for row in csv.DictReader(csv_file):
+                if not row['name']:
+                    continue
+                exchange_names = self.names_by_exchange_pk.setdefault(
+                    row['exchange'], {})
+                exchange_names[row['currency_exchange_pk']] = row['name']
+
+    def resolve(self, exchange_name, ticker_symbol, currency_exchange_pk=None):
+        """
+        Returns currency name.
+
+        First tries the known currencies, based on ticker symbol, then
+        the exchange specific names, based on the currency's exchange
+        pk. Returns None if not found, and adds the currency to
+        unresolved.
+        """
+        name = self.names_by_ticker_symbol.get(ticker_symbol)
+        if name:
+            return name
+
+        name = self.names_by_exchange_pk.get(
+            exchange_name, {}).get(currency_exchange_pk)
+        if name:
+            return name
+
+        self.unresolved[(exchange_name, ticker_symbol)] = currency_exchange_pk
+        return None
+
+    def add(self, ticker_symbol, name):
+        """
+        Registers a currency that was added to the db after loading.
+        """
+        self.names_by_ticker_symbol.setdefault(ticker_symbol, name)
+
+    def write_unresolved_names(self, file_path):
+        with open(file_path, 'w', newline='') as csv_file:
+            csv_writer = csv.DictWriter(
+                csv_file, fieldnames=UNRESOLVED_NAMES_FIELDS)
+            csv_writer.writeheader()
+            for (exchange_name, ticker_symbol), currency_exchange_pk in sorted(
+                    self.unresolved.items()):
+                csv_writer.writerow({
+                    'exchange': exchange_name,
+                    'ticker_symbol': ticker_symbol,
+                    'currency_exchange_pk': currency_exchange_pk,
+                    'name': '',
+                })
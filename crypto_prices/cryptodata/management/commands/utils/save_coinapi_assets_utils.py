@@ -1,11 +1,18 @@
-import json
-import requests
+from contextlib import closing
 
 from django.conf import settings
 
+from common import http_client, metrics
+from common.instrumentation import iter_stage, stage
+from common.utils import iter_json_array
+from cryptodata.management.commands.utils.api_snapshot_utils import return_conditional_headers, update_snapshot_validators
 from cryptodata.models import Currency, Exchange
 
 
+BULK_CREATE_BATCH_SIZE = 500
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
 def create_currency(currency_data):
     currency_name = currency_data['name']
     ticker_symbol = currency_data['asset_id']
@@ -25,6 +32,63 @@ def create_currency(currency_data):
     return instance
 
 
+def bulk_create_currencies(currencies_data, batch_size=BULK_CREATE_BATCH_SIZE):
+    """
+    Adds every currency in currencies_data that isn't in the db yet,
+    using a constant number of queries instead of one per asset.
+
+    The existing (name, ticker_symbol) keys are loaded once, the
+    missing currencies are collected in memory and written with
+    bulk_create in batches of batch_size. Every batch is committed on
+    its own, so no write transaction stays open while currencies_data
+    is still being downloaded, blocking other writers. A failed run
+    leaves the batches written so far, the next run skips those.
+
+    Returns the counts per outcome:
+    {
+        'inserted': ...,   # new Currency rows
+        'unchanged': ...,  # already in the db
+        'skipped': ...,    # no name, or a duplicate within currencies_data
+    }
+    """
+    counts = {'inserted': 0, 'unchanged': 0, 'skipped': 0}
+    existing_keys = set(
+        Currency.objects.values_list('name', 'ticker_symbol'))
+    new_keys = set()
+    batch = []
+
+    with stage('normalize'):
+        for currency_data in currencies_data:
+            if 'name' not in currency_data:
+                counts['skipped'] += 1
+                continue
+
+            key = (currency_data['name'], currency_data['asset_id'])
+            if key in existing_keys:
+                counts['unchanged'] += 1
+                continue
+            if key in new_keys:
+                counts['skipped'] += 1
+                continue
+
+            new_keys.add(key)
+            batch.append(Currency(name=key[0], ticker_symbol=key[1]))
+            if len(batch) >= batch_size:
+                with stage('write'):
+                    Currency.objects.bulk_create(batch)
+                metrics.rows_inserted.labels('Currency').inc(len(batch))
+                counts['inserted'] += len(batch)
+                batch = []
+
+        if batch:
+            with stage('write'):
+                Currency.objects.bulk_create(batch)
+            metrics.rows_inserted.labels('Currency').inc(len(batch))
+            counts['inserted'] += len(batch)
+
+    return counts
+
+
 def fetch_coinapi_currency_data():
     """
     Fetches data from coinapi api, returns that data.
@@ -54,6 +118,32 @@ def fetch_coinapi_currency_data():
     """
     url = 'https://rest.coinapi.io/v1/assets'
     headers = {'X-CoinAPI-Key': settings.COINAPI_KEY}
-    response = requests.get(url, headers=headers)
-    currencydata = json.loads(response.text)
+    currencydata = http_client.get_json(url, headers=headers)
     return currencydata
+
+
+def iter_coinapi_currency_data(chunk_size=STREAM_CHUNK_SIZE, snapshot=None):
+    """
+    Streaming version of fetch_coinapi_currency_data.
+
+    Reads the response body in chunks of chunk_size bytes and yields
+    one asset dict at a time (same format as above), so the assets
+    can be handled while the download is still in progress.
+
+    If an ApiSnapshot is given, its ETag and Last-Modified values are
+    sent along, and nothing is yielded when coinapi answers 304 Not
+    Modified. Otherwise the snapshot's values are updated (not saved).
+    """
+    url = 'https://rest.coinapi.io/v1/assets'
+    headers = {'X-CoinAPI-Key': settings.COINAPI_KEY}
+    if snapshot is not None:
+        headers = return_conditional_headers(snapshot, headers)
+    with stage('fetch'):
+        response = http_client.get(url, headers=headers, stream=True)
+    with closing(response):
+        if response.status_code == 304:
+            return
+        if snapshot is not None:
+            update_snapshot_validators(snapshot, response)
+        chunks = iter_stage('fetch', response.iter_content(chunk_size))
+        yield from iter_stage('parse', iter_json_array(chunks))
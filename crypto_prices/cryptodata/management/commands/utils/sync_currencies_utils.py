@@ -0,0 +1,145 @@
+from common import metrics
+from common.instrumentation import stage
+from common.sqlite import write_atomic
+from common.utils import determine_str_or_int
+from cryptodata.models import Currency, CurrencyExchangePK
+
+
+BULK_CREATE_BATCH_SIZE = 500
+
+
+@stage('write')
+def sync_exchange_currencies(exchange_instance, formatted_currencies_data):
+    """
+    Adds the currencies of one exchange to the db, using a fixed number
+    of queries instead of several per currency.
+
+    formatted_currencies_data is a list of dicts in the format returned
+    by the return_formatted_currency_data method of the
+    old_get_exchange_available_currencies command, with a known
+    currency_name.
+
+    Currencies are matched on name. The existing currencies, exchange
+    links and CurrencyExchangePKs are loaded once, the missing ones
+    are written with bulk_create, inside one transaction. Existing
+    rows are left as they are. The first currency listed wins for
+    duplicate names and keys.
+
+    Returns the counts per change, and the (ticker_symbol, name) of
+    the created currencies:
+    (
+        {
+            'currencies_created': ...,
+            'exchange_links_added': ...,
+            'exchange_pks_added': ...,
+        },
+        [(ticker_symbol, name), ...],
+    )
+    """
+    ticker_symbol_by_name = {}
+    name_by_key = {}
+    for currency_data in formatted_currencies_data:
+        ticker_symbol_by_name.setdefault(
+            currency_data['currency_name'], currency_data['ticker_symbol'])
+        name_by_key.setdefault(
+            currency_data['currency_exchange_pk'], currency_data['currency_name'])
+
+    with write_atomic():
+        currency_ids, new_currencies = save_missing_currencies(
+            ticker_symbol_by_name)
+        links_added = save_missing_currency_exchanges(
+            exchange_instance,
+            {currency_ids[name] for name in ticker_symbol_by_name})
+        exchange_pks_added = save_missing_currency_exchange_pks(
+            exchange_instance,
+            {key: currency_ids[name] for key, name in name_by_key.items()})
+
+    metrics.rows_inserted.labels('Currency').inc(len(new_currencies))
+    metrics.rows_inserted.labels('CurrencyExchangePK').inc(exchange_pks_added)
+
+    counts = {
+        'currencies_created': len(new_currencies),
+        'exchange_links_added': links_added,
+        'exchange_pks_added': exchange_pks_added,
+    }
+    return counts, new_currencies
+
+
+def return_currency_ids():
+    """
+    Returns a dict of all currencies, in the format:
+    {name: currency_id}, the oldest currency for duplicate names.
+    """
+    currency_ids = {}
+    for currency_id, name in Currency.objects.order_by('id').values_list('id', 'name'):
+        currency_ids.setdefault(name, currency_id)
+    return currency_ids
+
+
+def save_missing_currencies(ticker_symbol_by_name):
+    """
+    Takes a dict in the format {name: ticker_symbol}, adds the
+    currencies whose name doesn't exist yet.
+
+    Returns the ids of all currencies (see return_currency_ids) and
+    the (ticker_symbol, name) of the created currencies.
+    """
+    currency_ids = return_currency_ids()
+    new_currencies = [
+        (ticker_symbol, name)
+        for name, ticker_symbol in ticker_symbol_by_name.items()
+        if name not in currency_ids
+    ]
+    if not new_currencies:
+        return currency_ids, new_currencies
+
+    Currency.objects.bulk_create(
+        [Currency(name=name, ticker_symbol=ticker_symbol)
+         for ticker_symbol, name in new_currencies],
+        batch_size=BULK_CREATE_BATCH_SIZE)
+    # bulk_create doesn't set the ids on every db backend (e.g. SQLite)
+    return return_currency_ids(), new_currencies
+
+
+def save_missing_currency_exchanges(exchange_instance, currency_ids):
+    """
+    Adds exchange_instance to the Currency.exchanges of the currencies
+    in currency_ids that don't have it yet.
+
+    Returns the number of added links.
+    """
+    through_model = Currency.exchanges.through
+    existing_currency_ids = set(through_model.objects.filter(
+        exchange=exchange_instance).values_list('currency', flat=True))
+
+    new_currency_ids = currency_ids - existing_currency_ids
+    through_model.objects.bulk_create(
+        [through_model(currency_id=currency_id, exchange=exchange_instance)
+         for currency_id in new_currency_ids],
+        batch_size=BULK_CREATE_BATCH_SIZE)
+    return len(new_currency_ids)
+
+
+def save_missing_currency_exchange_pks(exchange_instance, currency_id_by_key):
+    """
+    Adds the CurrencyExchangePKs in currency_id_by_key, a dict in the
+    format {key: currency_id}, whose key doesn't exist yet for
+    exchange_instance.
+
+    Returns the number of added keys.
+    """
+    existing_keys = set(CurrencyExchangePK.objects.filter(
+        exchange=exchange_instance).values_list('key', flat=True))
+
+    new_exchange_pks = [
+        CurrencyExchangePK(
+            currency_id=currency_id,
+            exchange=exchange_instance,
+            key=key,
+            key_type=determine_str_or_int(key).upper())
+        for key, currency_id in currency_id_by_key.items()
+        if key not in existing_keys
+    ]
+    CurrencyExchangePK.objects.bulk_create(
+        new_exchange_pks, batch_size=BULK_CREATE_BATCH_SIZE)
+    return len(new_exchange_pks)
@@ -0,0 +1,186 @@
+from common import metrics
+from common.instrumentation import stage
+from common.sqlite import write_atomic
+from common.utils import determine_str_or_int
+from cryptodata.models import TradingPair, TradingPairExchangePK
+
+
+BULK_CREATE_BATCH_SIZE = 500
+DELETE_BATCH_SIZE = 500
+
+
+@stage('write')
+def sync_exchange_trading_pairs(exchange_instance, formatted_pairs_data,
+                                skipped_keys=()):
+    """
+    Makes the trading pairs stored for one exchange match
+    formatted_pairs_data, using a fixed number of queries instead of
+    several per pair.
+
+    formatted_pairs_data is a list of dicts in the format returned by
+    the standardize_pair_data_format method of the
+    save_available_trading_pairs command, with both currency instances
+    resolved.
+
+    The desired TradingPairs, TradingPair.exchanges rows and
+    TradingPairExchangePKs are built in memory and diffed against the
+    db, then the differences are written with bulk_create and batched
+    deletes, inside one transaction. Pairs that are no longer listed
+    by the exchange lose their exchange link and keys; the TradingPair
+    rows themselves are kept, as other exchanges may still list them.
+
+    skipped_keys are the exchange_pks of listed pairs that were left
+    out of formatted_pairs_data, e.g. because a currency couldn't be
+    resolved. Their existing exchange link and keys are kept as they
+    are instead of being pruned.
+
+    Returns the counts per change:
+    {
+        'pairs_created': ...,
+        'exchange_links_added': ...,
+        'exchange_links_removed': ...,
+        'exchange_pks_added': ...,
+        'exchange_pks_removed': ...,
+    }
+    """
+    desired_pair_by_key = {
+        pair_data['exchange_pk']: (pair_data['currency1_instance'].id,
+                                   pair_data['currency2_instance'].id)
+        for pair_data in formatted_pairs_data
+    }
+
+    with write_atomic():
+        pair_ids, pairs_created = save_missing_trading_pairs(
+            set(desired_pair_by_key.values()))
+        desired_pk_by_key = return_skipped_exchange_pks(
+            exchange_instance, set(skipped_keys) - desired_pair_by_key.keys())
+        desired_pk_by_key.update(
+            (key, pair_ids[pair]) for key, pair in desired_pair_by_key.items())
+
+        links_added, links_removed = sync_trading_pair_exchanges(
+            exchange_instance, set(desired_pk_by_key.values()))
+        exchange_pks_added, exchange_pks_removed = sync_trading_pair_exchange_pks(
+            exchange_instance, desired_pk_by_key)
+
+    metrics.rows_inserted.labels('TradingPair').inc(pairs_created)
+    metrics.rows_inserted.labels('TradingPair_exchanges').inc(links_added)
+    metrics.rows_inserted.labels('TradingPairExchangePK').inc(exchange_pks_added)
+
+    return {
+        'pairs_created': pairs_created,
+        'exchange_links_added': links_added,
+        'exchange_links_removed': links_removed,
+        'exchange_pks_added': exchange_pks_added,
+        'exchange_pks_removed': exchange_pks_removed,
+    }
+
+
+def return_trading_pair_ids():
+    """
+    Returns a dict of all trading pairs, in the format:
+    {(currency1_id, currency2_id): trading_pair_id}
+    """
+    return {
+        (currency1_id, currency2_id): trading_pair_id
+        for trading_pair_id, currency1_id, currency2_id
+        in TradingPair.objects.values_list('id', 'currency1', 'currency2')
+    }
+
+
+def return_skipped_exchange_pks(exchange_instance, skipped_keys):
+    """
+    Returns the stored TradingPairExchangePKs of exchange_instance
+    with a key in skipped_keys, in the format {key: trading_pair_id}.
+    """
+    if not skipped_keys:
+        return {}
+    return dict(TradingPairExchangePK.objects.filter(
+        exchange=exchange_instance, key__in=skipped_keys).values_list(
+            'key', 'trading_pair'))
+
+
+def save_missing_trading_pairs(desired_pairs):
+    """
+    Takes a set of (currency1_id, currency2_id) tuples, adds the
+    ones that don't exist yet as TradingPair.
+
+    Returns the ids of all trading pairs (see return_trading_pair_ids)
+    and the number of created pairs.
+    """
+    pair_ids = return_trading_pair_ids()
+    missing_pairs = desired_pairs - pair_ids.keys()
+    if not missing_pairs:
+        return pair_ids, 0
+
+    TradingPair.objects.bulk_create(
+        [TradingPair(currency1_id=currency1_id, currency2_id=currency2_id)
+         for currency1_id, currency2_id in missing_pairs],
+        batch_size=BULK_CREATE_BATCH_SIZE)
+    # bulk_create doesn't set the ids on every db backend (e.g. SQLite)
+    return return_trading_pair_ids(), len(missing_pairs)
+
+
+def sync_trading_pair_exchanges(exchange_instance, desired_pair_ids):
+    """
+    Makes exchange_instance part of exactly the TradingPair.exchanges
+    of the pairs in desired_pair_ids.
+
+    Returns the number of added and removed links.
+    """
+    through_model = TradingPair.exchanges.through
+    existing_pair_ids = set(through_model.objects.filter(
+        exchange=exchange_instance).values_list('tradingpair', flat=True))
+
+    new_pair_ids = desired_pair_ids - existing_pair_ids
+    through_model.objects.bulk_create(
+        [through_model(tradingpair_id=pair_id, exchange=exchange_instance)
+         for pair_id in new_pair_ids],
+        batch_size=BULK_CREATE_BATCH_SIZE)
+
+    stale_pair_ids = list(existing_pair_ids - desired_pair_ids)
+    for i in range(0, len(stale_pair_ids), DELETE_BATCH_SIZE):
+        through_model.objects.filter(
+            exchange=exchange_instance,
+            tradingpair__in=stale_pair_ids[i:i + DELETE_BATCH_SIZE]).delete()
+
+    return len(new_pair_ids), len(stale_pair_ids)
+
+
+def sync_trading_pair_exchange_pks(exchange_instance, desired_pk_by_key):
+    """
+    Makes the TradingPairExchangePKs of exchange_instance match
+    desired_pk_by_key, a dict in the format {key: trading_pair_id}.
+
+    Keys that are no longer listed, point to another trading pair
+    or are duplicates are deleted.
+
+    Returns the number of added and removed keys.
+    """
+    existing_exchange_pks = TradingPairExchangePK.objects.filter(
+        exchange=exchange_instance).values_list('id', 'key', 'trading_pair')
+
+    kept_keys = set()
+    stale_ids = []
+    for exchange_pk_id, key, trading_pair_id in existing_exchange_pks:
+        if key in kept_keys or desired_pk_by_key.get(key) != trading_pair_id:
+            stale_ids.append(exchange_pk_id)
+        else:
+            kept_keys.add(key)
+
+    for i in range(0, len(stale_ids), DELETE_BATCH_SIZE):
+        TradingPairExchangePK.objects.filter(
+            id__in=stale_ids[i:i + DELETE_BATCH_SIZE]).delete()
+
+    new_exchange_pks = [
+        TradingPairExchangePK(
+            trading_pair_id=trading_pair_id,
+            exchange=exchange_instance,
+            key=key,
+            key_type=determine_str_or_int(key).upper())
+        for key, trading_pair_id in desired_pk_by_key.items()
+        if key not in kept_keys
+    ]
+    TradingPairExchangePK.objects.bulk_create(
+        new_exchange_pks, batch_size=BULK_CREATE_BATCH_SIZE)
+
+    return len(new_exchange_pks), len(stale_ids)
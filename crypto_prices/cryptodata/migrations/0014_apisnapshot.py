@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptodata', '0013_auto_20190511_2101'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApiSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255, unique=True)),
+                ('etag', models.CharField(blank=True, max_length=255)),
+                ('last_modified', models.CharField(blank=True, max_length=255)),
+                ('content_hash', models.CharField(blank=True, max_length=64)),
+                ('keys', models.TextField(blank=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['source'],
+            },
+        ),
+    ]
@@ -1,3 +1,5 @@
+import json
+
 from django.db import models
 
 
@@ -86,3 +88,31 @@ class Exchange(models.Model):
 
     class Meta:
         ordering = ['name']
+
+
+class ApiSnapshot(models.Model):
+    """
+    What was synced from one api source (e.g. the trading pairs of an
+    exchange) on the last successful run: the response's ETag,
+    Last-Modified and content hash, and the keys of its records.
+    """
+    source = models.CharField(max_length=255, unique=True)
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=255, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    keys = models.TextField(blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.source
+
+    def get_keys(self):
+        if not self.keys:
+            return set()
+        return set(json.loads(self.keys))
+
+    def set_keys(self, keys):
+        self.keys = json.dumps(sorted(keys))
+
+    class Meta:
+        ordering = ['source']
@@ -0,0 +1,89 @@
+from unittest import mock
+
+import requests
+
+from django.test import SimpleTestCase, TestCase
+
+from cryptodata.management.commands.utils import api_snapshot_utils
+from cryptodata.management.commands.utils.api_snapshot_utils import fetch_json_if_changed, return_api_snapshots
+from cryptodata.models import ApiSnapshot
+
+
+class FetchJsonIfChangedTestCase(SimpleTestCase):
+    url = 'https://api.kraken.com/0/public/Assets'
+
+    def setUp(self):
+        patcher = mock.patch.object(api_snapshot_utils.http_client, 'get')
+        self.get = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.snapshot = ApiSnapshot(source='currencies:Kraken')
+
+    def return_response(self, status_code, content=b'', headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers.update(headers or {})
+        response._content = content
+        return response
+
+    def test_fetch_json_if_changed(self):
+        """
+        Tests that changed data is returned and remembered in the
+        snapshot, and that None is returned when the server answers
+        304 or the content is the same as last time.
+        """
+        self.get.return_value = self.return_response(
+            200, b'{"result": {"XXBT": {}}}', {'ETag': '"v1"'})
+        self.assertEqual(
+            fetch_json_if_changed(self.url, self.snapshot),
+            {'result': {'XXBT': {}}})
+        self.assertEqual(self.snapshot.etag, '"v1"')
+        content_hash = self.snapshot.content_hash
+        self.assertTrue(content_hash)
+
+        # Server supports conditional requests
+        self.get.return_value = self.return_response(304)
+        self.assertIsNone(fetch_json_if_changed(self.url, self.snapshot))
+        self.assertEqual(
+            self.get.call_args[1]['headers'], {'If-None-Match': '"v1"'})
+
+        # Server doesn't, content is the same
+        self.get.return_value = self.return_response(
+            200, b'{"result": {"XXBT": {}}}')
+        self.assertIsNone(fetch_json_if_changed(self.url, self.snapshot))
+        self.assertEqual(self.snapshot.content_hash, content_hash)
+
+        self.get.return_value = self.return_response(
+            200, b'{"result": {"XXBT": {}, "XETH": {}}}')
+        self.assertEqual(
+            fetch_json_if_changed(self.url, self.snapshot),
+            {'result': {'XXBT': {}, 'XETH': {}}})
+        self.assertNotEqual(self.snapshot.content_hash, content_hash)
+
+    def test_snapshot_keys(self):
+        self.assertEqual(self.snapshot.get_keys(), set())
+        self.snapshot.set_keys({'XXBT', 'XETH'})
+        self.assertEqual(self.snapshot.get_keys(), {'XXBT', 'XETH'})
+
+
+class ReturnApiSnapshotsTestCase(TestCase):
+    def setUp(self):
+        snapshot = ApiSnapshot(source='currencies:Kraken', etag='"v1"', content_hash='abc')
+        snapshot.set_keys({'XXBT'})
+        snapshot.save()
+
+    def test_return_api_snapshots(self):
+        snapshots = return_api_snapshots(['currencies:Kraken', 'currencies:Binance'])
+        self.assertEqual(snapshots['currencies:Kraken'].etag, '"v1"')
+        self.assertEqual(snapshots['currencies:Kraken'].get_keys(), {'XXBT'})
+        self.assertIsNone(snapshots['currencies:Binance'].pk)
+
+    def test_full(self):
+        """
+        full empties the existing snapshots, which can be saved again
+        (the source is unique).
+        """
+        snapshot = return_api_snapshots(['currencies:Kraken'], full=True)['currencies:Kraken']
+        self.assertEqual((snapshot.etag, snapshot.content_hash), ('', ''))
+        self.assertEqual(snapshot.get_keys(), set())
+        snapshot.save()
+        self.assertEqual(ApiSnapshot.objects.count(), 1)
@@ -0,0 +1,78 @@
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+
+from common import http_client
+from common.models import MetricsSnapshot
+from cryptodata.management.commands.utils.benchmark_utils import (
+    BENCHMARK_COMMANDS, compare_results, return_fixture_payloads, run_benchmarks, serve_fixtures)
+from cryptodata.models import Currency
+
+
+class FixturePayloadsTestCase(TestCase):
+    def test_scale(self):
+        """
+        Scaling copies every currency with a suffixed ticker symbol,
+        keeping the quote currencies of the pairs.
+        """
+        url = 'https://api.binance.com/api/v1/exchangeInfo'
+        symbols = return_fixture_payloads(1)[url]['symbols']
+        scaled_symbols = return_fixture_payloads(3)[url]['symbols']
+
+        self.assertEqual(len(scaled_symbols), 3 * len(symbols))
+        self.assertEqual(
+            len({symbol['symbol'] for symbol in scaled_symbols}), len(scaled_symbols))
+        self.assertEqual(
+            {symbol['quoteAsset'] for symbol in scaled_symbols},
+            {symbol['quoteAsset'] for symbol in symbols})
+
+    def test_serve_fixtures(self):
+        session = http_client.get_session()
+        original_adapter = session.get_adapter('https://')
+        payloads = return_fixture_payloads(1)
+        with serve_fixtures(payloads) as adapter:
+            response = session.get('https://rest.coinapi.io/v1/assets?filter=x')
+            self.assertEqual(response.json(), payloads['https://rest.coinapi.io/v1/assets'])
+            self.assertEqual(session.get('https://example.com/').status_code, 404)
+            self.assertEqual(adapter.request_count, 2)
+        self.assertIs(session.get_adapter('https://'), original_adapter)
+
+
+class RunBenchmarksTestCase(TestCase):
+    def test_run_benchmarks(self):
+        results = run_benchmarks([1], measure_memory=False)
+
+        self.assertEqual(
+            [result['command'] for result in results],
+            [command_name for command_name, _ in BENCHMARK_COMMANDS])
+        for result in results:
+            self.assertEqual(result['scale'], 1)
+            self.assertGreater(result['rows'], 0)
+            self.assertGreater(result['queries'], 0)
+        self.assertTrue(Currency.objects.filter(ticker_symbol='BTC').exists())
+
+    def test_command_saves_no_metrics(self):
+        """
+        The benchmark's synthetic runs don't end up in the saved
+        metrics (the test database is used instead of a new one).
+        """
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(connection.creation, 'create_test_db'), \
+                mock.patch.object(connection.creation, 'destroy_test_db'):
+            call_command(
+                'run_benchmarks', scales='1', no_memory=True,
+                output=os.path.join(directory, 'results.json'), stdout=StringIO())
+        self.assertTrue(Currency.objects.exists())
+        self.assertFalse(MetricsSnapshot.objects.exists())
+
+    def test_compare_results(self):
+        previous = [{'command': 'c', 'scale': 1, 'wall_time': 2.0, 'queries': 10, 'peak_memory': None}]
+        current = [{'command': 'c', 'scale': 1, 'wall_time': 1.0, 'queries': 10, 'peak_memory': 5}]
+        self.assertEqual(
+            compare_results(previous, current),
+            ['c x1: wall_time -50.0%, queries +0.0%'])
@@ -0,0 +1,70 @@
+import csv
+import os
+import tempfile
+
+from django.test import TestCase
+
+from cryptodata.management.commands.utils.currency_name_utils import CurrencyNameResolver
+from cryptodata.models import Currency
+
+
+class CurrencyNameResolverTestCase(TestCase):
+    def setUp(self):
+        Currency.objects.create(name='Bitcoin', ticker_symbol='BTC')
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.file_path = os.path.join(self.temp_dir.name, 'names.csv')
+
+    def test_resolve(self):
+        """
+        Tests that names are resolved from the db, the Binance names
+        and the Kraken csv without any further queries, and that
+        unknown currencies are collected instead of asked for.
+        """
+        with self.assertNumQueries(1):
+            resolver = CurrencyNameResolver()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.resolve('Bittrex', 'BTC'), 'Bitcoin')
+            self.assertEqual(
+                resolver.resolve('Binance', 'VET', 'VET'), 'Vechain')
+            self.assertEqual(
+                resolver.resolve('Kraken', 'ADA', 'ADA'), 'Cardano')
+            self.assertIsNone(resolver.resolve('Kraken', 'VET', 'VET'))
+            self.assertIsNone(resolver.resolve('Binance', 'NEW', 'NEW'))
+
+        self.assertEqual(resolver.unresolved, {
+            ('Kraken', 'VET'): 'VET',
+            ('Binance', 'NEW'): 'NEW',
+        })
+
+        resolver.add('NEW', 'New coin')
+        self.assertEqual(resolver.resolve('Binance', 'NEW', 'NEW'), 'New coin')
+
+    def test_unresolved_names_round_trip(self):
+        """
+        Tests that the unresolved names csv, once filled in, can be
+        used to resolve those names on the next run.
+        """
+        resolver = CurrencyNameResolver()
+        resolver.resolve('Kraken', 'FOO', 'XFOO')
+        resolver.write_unresolved_names(self.file_path)
+
+        with open(self.file_path) as csv_file:
+            rows = list(csv.DictReader(csv_file))
+        self.assertEqual(rows, [{
+            'exchange': 'Kraken',
+            'ticker_symbol': 'FOO',
+            'currency_exchange_pk': 'XFOO',
+            'name': '',
+        }])
+
+        rows[0]['name'] = 'Foo coin'
+        with open(self.file_path, 'w', newline='') as csv_file:
+            csv_writer = csv.DictWriter(csv_file, fieldnames=rows[0].keys())
+            csv_writer.writeheader()
+            csv_writer.writerows(rows)
+
+        resolver = CurrencyNameResolver(self.file_path)
+        self.assertEqual(
+            resolver.resolve('Kraken', 'FOO', 'XFOO'), 'Foo coin')
@@ -1,6 +1,8 @@
 from django.test import TestCase
 
-from cryptodata.management.commands.utils.save_coinapi_assets_utils import create_currency
+from common.instrumentation import query_budget
+
+from cryptodata.management.commands.utils.save_coinapi_assets_utils import bulk_create_currencies, create_currency
 from cryptodata.models import Currency
 
 
@@ -66,3 +68,48 @@ class SaveCoinAPIAssetsToDBTestCase(TestCase):
 
         self.assertEqual(existing_currency_instance_id,
                          returned_currency_instance_id)
+
+
+class BulkCreateCurrenciesTestCase(TestCase):
+    def setUp(self):
+        Currency.objects.create(name="Existing coin", ticker_symbol="XSC")
+
+        self.currencies_data = [
+            {"asset_id": "XSC", "name": "Existing coin"},
+            {"asset_id": "NXC", "name": "None existing coin"},
+            {"asset_id": "NXC", "name": "None existing coin"},
+            {"asset_id": "NNC"},
+            {"asset_id": "AAA", "name": "Another coin"},
+            {"asset_id": "BBB", "name": "Batched coin"},
+        ]
+
+    def test_bulk_create_currencies(self):
+        """
+        Tests the bulk_create_currencies function.
+
+        Checks that only the missing currencies are added, that
+        duplicates and assets without a name are skipped, and that
+        the number of queries doesn't depend on the number of assets.
+        """
+        # The existing keys, and one insert per batch, without a
+        # transaction around them
+        with self.assertNumQueries(3):
+            counts = bulk_create_currencies(
+                self.currencies_data, batch_size=2)
+
+        self.assertEqual(
+            counts, {'inserted': 3, 'unchanged': 1, 'skipped': 2})
+        self.assertEqual(Currency.objects.count(), 4)
+        self.assertTrue(Currency.objects.filter(
+            name="Batched coin", ticker_symbol="BBB").exists())
+
+    def test_bulk_create_currencies_query_budget(self):
+        """
+        1000 assets take a few batched inserts, not a query per asset.
+        """
+        currencies_data = [
+            {"asset_id": f"C{number}", "name": f"Coin {number}"}
+            for number in range(1000)
+        ]
+        with query_budget(10):
+            bulk_create_currencies(currencies_data)
@@ -0,0 +1,89 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from common.instrumentation import query_budget
+
+from cryptodata.management.commands.utils.benchmark_utils import return_fixture_payloads, serve_fixtures
+from cryptodata.management.commands.utils.sync_currencies_utils import sync_exchange_currencies
+from cryptodata.models import Currency, CurrencyExchangePK, Exchange
+
+
+class SyncExchangeCurrenciesTestCase(TestCase):
+    def setUp(self):
+        self.exchange = Exchange.objects.create(name='Kraken')
+        self.bitcoin = Currency.objects.create(name='Bitcoin', ticker_symbol='XBT')
+        self.bitcoin.exchanges.add(self.exchange)
+        CurrencyExchangePK.objects.create(
+            currency=self.bitcoin, exchange=self.exchange, key='XXBT')
+        self.ether = Currency.objects.create(name='Ether', ticker_symbol='ETH')
+
+    def return_formatted_currencies_data(self, currencies):
+        return [
+            {
+                'currency_exchange_pk': key,
+                'currency_name': name,
+                'ticker_symbol': ticker_symbol,
+            }
+            for key, name, ticker_symbol in currencies
+        ]
+
+    def test_sync_exchange_currencies(self):
+        """
+        Tests that missing currencies, exchange links and keys are
+        added, and existing ones are kept.
+        """
+        formatted_currencies_data = self.return_formatted_currencies_data([
+            ('XXBT', 'Bitcoin', 'XBT'),
+            ('XETH', 'Ether', 'ETH'),
+            ('ZEUR', 'Euro', 'EUR'),
+            # Duplicate, the first one is kept
+            ('ZEUR', 'Euro', 'EURO'),
+        ])
+        counts, new_currencies = sync_exchange_currencies(
+            self.exchange, formatted_currencies_data)
+
+        self.assertEqual(counts, {
+            'currencies_created': 1,
+            'exchange_links_added': 2,
+            'exchange_pks_added': 2,
+        })
+        self.assertEqual(new_currencies, [('EUR', 'Euro')])
+        self.assertEqual(
+            set(Currency.objects.filter(exchanges=self.exchange).values_list('name', flat=True)),
+            {'Bitcoin', 'Ether', 'Euro'})
+        self.assertEqual(
+            set(CurrencyExchangePK.objects.values_list('key', 'currency__name')),
+            {('XXBT', 'Bitcoin'), ('XETH', 'Ether'), ('ZEUR', 'Euro')})
+
+        # A second run with the same data changes nothing
+        counts, new_currencies = sync_exchange_currencies(
+            self.exchange, formatted_currencies_data)
+        self.assertEqual(set(counts.values()), {0})
+        self.assertEqual(new_currencies, [])
+
+    def test_sync_exchange_currencies_query_budget(self):
+        """
+        The number of queries stays the same for many more currencies.
+        """
+        formatted_currencies_data = self.return_formatted_currencies_data([
+            (f'C{number}', f'Coin {number}', f'C{number}') for number in range(500)
+        ])
+        with query_budget(12):
+            sync_exchange_currencies(self.exchange, formatted_currencies_data)
+        self.assertEqual(
+            CurrencyExchangePK.objects.filter(exchange=self.exchange).count(), 501)
+
+
+class GetExchangeAvailableCurrenciesTestCase(TestCase):
+    def test_query_budget(self):
+        """
+        The command's queries don't depend on the number of currencies.
+        """
+        with serve_fixtures(return_fixture_payloads(3)):
+            call_command('save_coinapi_assets', stdout=StringIO())
+            with query_budget(55):
+                call_command(
+                    'old_get_exchange_available_currencies', stdout=StringIO())
+        self.assertGreater(CurrencyExchangePK.objects.count(), 100)
@@ -0,0 +1,116 @@
+from django.test import TestCase
+
+from common.instrumentation import query_budget
+
+from cryptodata.management.commands.utils.sync_trading_pairs_utils import sync_exchange_trading_pairs
+from cryptodata.models import Currency, Exchange, TradingPair, TradingPairExchangePK
+
+
+class SyncExchangeTradingPairsTestCase(TestCase):
+    def setUp(self):
+        self.exchange = Exchange.objects.create(name='Kraken')
+        self.other_exchange = Exchange.objects.create(name='Bittrex')
+        self.currencies = {
+            symbol: Currency.objects.create(name=symbol, ticker_symbol=symbol)
+            for symbol in ['BTC', 'ETH', 'EUR', 'USD', 'XRP']
+        }
+
+        # Listed before, still listed
+        self.kept_pair = self.create_pair('ETH', 'BTC', 'XETHXXBT')
+        # Listed before, delisted since, also listed by other exchange
+        self.delisted_pair = self.create_pair('XRP', 'BTC', 'XXRPXXBT')
+        self.delisted_pair.exchanges.add(self.other_exchange)
+
+    def create_pair(self, symbol1, symbol2, key):
+        pair = TradingPair.objects.create(
+            currency1=self.currencies[symbol1],
+            currency2=self.currencies[symbol2])
+        pair.exchanges.add(self.exchange)
+        TradingPairExchangePK.objects.create(
+            trading_pair=pair, exchange=self.exchange, key=key)
+        return pair
+
+    def return_formatted_pairs_data(self, pairs):
+        return [
+            {
+                'currency1_instance': self.currencies[symbol1],
+                'currency2_instance': self.currencies[symbol2],
+                'exchange_instance': self.exchange,
+                'exchange_pk': key,
+            }
+            for symbol1, symbol2, key in pairs
+        ]
+
+    def test_sync_exchange_trading_pairs(self):
+        """
+        Tests that new pairs are added, delisted pairs are removed from
+        the exchange only, and that the number of queries doesn't
+        depend on the number of pairs.
+        """
+        formatted_pairs_data = self.return_formatted_pairs_data([
+            ('ETH', 'BTC', 'XETHXXBT'),
+            ('BTC', 'EUR', 'XXBTZEUR'),
+            ('BTC', 'USD', 'XXBTZUSD'),
+            ('ETH', 'EUR', 'XETHZEUR'),
+        ])
+        with self.assertNumQueries(12):
+            counts = sync_exchange_trading_pairs(
+                self.exchange, formatted_pairs_data)
+
+        self.assertEqual(counts, {
+            'pairs_created': 3,
+            'exchange_links_added': 3,
+            'exchange_links_removed': 1,
+            'exchange_pks_added': 3,
+            'exchange_pks_removed': 1,
+        })
+        exchange_pairs = TradingPair.objects.filter(exchanges=self.exchange)
+        self.assertEqual(exchange_pairs.count(), 4)
+        self.assertNotIn(self.delisted_pair, exchange_pairs)
+        self.assertIn(self.kept_pair, exchange_pairs)
+        self.assertEqual(
+            list(self.delisted_pair.exchanges.all()), [self.other_exchange])
+        self.assertEqual(
+            set(TradingPairExchangePK.objects.filter(
+                exchange=self.exchange).values_list('key', flat=True)),
+            {'XETHXXBT', 'XXBTZEUR', 'XXBTZUSD', 'XETHZEUR'})
+
+        # A second run with the same data changes nothing
+        with self.assertNumQueries(6):
+            counts = sync_exchange_trading_pairs(
+                self.exchange, formatted_pairs_data)
+        self.assertEqual(set(counts.values()), {0})
+
+    def test_sync_exchange_trading_pairs_query_budget(self):
+        """
+        The number of queries stays the same for many more pairs.
+        """
+        for number in range(200):
+            self.currencies[f'C{number}'] = Currency.objects.create(
+                name=f'Coin {number}', ticker_symbol=f'C{number}')
+        formatted_pairs_data = self.return_formatted_pairs_data([
+            (f'C{number}', quote, f'C{number}{quote}')
+            for number in range(200) for quote in ['BTC', 'EUR']
+        ])
+        with query_budget(12):
+            sync_exchange_trading_pairs(self.exchange, formatted_pairs_data)
+
+    def test_sync_exchange_trading_pairs_skipped_keys(self):
+        """
+        Pairs that were skipped, e.g. because a currency couldn't be
+        resolved, keep their exchange link and keys.
+        """
+        formatted_pairs_data = self.return_formatted_pairs_data([
+            ('ETH', 'BTC', 'XETHXXBT'),
+        ])
+        counts = sync_exchange_trading_pairs(
+            self.exchange, formatted_pairs_data,
+            skipped_keys=['XXRPXXBT', 'XNEWXXBT'])
+
+        self.assertEqual(set(counts.values()), {0})
+        self.assertIn(
+            self.exchange, self.delisted_pair.exchanges.all())
+        self.assertEqual(
+            set(TradingPairExchangePK.objects.filter(
+                exchange=self.exchange).values_list('key', flat=True)),
+            {'XETHXXBT', 'XXRPXXBT'})
@@ -0,0 +1,66 @@
+import threading
+import time
+
+from django.test import SimpleTestCase, TestCase
+
+from cryptodata.management.commands._utils import CurrencyExchangePKResolver, fetch_exchanges_data
+from cryptodata.models import Currency, CurrencyExchangePK, Exchange
+
+
+class FetchExchangesDataTestCase(SimpleTestCase):
+    def setUp(self):
+        self.exchange_names = ['Binance', 'Bittrex', 'Kraken']
+        self.thread_names = set()
+
+    def fetch(self, exchange_name):
+        self.thread_names.add(threading.current_thread().name)
+        time.sleep(0.01)
+        return {'exchange': exchange_name}
+
+    def test_fetch_exchanges_data(self):
+        """
+        Tests that the serial and concurrent mode return the same
+        data, in the order of the given exchange names, and that the
+        concurrent mode actually uses multiple threads.
+        """
+        serial_data = fetch_exchanges_data(self.fetch, self.exchange_names)
+        self.assertEqual(len(self.thread_names), 1)
+
+        self.thread_names = set()
+        concurrent_data = fetch_exchanges_data(
+            self.fetch, self.exchange_names, concurrency=3)
+        self.assertEqual(len(self.thread_names), 3)
+
+        self.assertEqual(serial_data, concurrent_data)
+        self.assertEqual(list(concurrent_data), self.exchange_names)
+
+
+class CurrencyExchangePKResolverTestCase(TestCase):
+    def setUp(self):
+        self.exchange = Exchange.objects.create(name='Kraken')
+        other_exchange = Exchange.objects.create(name='Bittrex')
+        self.bitcoin = Currency.objects.create(
+            name='Bitcoin', ticker_symbol='BTC')
+        self.euro = Currency.objects.create(name='Euro', ticker_symbol='EUR')
+        CurrencyExchangePK.objects.create(
+            currency=self.bitcoin, exchange=self.exchange, key='XXBT')
+        CurrencyExchangePK.objects.create(
+            currency=self.euro, exchange=self.exchange, key='ZEUR')
+        CurrencyExchangePK.objects.create(
+            currency=self.euro, exchange=other_exchange, key='EUR')
+
+    def test_resolve(self):
+        """
+        Tests that the mapping is loaded with one query, that lookups
+        don't query the db, and that unknown keys are collected.
+        """
+        with self.assertNumQueries(1):
+            resolver = CurrencyExchangePKResolver(self.exchange)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.resolve('XXBT'), self.bitcoin)
+            self.assertEqual(resolver.resolve('ZEUR').name, 'Euro')
+            self.assertIsNone(resolver.resolve('EUR'))
+            self.assertIsNone(resolver.resolve('XXDG'))
+
+        self.assertEqual(resolver.unresolved_keys, {'EUR', 'XXDG'})
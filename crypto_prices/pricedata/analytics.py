@@ -0,0 +1,221 @@
+"""
+Market analytics over the rates of a PriceFrame (see
+pricedata.price_frame).
+
+All functions work on whole NumPy arrays of one pair at a time, there
+are no Python loops over the ticks. Rolling windows count ticks, not
+time.
+
+Summaries contain None instead of NaN or infinity (e.g. the relative
+spread of a zero price), which aren't valid JSON.
+
+Requires numpy.
+"""
+from itertools import combinations
+
+import math
+
+import numpy
+
+
+def return_spreads(bids, asks):
+    """
+    Returns the absolute spreads (ask - bid), and the spreads relative
+    to the mid price.
+    """
+    spreads = asks - bids
+    # NaN or infinity for zero prices
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return spreads, spreads / ((bids + asks) / 2)
+
+
+def return_float(value):
+    """
+    Returns value as a float, or None if it's NaN or infinite.
+    """
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def return_stats(values):
+    if not len(values):
+        return None
+    return {
+        'mean': return_float(numpy.mean(values)),
+        'median': return_float(numpy.median(values)),
+        'std': return_float(numpy.std(values)),
+        'min': return_float(numpy.min(values)),
+        'max': return_float(numpy.max(values)),
+    }
+
+
+def return_log_returns(prices):
+    """
+    Returns the log returns between consecutive prices, one less than
+    there are prices.
+    """
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.diff(numpy.log(prices))
+
+
+def return_rolling_volatility(returns, window):
+    """
+    Returns the standard deviation of returns over each window of
+    window consecutive returns (len(returns) - window + 1 values).
+
+    Uses running sums, so the cost doesn't depend on the window size.
+    The returns are centered first, so the sums don't lose precision.
+    """
+    if len(returns) < window:
+        return numpy.empty(0)
+    centered = returns - returns.mean()
+    sums = numpy.concatenate(([0.0], numpy.cumsum(centered)))
+    squares = numpy.concatenate(([0.0], numpy.cumsum(centered ** 2)))
+    window_sums = sums[window:] - sums[:-window]
+    window_squares = squares[window:] - squares[:-window]
+    variances = window_squares / window - (window_sums / window) ** 2
+    return numpy.sqrt(numpy.maximum(variances, 0))
+
+
+def return_rolling_extremes(values, window, function):
+    """
+    Returns function (numpy.minimum or numpy.maximum) over each window
+    of window consecutive values (len(values) - window + 1 values).
+
+    Uses the van Herk/Gil-Werman algorithm, so the cost doesn't depend
+    on the window size: the values are split in blocks of window
+    values, and every window is covered by the end of one block and
+    the start of the next. Running extremes from the start and from
+    the end of every block give both parts.
+    """
+    if len(values) < window:
+        return numpy.empty(0, dtype=values.dtype)
+    # Padding to whole blocks, the padded values are never in a window
+    padded = numpy.pad(values, (0, -len(values) % window), mode='edge')
+    blocks = padded.reshape(-1, window)
+    from_start = function.accumulate(blocks, axis=1).ravel()
+    from_end = function.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    count = len(values) - window + 1
+    return function(from_end[:count], from_start[window - 1:window - 1 + count])
+
+
+def return_rolling_min(values, window):
+    """
+    Returns the minimum of each window of window consecutive values.
+    """
+    return return_rolling_extremes(values, window, numpy.minimum)
+
+
+def return_rolling_max(values, window):
+    """
+    Returns the maximum of each window of window consecutive values.
+    """
+    return return_rolling_extremes(values, window, numpy.maximum)
+
+
+def return_price_differences(timestamps, prices, other_timestamps, other_prices):
+    """
+    Compares two price series of the same pair on different exchanges.
+    For every tick of the first series, takes the last price of the
+    other series at or before it.
+
+    Returns (timestamps, differences): prices - other prices, for the
+    ticks after the other series started.
+    """
+    positions = numpy.searchsorted(other_timestamps, timestamps, side='right') - 1
+    valid = positions >= 0
+    return timestamps[valid], prices[valid] - other_prices[positions[valid]]
+
+
+def summarize_pair(frame, window):
+    """
+    Returns the analytics of a PriceFrame with one pair, in the format:
+    {
+        'tick_count': 1000,
+        'spread': {'mean': ..., 'median': ..., 'std': ..., 'min': ..., 'max': ...},
+        'relative_spread': {...},
+        'returns': {...},  # log returns of the mid price
+        'volatility': {'latest': ..., 'max': ...},  # rolling std of the returns
+        'rolling_min': ...,  # mid price range over the last window ticks
+        'rolling_max': ...,
+    }
+    Values are None if there are fewer ticks than needed.
+    """
+    bids = frame.to_float(frame.bids)
+    asks = frame.to_float(frame.asks)
+    mids = frame.to_float(frame.mids)
+    spreads, relative_spreads = return_spreads(bids, asks)
+    returns = return_log_returns(mids)
+    volatility = return_rolling_volatility(returns, window)
+    rolling_min = return_rolling_min(mids, window)
+    rolling_max = return_rolling_max(mids, window)
+    return {
+        'tick_count': len(frame),
+        'spread': return_stats(spreads),
+        'relative_spread': return_stats(relative_spreads),
+        'returns': return_stats(returns),
+        'volatility': {
+            'latest': return_float(volatility[-1]),
+            'max': return_float(volatility.max()),
+        } if len(volatility) else None,
+        'rolling_min': return_float(rolling_min[-1]) if len(rolling_min) else None,
+        'rolling_max': return_float(rolling_max[-1]) if len(rolling_max) else None,
+    }
+
+
+def summarize_exchange_differences(frame, key, other_key):
+    """
+    Returns the mid price differences between two pairs of a PriceFrame,
+    the same base and quote on different exchanges, in the format:
+    {
+        'count': 1000,
+        'difference': {'mean': ..., 'median': ..., 'std': ..., 'min': ..., 'max': ...},
+        'relative_difference': {...},
+    }
+    """
+    pair = frame.pair(key)
+    other_pair = frame.pair(other_key)
+    mids = pair.to_float(pair.mids)
+    timestamps, differences = return_price_differences(
+        pair.timestamps, mids, other_pair.timestamps,
+        other_pair.to_float(other_pair.mids))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        relative_differences = differences / mids[len(mids) - len(differences):]
+    return {
+        'count': len(differences),
+        'difference': return_stats(differences),
+        'relative_difference': return_stats(relative_differences),
+    }
+
+
+def summarize_frame(frame, window):
+    """
+    Returns the analytics of every pair of the PriceFrame, and the
+    differences between every two exchanges that have the same pair:
+    {
+        'pairs': [
+            {'base': 1, 'quote': 2, 'exchange': 1, **summarize_pair()},
+            ...
+        ],
+        'exchange_differences': [
+            {'base': 1, 'quote': 2, 'exchange': 1, 'other_exchange': 2,
+             **summarize_exchange_differences()},
+            ...
+        ]
+    }
+    """
+    summary = {'pairs': [], 'exchange_differences': []}
+    for key in frame.pairs:
+        summary['pairs'].append({
+            'base': key[0], 'quote': key[1], 'exchange': key[2],
+            **summarize_pair(frame.pair(key), window),
+        })
+    for key, other_key in combinations(frame.pairs, 2):
+        if key[:2] != other_key[:2]:
+            continue
+        summary['exchange_differences'].append({
+            'base': key[0], 'quote': key[1], 'exchange': key[2],
+            'other_exchange': other_key[2],
+            **summarize_exchange_differences(frame, key, other_key),
+        })
+    return summary
@@ -0,0 +1,216 @@
+"""
+Triangular arbitrage scanner.
+
+The trading pairs of each exchange (TradingPairExchangePK) form a
+directed currency graph. Every pair base/quote gives two edges:
+
+    base -> quote   sell base at the bid, rate bid
+    quote -> base   buy base at the ask, rate 1 / ask
+
+with weight -log(rate) (plus the fee). A cycle of three edges whose
+weights add up to less than zero returns more than it started with.
+
+All triangles are found once, when the scanner is built, and stored in
+integer arrays: the three edge indexes of each triangle, and per edge
+the triangles it is part of (in CSR format, offsets into one array).
+An update of one pair then only sums the weights of the triangles of
+its two edges, with a few NumPy operations.
+
+Requires numpy.
+"""
+import math
+from collections import defaultdict
+
+import numpy
+
+from cryptodata.models import TradingPairExchangePK
+from pricedata.latest_prices import latest_price_cache
+
+
+class ArbitrageScanner:
+    """
+    Takes (base_id, quote_id, exchange_id) tuples. If an exchange lists
+    the same two currencies as two pairs (base/quote and quote/base),
+    both update the same edges.
+
+    fee is the fraction of every trade paid as fee, min_profit the
+    fraction a cycle has to return on top of the start amount to be
+    reported.
+    """
+
+    def __init__(self, pair_keys, fee=0.0, min_profit=0.0):
+        self.fee_weight = -math.log(1 - fee)
+        self.max_weight = -math.log(1 + min_profit)
+        # Nodes are (exchange_id, currency_id), so the graphs of the
+        # exchanges are separate parts of one graph
+        node_indexes = {}
+        # {(from node index, to node index): edge index}
+        edge_indexes = {}
+        # {pair key: (base -> quote edge, quote -> base edge)}
+        self.pair_edges = {}
+        for base_id, quote_id, exchange_id in sorted(set(pair_keys)):
+            if base_id == quote_id:
+                continue
+            base, quote = [
+                node_indexes.setdefault((exchange_id, currency_id), len(node_indexes))
+                for currency_id in (base_id, quote_id)
+            ]
+            self.pair_edges[(base_id, quote_id, exchange_id)] = tuple(
+                edge_indexes.setdefault(edge, len(edge_indexes))
+                for edge in ((base, quote), (quote, base)))
+        self.nodes = sorted(node_indexes, key=node_indexes.get)
+
+        self.edge_nodes = numpy.zeros((len(edge_indexes), 2), dtype=numpy.int32)
+        for (from_node, to_node), edge in edge_indexes.items():
+            self.edge_nodes[edge] = (from_node, to_node)
+        # Unknown rates have an infinite weight, so their cycles never
+        # come out negative
+        self.weights = numpy.full(len(edge_indexes), numpy.inf)
+
+        self.triangle_edges = self.return_triangle_edges(edge_indexes)
+        self.edge_triangle_offsets, self.edge_triangles = self.return_edge_triangles(
+            len(edge_indexes), self.triangle_edges)
+
+    @classmethod
+    def from_db(cls, exchange_ids=None, **kwargs):
+        """
+        Returns a scanner of all pairs in TradingPairExchangePK, or of
+        the pairs of the given exchanges.
+        """
+        exchange_pks = TradingPairExchangePK.objects.all()
+        if exchange_ids is not None:
+            exchange_pks = exchange_pks.filter(exchange__in=exchange_ids)
+        return cls(exchange_pks.values_list(
+            'trading_pair__currency1', 'trading_pair__currency2', 'exchange'),
+            **kwargs)
+
+    @staticmethod
+    def return_triangle_edges(edge_indexes):
+        """
+        Returns an array with the three edge indexes of every directed
+        3-cycle, shape (triangle count, 3).
+        """
+        neighbours = defaultdict(set)
+        for from_node, to_node in edge_indexes:
+            neighbours[from_node].add(to_node)
+
+        triangles = []
+        for a in neighbours:
+            for b in neighbours[a]:
+                if b <= a:
+                    continue
+                for c in neighbours[b]:
+                    # Each cycle once, starting at its lowest node
+                    if c > a and a in neighbours[c]:
+                        triangles.append((
+                            edge_indexes[(a, b)], edge_indexes[(b, c)],
+                            edge_indexes[(c, a)]))
+        return numpy.array(triangles, dtype=numpy.int32).reshape(-1, 3)
+
+    @staticmethod
+    def return_edge_triangles(edge_count, triangle_edges):
+        """
+        Returns (offsets, triangles): the triangles of edge e are
+        triangles[offsets[e]:offsets[e + 1]].
+        """
+        edges = triangle_edges.ravel()
+        triangles = numpy.repeat(
+            numpy.arange(len(triangle_edges), dtype=numpy.int32), 3)
+        order = numpy.argsort(edges, kind='stable')
+        offsets = numpy.zeros(edge_count + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum(numpy.bincount(edges, minlength=edge_count))
+        return offsets, triangles[order]
+
+    def set_rate(self, key, bid, ask):
+        """
+        Sets the weights of the pair's edges, without checking cycles.
+        Returns the edge indexes, or None if the pair isn't known.
+        """
+        edges = self.pair_edges.get(key)
+        if edges is None:
+            return None
+        bid, ask = float(bid), float(ask)
+        self.weights[edges[0]] = (
+            -math.log(bid) if bid > 0 else numpy.inf) + self.fee_weight
+        self.weights[edges[1]] = (
+            math.log(ask) if ask > 0 else numpy.inf) + self.fee_weight
+        return edges
+
+    def update(self, key, bid, ask):
+        """
+        Updates the rate of one pair, returns the opportunities among
+        the cycles that use it (see return_opportunities).
+        """
+        edges = self.set_rate(key, bid, ask)
+        if edges is None:
+            return []
+        offsets = self.edge_triangle_offsets
+        triangles = numpy.concatenate([
+            self.edge_triangles[offsets[edge]:offsets[edge + 1]]
+            for edge in edges
+        ])
+        return self.return_opportunities(triangles)
+
+    def update_from_rates(self, exchange_rates):
+        """
+        Updates the scanner with newly saved ExchangeRates, returns the
+        opportunities among the cycles that use any of them.
+        """
+        edges = []
+        for exchange_rate in exchange_rates:
+            pair_edges = self.set_rate(
+                (exchange_rate.base_id, exchange_rate.quote_id,
+                 exchange_rate.exchange_id),
+                exchange_rate.bid, exchange_rate.ask)
+            if pair_edges is not None:
+                edges.extend(pair_edges)
+        if not edges:
+            return []
+        offsets = self.edge_triangle_offsets
+        triangles = numpy.unique(numpy.concatenate([
+            self.edge_triangles[offsets[edge]:offsets[edge + 1]]
+            for edge in edges
+        ]))
+        return self.return_opportunities(triangles)
+
+    def load_latest_prices(self):
+        """
+        Sets the rates of all pairs from the latest prices.
+        """
+        for key, (bid, ask, _) in latest_price_cache.get_many(self.pair_edges).items():
+            self.set_rate(key, bid, ask)
+
+    def scan(self):
+        """
+        Checks all cycles, returns the opportunities.
+        """
+        return self.return_opportunities(
+            numpy.arange(len(self.triangle_edges)))
+
+    def return_opportunities(self, triangles):
+        """
+        Returns the given triangles that return more than min_profit,
+        most profitable first, in the format:
+        [
+            {
+                'exchange': 1,
+                'currencies': [1, 2, 3],  # trade 1 -> 2 -> 3 -> 1
+                'profit': 0.0012,  # fraction of the start amount
+            },
+            ...
+        ]
+        """
+        if not len(triangles):
+            return []
+        sums = self.weights[self.triangle_edges[triangles]].sum(axis=1)
+        profitable = sums < self.max_weight
+        opportunities = []
+        for triangle, weight in zip(triangles[profitable], sums[profitable]):
+            from_nodes = self.edge_nodes[self.triangle_edges[triangle], 0]
+            opportunities.append({
+                'exchange': self.nodes[from_nodes[0]][0],
+                'currencies': [self.nodes[node][1] for node in from_nodes],
+                'profit': math.exp(-weight) - 1,
+            })
+        opportunities.sort(key=lambda opportunity: -opportunity['profit'])
+        return opportunities
@@ -0,0 +1,200 @@
+"""
+Incremental rollup of ExchangeRate ticks into Candles.
+
+Only the ticks that arrived since the last rollup (ExchangeRate id
+above the high-water mark in CandleRollupState) are read. They are
+aggregated in memory per (base, quote, exchange, period, start), merged
+into the candles that already exist, and written with bulk_create and
+bulk_update.
+"""
+from datetime import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from common.sqlite import write_atomic
+from pricedata.fields import return_decimal
+from pricedata.models import Candle, CandleRollupState, ExchangeRate
+
+
+PERIOD_SECONDS = {
+    '1m': 60,
+    '5m': 5 * 60,
+    '1h': 60 * 60,
+    '1d': 24 * 60 * 60,
+}
+
+SERIES = ['bid', 'ask', 'mid']
+
+ROLLUP_BATCH_SIZE = 50000
+BULK_BATCH_SIZE = 500
+
+
+def return_period_start(timestamp, period):
+    """
+    Returns the start of the period (in UTC) that timestamp falls in.
+    """
+    seconds = int(timestamp.timestamp())
+    return datetime.fromtimestamp(
+        seconds - seconds % PERIOD_SECONDS[period], timezone.utc)
+
+
+def update_candles(batch_size=ROLLUP_BATCH_SIZE):
+    """
+    Adds all ExchangeRates above the high-water mark to the candles,
+    batch_size ticks per transaction.
+
+    Returns the number of ticks added.
+    """
+    state = CandleRollupState.objects.first()
+    if state is None:
+        state = CandleRollupState.objects.create()
+
+    tick_count = 0
+    while True:
+        rows = list(ExchangeRate.objects.filter(
+            id__gt=state.last_exchange_rate_id).order_by('id').values_list(
+                'id', 'base', 'quote', 'exchange', 'timestamp', 'bid', 'ask',
+                'price_scale')[:batch_size])
+        if not rows:
+            return tick_count
+        ticks = [
+            (id, base_id, quote_id, exchange_id, timestamp,
+             return_decimal(bid, price_scale), return_decimal(ask, price_scale))
+            for id, base_id, quote_id, exchange_id, timestamp, bid, ask, price_scale in rows
+        ]
+
+        with write_atomic():
+            save_candles(aggregate_ticks(ticks))
+            state.last_exchange_rate_id = ticks[-1][0]
+            state.save()
+        tick_count += len(ticks)
+
+
+def rebuild_candles(batch_size=ROLLUP_BATCH_SIZE):
+    """
+    Deletes all candles, then computes them again from all
+    ExchangeRates. Returns the number of ticks added.
+    """
+    with transaction.atomic():
+        Candle.objects.all().delete()
+        CandleRollupState.objects.all().delete()
+    return update_candles(batch_size)
+
+
+def aggregate_ticks(ticks):
+    """
+    Takes (id, base_id, quote_id, exchange_id, timestamp, bid, ask)
+    tuples, returns the aggregated ticks per candle, in the format:
+    {
+        (base_id, quote_id, exchange_id, period, start): {
+            'first_timestamp': ...,
+            'last_timestamp': ...,
+            'tick_count': ...,
+            'bid': [open, high, low, close],
+            'ask': [open, high, low, close],
+            'mid': [open, high, low, close],
+        },
+        ...
+    }
+    """
+    aggregates = {}
+    for _, base_id, quote_id, exchange_id, timestamp, bid, ask in ticks:
+        values = {'bid': bid, 'ask': ask, 'mid': (bid + ask) / 2}
+        for period in PERIOD_SECONDS:
+            key = (base_id, quote_id, exchange_id, period,
+                   return_period_start(timestamp, period))
+            aggregate = aggregates.get(key)
+            if aggregate is None:
+                aggregates[key] = {
+                    'first_timestamp': timestamp,
+                    'last_timestamp': timestamp,
+                    'tick_count': 1,
+                    **{series: [value] * 4 for series, value in values.items()},
+                }
+                continue
+
+            for series, value in values.items():
+                ohlc = aggregate[series]
+                ohlc[1] = max(ohlc[1], value)
+                ohlc[2] = min(ohlc[2], value)
+            if timestamp < aggregate['first_timestamp']:
+                aggregate['first_timestamp'] = timestamp
+                for series, value in values.items():
+                    aggregate[series][0] = value
+            if timestamp >= aggregate['last_timestamp']:
+                aggregate['last_timestamp'] = timestamp
+                for series, value in values.items():
+                    aggregate[series][3] = value
+            aggregate['tick_count'] += 1
+    return aggregates
+
+
+def return_new_candle(key, aggregate):
+    base_id, quote_id, exchange_id, period, start = key
+    candle = Candle(
+        base_id=base_id, quote_id=quote_id, exchange_id=exchange_id,
+        period=period, start=start,
+        first_timestamp=aggregate['first_timestamp'],
+        last_timestamp=aggregate['last_timestamp'],
+        tick_count=aggregate['tick_count'])
+    for series in SERIES:
+        (candle_open, candle_high, candle_low, candle_close) = aggregate[series]
+        setattr(candle, f'{series}_open', candle_open)
+        setattr(candle, f'{series}_high', candle_high)
+        setattr(candle, f'{series}_low', candle_low)
+        setattr(candle, f'{series}_close', candle_close)
+    return candle
+
+
+def merge_into_candle(candle, aggregate):
+    """
+    Adds the aggregated ticks to an existing candle.
+    """
+    for series in SERIES:
+        _, aggregate_high, aggregate_low, _ = aggregate[series]
+        setattr(candle, f'{series}_high', max(
+            getattr(candle, f'{series}_high'), aggregate_high))
+        setattr(candle, f'{series}_low', min(
+            getattr(candle, f'{series}_low'), aggregate_low))
+    if aggregate['first_timestamp'] < candle.first_timestamp:
+        candle.first_timestamp = aggregate['first_timestamp']
+        for series in SERIES:
+            setattr(candle, f'{series}_open', aggregate[series][0])
+    if aggregate['last_timestamp'] >= candle.last_timestamp:
+        candle.last_timestamp = aggregate['last_timestamp']
+        for series in SERIES:
+            setattr(candle, f'{series}_close', aggregate[series][3])
+    candle.tick_count += aggregate['tick_count']
+
+
+def save_candles(aggregates):
+    """
+    Takes the output of aggregate_ticks, merges the aggregates of
+    candles that already exist into the existing rows, adds the
+    others as new candles.
+    """
+    aggregates = dict(aggregates)
+    existing_candles = []
+    for period in PERIOD_SECONDS:
+        starts = sorted({key[4] for key in aggregates if key[3] == period})
+        for i in range(0, len(starts), BULK_BATCH_SIZE):
+            for candle in Candle.objects.filter(
+                    period=period, start__in=starts[i:i + BULK_BATCH_SIZE]):
+                key = (candle.base_id, candle.quote_id, candle.exchange_id,
+                       period, candle.start)
+                aggregate = aggregates.pop(key, None)
+                if aggregate is not None:
+                    merge_into_candle(candle, aggregate)
+                    existing_candles.append(candle)
+
+    Candle.objects.bulk_create(
+        [return_new_candle(key, aggregate)
+         for key, aggregate in aggregates.items()],
+        batch_size=BULK_BATCH_SIZE)
+    Candle.objects.bulk_update(
+        existing_candles,
+        ['first_timestamp', 'last_timestamp', 'tick_count'] + [
+            f'{series}_{field}' for series in SERIES
+            for field in ['open', 'high', 'low', 'close']],
+        batch_size=BULK_BATCH_SIZE)
@@ -0,0 +1,202 @@
+"""
+Converts any currency to the quote currencies in
+settings.CONVERSION_QUOTE_CURRENCIES (e.g. EUR, USD), also when there's
+no direct trading pair, through a chain of pairs, e.g. XYZ -> BTC -> EUR.
+
+ConversionIndex holds the best path from every currency to every quote
+currency. All trading pairs of all exchanges (TradingPairExchangePK)
+form one currency graph. Every pair costs 1, plus a penalty for less
+preferred exchanges (settings.CONVERSION_EXCHANGE_PREFERENCE, exchanges
+not listed there come last), so the path with the fewest pairs wins,
+and of those the one on the preferred exchanges. The paths are found
+once, with one Dijkstra search per quote currency.
+
+ConversionService keeps an index, checks at most every
+CONVERSION_INDEX_CHECK_INTERVAL seconds whether the pairs changed (by
+reading the pair keys, one query), and only then builds a new index.
+Conversions multiply the mid prices of the pairs on the path, taken
+from the latest price cache, with one cache lookup for all pairs of
+a batch.
+"""
+import heapq
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+
+from cryptodata.models import Currency, Exchange, TradingPairExchangePK
+from pricedata.latest_prices import latest_price_cache
+
+
+# Added to the cost of a pair per place down the exchange preference
+EXCHANGE_PREFERENCE_PENALTY = 0.01
+
+
+class ConversionIndex:
+    """
+    Takes (base_id, quote_id, exchange_id) tuples, the ids of the quote
+    currencies, and {exchange_id: penalty}.
+
+    paths has the format:
+    {
+        quote_id: {
+            currency_id: (
+                # (pair key, inverted): the price of the pair converts
+                # base to quote, inverted means the path goes from
+                # quote to base
+                ((base_id, quote_id, exchange_id), False),
+                ...
+            ),
+            ...
+        },
+        ...
+    }
+    """
+
+    def __init__(self, pair_keys, quote_ids, exchange_penalties=None):
+        exchange_penalties = exchange_penalties or {}
+        # {currency_id: {other_currency_id: (cost, pair key)}}, the
+        # cheapest pair between every two currencies
+        neighbours = {}
+        for key in pair_keys:
+            base_id, quote_id, exchange_id = key
+            if base_id == quote_id:
+                continue
+            cost = 1 + exchange_penalties.get(exchange_id, 0)
+            for currency_id, other_currency_id in ((base_id, quote_id), (quote_id, base_id)):
+                edges = neighbours.setdefault(currency_id, {})
+                if other_currency_id not in edges or cost < edges[other_currency_id][0]:
+                    edges[other_currency_id] = (cost, key)
+
+        self.paths = {
+            quote_id: self.return_paths(neighbours, quote_id)
+            for quote_id in quote_ids
+        }
+
+    @staticmethod
+    def return_paths(neighbours, target_id):
+        """
+        Returns the cheapest path from every currency to target_id,
+        with Dijkstra's algorithm, searching from the target.
+        """
+        costs = {target_id: 0}
+        # {currency_id: (step, next currency_id)}, towards the target
+        next_steps = {}
+        queue = [(0, target_id)]
+        while queue:
+            cost, currency_id = heapq.heappop(queue)
+            if cost > costs[currency_id]:
+                continue
+            for other_currency_id, (edge_cost, key) in neighbours.get(currency_id, {}).items():
+                other_cost = cost + edge_cost
+                if other_cost < costs.get(other_currency_id, float('inf')):
+                    costs[other_currency_id] = other_cost
+                    # Converting other currency to this one: the pair's
+                    # price if other currency is its base
+                    next_steps[other_currency_id] = (
+                        (key, key[0] != other_currency_id), currency_id)
+                    heapq.heappush(queue, (other_cost, other_currency_id))
+
+        paths = {target_id: ()}
+        for currency_id in sorted(costs, key=costs.get):
+            if currency_id != target_id:
+                step, next_currency_id = next_steps[currency_id]
+                paths[currency_id] = (step,) + paths[next_currency_id]
+        return paths
+
+
+def return_pair_keys():
+    """
+    Returns the (base_id, quote_id, exchange_id) of all
+    TradingPairExchangePKs, as a frozenset. Compared to the keys the
+    index was built from, it shows any change of the pairs, unlike
+    e.g. their count and max id, which don't change when a pair is
+    deleted and another added.
+    """
+    return frozenset(TradingPairExchangePK.objects.values_list(
+        'trading_pair__currency1', 'trading_pair__currency2', 'exchange'))
+
+
+def build_conversion_index(pair_keys):
+    quote_ids = Currency.objects.filter(
+        ticker_symbol__in=settings.CONVERSION_QUOTE_CURRENCIES).values_list(
+            'id', flat=True)
+    preference = settings.CONVERSION_EXCHANGE_PREFERENCE
+    # Exchanges that aren't listed get the largest penalty
+    exchange_penalties = {
+        exchange_id: (
+            preference.index(name) if name in preference else len(preference)
+        ) * EXCHANGE_PREFERENCE_PENALTY
+        for exchange_id, name in Exchange.objects.values_list('id', 'name')
+    }
+    return ConversionIndex(pair_keys, quote_ids, exchange_penalties)
+
+
+class ConversionService:
+
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._index = None
+        self._pair_keys = None
+        self._checked = None
+
+    def get_index(self):
+        """
+        Returns the ConversionIndex, builds a new one if the pairs
+        changed since it was built.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._checked is None or now - self._checked >= self.check_interval:
+                pair_keys = return_pair_keys()
+                if self._index is None or pair_keys != self._pair_keys:
+                    self._index = build_conversion_index(pair_keys)
+                    self._pair_keys = pair_keys
+                self._checked = now
+            return self._index
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+            self._checked = None
+
+    def convert_many(self, currency_ids, quote_id):
+        """
+        Returns the price of each currency in the quote currency, in
+        the format:
+        {currency_id: (rate, path)}
+
+        Currencies without a path to the quote currency, or with a
+        pair on the path without any rate, are left out. Raises
+        KeyError if quote_id isn't one of the quote currencies.
+        """
+        paths = self.get_index().paths[quote_id]
+        currency_paths = {
+            currency_id: paths[currency_id]
+            for currency_id in currency_ids if currency_id in paths
+        }
+        prices = latest_price_cache.get_many({
+            key for path in currency_paths.values() for key, _ in path})
+
+        rates = {}
+        for currency_id, path in currency_paths.items():
+            rate = Decimal(1)
+            for key, inverted in path:
+                if key not in prices:
+                    break
+                bid, ask, _ = prices[key]
+                mid = (bid + ask) / 2
+                if not mid:
+                    break
+                if inverted:
+                    rate /= mid
+                else:
+                    rate *= mid
+            else:
+                rates[currency_id] = (rate, path)
+        return rates
+
+
+conversion_service = ConversionService(settings.CONVERSION_INDEX_CHECK_INTERVAL)
@@ -0,0 +1,121 @@
+from decimal import Decimal
+
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+
+INT64_MAX = 2 ** 63 - 1
+MAX_DECIMAL_PLACES = 18
+# How many times a price can grow before it doesn't fit anymore at the
+# number of decimal places chosen for it
+PRICE_HEADROOM = 1000
+
+
+def return_decimal_places(price):
+    """
+    Returns the most decimal places (at most MAX_DECIMAL_PLACES) at
+    which PRICE_HEADROOM times price still fits in 64 bits.
+    """
+    price = abs(Decimal(price))
+    if not price:
+        return MAX_DECIMAL_PLACES
+    decimal_places = (Decimal(INT64_MAX) / (price * PRICE_HEADROOM)).adjusted()
+    return max(0, min(MAX_DECIMAL_PLACES, decimal_places))
+
+
+def fits_decimal_places(price, decimal_places):
+    return abs(Decimal(price).scaleb(decimal_places)) <= INT64_MAX
+
+
+def return_units(value, decimal_places):
+    """
+    Returns value (a Decimal) as an integer number of
+    10 ** -decimal_places units, rounded half to even. Raises
+    ValueError if it doesn't fit in 64 bits.
+    """
+    units = int(Decimal(value).scaleb(decimal_places).to_integral_value())
+    if abs(units) > INT64_MAX:
+        raise ValueError(
+            f"{value} doesn't fit in 64 bits with {decimal_places} decimal places")
+    return units
+
+
+def return_decimal(units, decimal_places):
+    return Decimal(units).scaleb(-decimal_places)
+
+
+class FixedPointDescriptor(DeferredAttribute):
+    """
+    Holds the value as stored (an int) or as set (a Decimal) and returns
+    it as a Decimal, converted with the instance's current scale.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        super().__init__(field.attname)
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, int):
+            return return_decimal(
+                value, getattr(instance, self.field.scale_field))
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class FixedPointField(models.BigIntegerField):
+    """
+    A decimal value, stored as a 64 bit integer number of
+    10 ** -decimal_places units. The number of decimal places is read
+    from another field of the same instance, scale_field, so it can
+    differ per row.
+
+    Instances return the value as a Decimal. Queries (filter,
+    values_list, aggregates) work on the stored integers, so they only
+    compare rows with the same scale, and filter values should be
+    given as units. Rows of one ExchangeRate pair can have different
+    scales (the pair's scale is lowered when its prices outgrow it), so
+    SQL filters, ordering and aggregates on bid or ask are only right
+    within one price_scale: filter or group on it as well, or convert
+    the values first.
+
+    Values set as Decimal are rounded to the scale on saving (also by
+    bulk_create), so scale_field has to be set by then. Not supported
+    by bulk_update, which doesn't call pre_save.
+    """
+
+    def __init__(self, *args, scale_field, **kwargs):
+        self.scale_field = scale_field
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['scale_field'] = self.scale_field
+        return name, path, args, kwargs
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super().contribute_to_class(cls, name, **kwargs)
+        setattr(cls, self.attname, FixedPointDescriptor(self))
+
+    def pre_save(self, model_instance, add):
+        value = model_instance.__dict__.get(self.attname)
+        if value is None or isinstance(value, int):
+            return value
+        decimal_places = getattr(model_instance, self.scale_field)
+        if decimal_places is None:
+            raise ValueError(
+                f"Can't save {self.name} before {self.scale_field} is set")
+        units = return_units(value, decimal_places)
+        model_instance.__dict__[self.attname] = units
+        return units
+
+    def get_prep_value(self, value):
+        if isinstance(value, (Decimal, float)):
+            raise TypeError(
+                f"{self.name} is compared as units, not as a "
+                f"{type(value).__name__}")
+        return super().get_prep_value(value)
@@ -0,0 +1,107 @@
+"""
+In-process cache of the latest bid/ask per (base_id, quote_id,
+exchange_id).
+
+Code that saves ExchangeRates in this process (e.g. the
+poll_exchange_rates command) puts them in the cache with
+update_from_rates. Other processes (e.g. the web server) fill it from
+the db on a miss, and keep the entries for LATEST_PRICE_CACHE_TTL
+seconds, so repeated reads of the same pairs don't touch the db. Pairs
+without rates are cached too, as None.
+The least recently used entries are evicted once the cache holds
+LATEST_PRICE_CACHE_SIZE pairs.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from pricedata.models import ExchangeRate
+
+
+# Returned by get for pairs that aren't cached
+MISSED = object()
+
+
+class LatestPriceCache:
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # {(base_id, quote_id, exchange_id): (expires, (bid, ask, timestamp) or None)}
+        self._prices = OrderedDict()
+
+    def get(self, key, default=None):
+        """
+        Returns (bid, ask, timestamp) of the pair, None if it's cached
+        as having no rates, or default if it isn't cached or has
+        expired.
+        """
+        with self._lock:
+            entry = self._prices.get(key)
+            if entry is None:
+                return default
+            expires, price = entry
+            if expires < time.monotonic():
+                del self._prices[key]
+                return default
+            self._prices.move_to_end(key)
+            return price
+
+    def set(self, key, price):
+        with self._lock:
+            self._prices[key] = (time.monotonic() + self.ttl, price)
+            self._prices.move_to_end(key)
+            while len(self._prices) > self.max_size:
+                self._prices.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._prices.clear()
+
+    def update_from_rates(self, exchange_rates):
+        """
+        Puts newly saved ExchangeRates in the cache, skips rates that
+        are older than the cached rate of their pair.
+        """
+        for exchange_rate in exchange_rates:
+            key = (exchange_rate.base_id, exchange_rate.quote_id,
+                   exchange_rate.exchange_id)
+            cached_price = self.get(key)
+            if cached_price is not None and cached_price[2] > exchange_rate.timestamp:
+                continue
+            self.set(key, (exchange_rate.bid, exchange_rate.ask,
+                           exchange_rate.timestamp))
+
+    def get_many(self, keys):
+        """
+        Returns the cached (bid, ask, timestamp) of each pair in keys,
+        reads the pairs that aren't cached from the db, together (see
+        latest_for_pairs). Pairs without any rate are left out.
+        """
+        prices = {}
+        missed_keys = []
+        for key in keys:
+            price = self.get(key, MISSED)
+            if price is MISSED:
+                missed_keys.append(key)
+            elif price is not None:
+                prices[key] = price
+
+        if missed_keys:
+            exchange_rates = ExchangeRate.objects.latest_for_pairs(missed_keys)
+            for key in missed_keys:
+                exchange_rate = exchange_rates.get(key)
+                price = None
+                if exchange_rate is not None:
+                    price = (exchange_rate.bid, exchange_rate.ask,
+                             exchange_rate.timestamp)
+                    prices[key] = price
+                self.set(key, price)
+        return prices
+
+
+latest_price_cache = LatestPriceCache(
+    settings.LATEST_PRICE_CACHE_TTL, settings.LATEST_PRICE_CACHE_SIZE)
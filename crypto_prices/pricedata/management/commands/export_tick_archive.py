@@ -0,0 +1,37 @@
+from django.core.management.base import CommandError
+
+from common.instrumentation import InstrumentedCommand
+from pricedata.tick_archive import write_tick_archive
+from pricedata.utils import parse_pair
+
+
+class Command(InstrumentedCommand):
+    help = """
+    Exports the ExchangeRate history to a binary tick archive in
+    DIRECTORY: per pair one file per column (timestamps as int64 ns,
+    bid and ask as float64) and an index.json file. See
+    pricedata.tick_archive for the format and the TickArchive reader.
+
+    Use --pair BASE_ID-QUOTE_ID-EXCHANGE_ID (repeatable) to export only
+    some pairs, all pairs are exported otherwise.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument(
+            '--pair', action='append', dest='pairs', metavar='BASE-QUOTE-EXCHANGE',
+            help="Only export this pair, given as ids, e.g. 1-2-1")
+
+    def handle(self, *args, **options):
+        pairs = None
+        if options['pairs']:
+            try:
+                pairs = [parse_pair(pair) for pair in options['pairs']]
+            except ValueError:
+                raise CommandError("--pair must be BASE_ID-QUOTE_ID-EXCHANGE_ID")
+
+        index = write_tick_archive(options['directory'], pairs)
+        tick_count = sum(pair['count'] for pair in index['pairs'])
+        self.stdout.write(
+            f"{tick_count} rates of {len(index['pairs'])} pairs exported "
+            f"to {options['directory']}")
@@ -0,0 +1,84 @@
+from django.conf import settings
+
+from common.instrumentation import InstrumentedCommand
+from pricedata.management.commands.utils.poll_exchange_rates_utils import ExchangeRatePoller, return_pair_keys
+from pricedata.management.commands.utils.scan_arbitrage_utils import format_opportunity
+
+
+class Command(InstrumentedCommand):
+    help = """
+    Keeps polling the bid/ask of all trading pairs (see
+    TradingPairExchangePK) of the exchanges in settings.EXCHANGES,
+    and saves them as ExchangeRate.
+
+    Each exchange is polled at its own interval, from
+    settings.EXCHANGE_POLL_INTERVALS, with one request for all of its
+    pairs. Only rates that changed since the previous poll are saved.
+
+    Use --scan-arbitrage to check the triangular arbitrage cycles of
+    every saved rate (see pricedata.arbitrage, requires numpy).
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float,
+            help="Seconds between polls, for all exchanges "
+                 "(default: settings.EXCHANGE_POLL_INTERVALS)")
+        parser.add_argument(
+            '--queue-size', type=int, default=10000,
+            help="Maximum number of rates waiting to be saved")
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Poll each exchange once, then stop")
+        parser.add_argument(
+            '--scan-arbitrage', action='store_true',
+            help="Print the triangular arbitrage opportunities after "
+                 "every saved batch of rates")
+        parser.add_argument(
+            '--min-profit', type=float, default=0.0,
+            help="With --scan-arbitrage, only print cycles returning more "
+                 "than this fraction")
+        parser.add_argument(
+            '--fee', type=float, default=0.0,
+            help="With --scan-arbitrage, fee per trade, as a fraction")
+
+    def handle(self, *args, **options):
+        pair_keys = return_pair_keys(settings.EXCHANGES)
+        intervals = {
+            exchange_name: options['interval'] or settings.EXCHANGE_POLL_INTERVALS[exchange_name]
+            for exchange_name in settings.EXCHANGES
+        }
+        for exchange_name, keys in pair_keys.items():
+            self.stdout.write(
+                f"{exchange_name}: polling {len(keys)} pairs every "
+                f"{intervals[exchange_name]}s")
+
+        on_saved = None
+        if options['scan_arbitrage']:
+            on_saved = self.return_arbitrage_scanner(options)
+
+        poller = ExchangeRatePoller(
+            pair_keys, intervals, queue_size=options['queue_size'],
+            on_saved=on_saved, on_error=self.stderr.write)
+        poller.run(once=options['once'])
+        self.stdout.write(f"{poller.saved_count} rates saved")
+        if poller.failed_count:
+            self.stdout.write(f"{poller.failed_count} rates failed to save")
+
+    def return_arbitrage_scanner(self, options):
+        """
+        Returns a function that updates an ArbitrageScanner with saved
+        rates, and prints the opportunities found.
+        """
+        from pricedata.arbitrage import ArbitrageScanner
+
+        scanner = ArbitrageScanner.from_db(
+            fee=options['fee'], min_profit=options['min_profit'])
+        scanner.load_latest_prices()
+        self.stdout.write(
+            f"Scanning {len(scanner.triangle_edges)} arbitrage cycles")
+
+        def scan_rates(exchange_rates):
+            for opportunity in scanner.update_from_rates(exchange_rates):
+                self.stdout.write(format_opportunity(opportunity))
+        return scan_rates
@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import CommandError
+
+from common.instrumentation import InstrumentedCommand
+from pricedata.analytics import summarize_frame
+from pricedata.models import ExchangeRate
+from pricedata.price_frame import load_price_frame
+from pricedata.utils import parse_pair, parse_timestamp
+
+
+class Command(InstrumentedCommand):
+    help = """
+    Prints spread, return and volatility statistics of the stored
+    rates per pair, and the price differences between exchanges of the
+    same pair, as json (see pricedata.analytics). Requires numpy.
+
+    Use --pair BASE_ID-QUOTE_ID-EXCHANGE_ID (repeatable) to select
+    pairs, all pairs are analysed otherwise.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pair', action='append', dest='pairs', metavar='BASE-QUOTE-EXCHANGE',
+            help="Only analyse this pair, given as ids, e.g. 1-2-1")
+        parser.add_argument('--start', help="ISO 8601 datetime, inclusive")
+        parser.add_argument('--end', help="ISO 8601 datetime, exclusive")
+        parser.add_argument(
+            '--window', type=int, default=100,
+            help="Ticks per rolling window (default 100)")
+
+    def handle(self, *args, **options):
+        queryset = ExchangeRate.objects.all()
+        try:
+            pairs = None
+            if options['pairs']:
+                pairs = [parse_pair(pair) for pair in options['pairs']]
+            if options['start']:
+                queryset = queryset.filter(
+                    timestamp__gte=parse_timestamp(options['start']))
+            if options['end']:
+                queryset = queryset.filter(
+                    timestamp__lt=parse_timestamp(options['end']))
+        except ValueError as error:
+            raise CommandError(error)
+        if options['window'] < 1:
+            raise CommandError("--window should be at least 1")
+
+        frame = load_price_frame(queryset, pairs=pairs)
+        self.stdout.write(json.dumps(
+            summarize_frame(frame, options['window']), indent=4))
@@ -0,0 +1,25 @@
+from common.instrumentation import InstrumentedCommand
+from pricedata.candles import rebuild_candles, update_candles
+
+
+class Command(InstrumentedCommand):
+    help = """
+    Adds the ExchangeRates saved since the last run to the 1m, 5m, 1h
+    and 1d candles (see pricedata.candles). Meant to be run often,
+    e.g. every minute.
+
+    Use --rebuild to (re)compute the candles from the complete
+    ExchangeRate history, e.g. the first time.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help="Delete all candles and compute them from all rates")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            tick_count = rebuild_candles()
+        else:
+            tick_count = update_candles()
+        self.stdout.write(f"{tick_count} rates added to the candles")
@@ -0,0 +1,45 @@
+import time
+
+from common.instrumentation import InstrumentedCommand
+from cryptodata.models import Currency, Exchange
+from pricedata.arbitrage import ArbitrageScanner
+from pricedata.management.commands.utils.scan_arbitrage_utils import format_opportunity
+
+
+class Command(InstrumentedCommand):
+    help = """
+    Checks all triangular arbitrage cycles of the trading pairs of
+    every exchange, using the latest bid/ask of each pair, and prints
+    the cycles that return more than they cost (see
+    pricedata.arbitrage). Requires numpy.
+
+    To check cycles as new rates come in, use poll_exchange_rates
+    --scan-arbitrage.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-profit', type=float, default=0.0,
+            help="Only print cycles returning more than this fraction")
+        parser.add_argument(
+            '--fee', type=float, default=0.0,
+            help="Fee per trade, as a fraction, e.g. 0.001")
+
+    def handle(self, *args, **options):
+        scanner = ArbitrageScanner.from_db(
+            fee=options['fee'], min_profit=options['min_profit'])
+        scanner.load_latest_prices()
+
+        started = time.perf_counter()
+        opportunities = scanner.scan()
+        duration = time.perf_counter() - started
+
+        currency_symbols = dict(Currency.objects.values_list('id', 'ticker_symbol'))
+        exchange_names = dict(Exchange.objects.values_list('id', 'name'))
+        for opportunity in opportunities:
+            self.stdout.write(format_opportunity(
+                opportunity, currency_symbols, exchange_names))
+        self.stdout.write(
+            f"{len(opportunities)} opportunities in "
+            f"{len(scanner.triangle_edges)} cycles, scanned in "
+            f"{duration * 1000:.2f}ms")
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import requests
+
+from django.conf import settings
+from django.db import DatabaseError, connection, connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from common import http_client, metrics
+from common.instrumentation import stage
+from cryptodata.models import TradingPairExchangePK
+from pricedata.latest_prices import latest_price_cache
+from pricedata.models import ExchangeRate
+
+
+logger = logging.getLogger(__name__)
+
+BULK_CREATE_BATCH_SIZE = 500
+
+# Endpoints that return the best bid/ask of many pairs at once
+TICKER_ENDPOINTS = {
+    'Binance': 'https://api.binance.com/api/v3/ticker/bookTicker',
+    'Bittrex': 'https://api.bittrex.com/api/v1.1/public/getmarketsummaries',
+    'Kraken': 'https://api.kraken.com/0/public/Ticker',
+}
+
+
+def return_pair_keys(exchange_names):
+    """
+    Returns the trading pairs to poll, per exchange, in the format:
+    {exchange_name: {key: (exchange_id, base_id, quote_id)}}
+    """
+    pair_keys = {exchange_name: {} for exchange_name in exchange_names}
+    exchange_pks = TradingPairExchangePK.objects.filter(
+        exchange__name__in=exchange_names).values_list(
+            'exchange__name', 'key', 'exchange',
+            'trading_pair__currency1', 'trading_pair__currency2')
+    for exchange_name, key, exchange_id, base_id, quote_id in exchange_pks:
+        pair_keys[exchange_name][key] = (exchange_id, base_id, quote_id)
+    return pair_keys
+
+
+@stage('fetch')
+def fetch_tickers(exchange_name, keys):
+    """
+    Fetches the bid/ask of all pairs of the exchange with one request,
+    returns the parsed json.
+    """
+    params = None
+    if exchange_name == 'Kraken':
+        params = {'pair': ','.join(sorted(keys))}
+    return http_client.get_json(TICKER_ENDPOINTS[exchange_name], params=params)
+
+
+@stage('parse')
+def parse_tickers(exchange_name, raw_data):
+    """
+    Takes the json returned by fetch_tickers, returns a list of
+    (key, bid, ask, timestamp) tuples. timestamp is None if the
+    exchange doesn't provide one.
+    """
+    if exchange_name == 'Binance':
+        return [
+            (ticker['symbol'], Decimal(ticker['bidPrice']),
+             Decimal(ticker['askPrice']), None)
+            for ticker in raw_data
+        ]
+    if exchange_name == 'Bittrex':
+        return [
+            (ticker['MarketName'], Decimal(str(ticker['Bid'])),
+             Decimal(str(ticker['Ask'])),
+             parse_bittrex_timestamp(ticker['TimeStamp']))
+            for ticker in raw_data['result']
+            if ticker['Bid'] is not None and ticker['Ask'] is not None
+        ]
+    if exchange_name == 'Kraken':
+        return [
+            (key, Decimal(ticker['b'][0]), Decimal(ticker['a'][0]), None)
+            for key, ticker in raw_data['result'].items()
+        ]
+
+
+def parse_bittrex_timestamp(value):
+    """
+    Bittrex timestamps are in UTC, without timezone.
+    """
+    timestamp = parse_datetime(value)
+    if timestamp is not None and timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp, timezone.utc)
+    return timestamp
+
+
+class ExchangeRatePoller:
+    """
+    Polls the ticker endpoints of several exchanges and saves the
+    rates as ExchangeRate.
+
+    Every exchange is polled by its own coroutine, at its own interval.
+    The http requests run in threads (using the shared http client),
+    the parsed rates go into a bounded queue. One writer coroutine
+    drains the queue and saves everything that's waiting with one
+    bulk_create, in a single db thread. Rates that didn't change since
+    the last poll aren't saved again.
+
+    The pollers wait when the queue is full, so a slow db slows the
+    polling down instead of using up memory. A batch that can't be
+    saved (DatabaseError) is reported and dropped, its rates are saved
+    again when they're polled next. Any other error of the writer
+    stops the pollers, and is raised by run().
+
+    on_saved, if given, is called with every list of saved rates, in
+    the db thread. on_error is called with a message for every failed
+    poll or batch, it logs the message by default.
+
+    The metrics are saved (as job metrics_job) every
+    METRICS_SNAPSHOT_INTERVAL seconds, in the db thread.
+    """
+    metrics_job = 'poll_exchange_rates'
+
+    def __init__(self, pair_keys, intervals, queue_size=10000, batch_size=BULK_CREATE_BATCH_SIZE, on_saved=None,
+                 on_error=logger.error):
+        self.pair_keys = pair_keys
+        self.intervals = intervals
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.on_saved = on_saved
+        self.on_error = on_error
+        # {(exchange_id, base_id, quote_id): (bid, ask)}
+        self.last_rates = {}
+        self.saved_count = 0
+        self.failed_count = 0
+        self.metrics_saved = time.monotonic()
+        self.queue_depth = metrics.writer_queue_depth.labels()
+        self.rows_inserted = metrics.rows_inserted.labels('ExchangeRate')
+
+    def run(self, once=False):
+        """
+        Polls until interrupted, or one round per exchange if once.
+        """
+        with ThreadPoolExecutor(max_workers=1) as db_executor, \
+                ThreadPoolExecutor(max_workers=len(self.pair_keys) or 1) as fetch_executor:
+            self.db_executor = db_executor
+            self.fetch_executor = fetch_executor
+            asyncio.run(self.poll_and_write(once))
+            db_executor.submit(connections.close_all).result()
+
+    async def poll_and_write(self, once):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        writer = asyncio.ensure_future(self.write_rates())
+        pollers = asyncio.gather(*[
+            self.poll_exchange(exchange_name, once)
+            for exchange_name, keys in self.pair_keys.items() if keys
+        ])
+        await asyncio.wait([writer, pollers], return_when=asyncio.FIRST_COMPLETED)
+        if writer.done():
+            # The writer only stops before the pollers if it failed,
+            # don't leave them waiting for room in the queue
+            pollers.cancel()
+            try:
+                await pollers
+            except asyncio.CancelledError:
+                pass
+            writer.result()
+        await pollers
+        await self.queue.put(None)
+        await writer
+
+    async def poll_exchange(self, exchange_name, once):
+        loop = asyncio.get_running_loop()
+        keys = self.pair_keys[exchange_name]
+        while True:
+            started = loop.time()
+            try:
+                raw_data = await loop.run_in_executor(
+                    self.fetch_executor, fetch_tickers, exchange_name, keys)
+                rates = parse_tickers(exchange_name, raw_data)
+            except (requests.RequestException, ValueError, KeyError) as error:
+                self.on_error(f"{exchange_name}: polling failed: {error!r}")
+            else:
+                for exchange_rate in self.return_changed_rates(exchange_name, rates):
+                    await self.queue.put(exchange_rate)
+                self.queue_depth.set(self.queue.qsize())
+                metrics.last_poll.labels(exchange_name).set(time.time())
+
+            if once:
+                return
+            await asyncio.sleep(max(
+                0, self.intervals[exchange_name] - (loop.time() - started)))
+
+    @stage('normalize')
+    def return_changed_rates(self, exchange_name, rates):
+        """
+        Returns unsaved ExchangeRate instances for the rates of known
+        pairs that changed since the last poll.
+        """
+        keys = self.pair_keys[exchange_name]
+        now = timezone.now()
+        exchange_rates = []
+        for key, bid, ask, timestamp in rates:
+            if key not in keys:
+                continue
+            if self.last_rates.get(keys[key]) == (bid, ask):
+                continue
+            self.last_rates[keys[key]] = (bid, ask)
+            exchange_id, base_id, quote_id = keys[key]
+            exchange_rates.append(ExchangeRate(
+                currency_id=base_id, exchange_id=exchange_id,
+                base_id=base_id, quote_id=quote_id,
+                bid=bid, ask=ask, timestamp=timestamp or now))
+        return exchange_rates
+
+    async def write_rates(self):
+        loop = asyncio.get_running_loop()
+        finished = False
+        while not finished:
+            exchange_rate = await self.queue.get()
+            if exchange_rate is None:
+                break
+            batch = [exchange_rate]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                exchange_rate = self.queue.get_nowait()
+                if exchange_rate is None:
+                    finished = True
+                    break
+                batch.append(exchange_rate)
+            self.queue_depth.set(self.queue.qsize())
+            error = await loop.run_in_executor(
+                self.db_executor, self.save_batch, batch)
+            if error is not None:
+                self.failed_count += len(batch)
+                self.on_error(f"Saving {len(batch)} rates failed: {error!r}")
+                # Save them again on the next poll, even if unchanged
+                for exchange_rate in batch:
+                    self.last_rates.pop(
+                        (exchange_rate.exchange_id, exchange_rate.base_id, exchange_rate.quote_id), None)
+
+    def save_batch(self, exchange_rates):
+        """
+        Saves the rates, returns the DatabaseError if that failed, or
+        None.
+        """
+        try:
+            self.save_rates(exchange_rates)
+        except DatabaseError as error:
+            connection.close_if_unusable_or_obsolete()
+            return error
+        if time.monotonic() - self.metrics_saved >= settings.METRICS_SNAPSHOT_INTERVAL:
+            self.metrics_saved = time.monotonic()
+            try:
+                metrics.registry.save_snapshot(self.metrics_job)
+            except DatabaseError as error:
+                connection.close_if_unusable_or_obsolete()
+                self.on_error(f"Saving the metrics failed: {error!r}")
+        return None
+
+    @stage('write')
+    def save_rates(self, exchange_rates):
+        ExchangeRate.objects.bulk_create(
+            exchange_rates, batch_size=BULK_CREATE_BATCH_SIZE)
+        latest_price_cache.update_from_rates(exchange_rates)
+        self.saved_count += len(exchange_rates)
+        self.rows_inserted.inc(len(exchange_rates))
+        if self.on_saved is not None:
+            self.on_saved(exchange_rates)
@@ -0,0 +1,23 @@
+from cryptodata.models import Currency, Exchange
+
+
+def format_opportunity(opportunity, currency_symbols=None, exchange_names=None):
+    """
+    Returns an opportunity of ArbitrageScanner as one line of text, e.g.:
+    Kraken: BTC -> EUR -> ETH -> BTC: 0.1200%
+
+    Currency and exchange names are read from the db, unless given as
+    {id: name} dicts.
+    """
+    if currency_symbols is None:
+        currency_symbols = dict(Currency.objects.filter(
+            id__in=opportunity['currencies']).values_list('id', 'ticker_symbol'))
+    if exchange_names is None:
+        exchange_names = dict(Exchange.objects.filter(
+            id=opportunity['exchange']).values_list('id', 'name'))
+    currencies = opportunity['currencies'] + opportunity['currencies'][:1]
+    cycle = ' -> '.join(
+        currency_symbols.get(currency_id) or str(currency_id)
+        for currency_id in currencies)
+    exchange = exchange_names.get(opportunity['exchange'], opportunity['exchange'])
+    return f"{exchange}: {cycle}: {opportunity['profit']:.4%}"
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:25
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pricedata', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='exchangerate',
+            options={'get_latest_by': 'timestamp'},
+        ),
+        migrations.AlterField(
+            model_name='exchangerate',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='exchangerate',
+            index=models.Index(fields=['base', 'quote', 'exchange', 'timestamp'], name='exchangerate_pair_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exchangerate',
+            index=models.Index(fields=['timestamp'], name='exchangerate_time_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptodata', '0014_apisnapshot'),
+        ('pricedata', '0002_exchangerate_time_series_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CandleRollupState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_exchange_rate_id', models.BigIntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Candle',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('1m', '1 minute'), ('5m', '5 minutes'), ('1h', '1 hour'), ('1d', '1 day')], max_length=2)),
+                ('start', models.DateTimeField()),
+                ('first_timestamp', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('tick_count', models.PositiveIntegerField()),
+                ('bid_open', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('bid_high', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('bid_low', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('bid_close', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('ask_open', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('ask_high', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('ask_low', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('ask_close', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('mid_open', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('mid_high', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('mid_low', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('mid_close', models.DecimalField(decimal_places=20, max_digits=40)),
+                ('base', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cryptodata.Currency')),
+                ('exchange', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cryptodata.Exchange')),
+                ('quote', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cryptodata.Currency')),
+            ],
+            options={
+                'ordering': ['start'],
+                'unique_together': {('base', 'quote', 'exchange', 'period', 'start')},
+            },
+        ),
+    ]
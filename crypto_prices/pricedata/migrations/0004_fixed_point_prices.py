@@ -0,0 +1,53 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pricedata', '0003_candle'),
+    ]
+
+    operations = [
+        # Nullable, so the migration can be reversed after 0006 drops them
+        migrations.AlterField(
+            model_name='exchangerate',
+            name='ask',
+            field=models.DecimalField(decimal_places=20, max_digits=40, null=True),
+        ),
+        migrations.AlterField(
+            model_name='exchangerate',
+            name='bid',
+            field=models.DecimalField(decimal_places=20, max_digits=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='exchangerate',
+            name='ask_units',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='exchangerate',
+            name='bid_units',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='exchangerate',
+            name='price_scale',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.CreateModel(
+            name='PriceScale',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('decimal_places', models.PositiveSmallIntegerField()),
+                ('base', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cryptodata.Currency')),
+                ('exchange', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cryptodata.Exchange')),
+                ('quote', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cryptodata.Currency')),
+            ],
+            options={
+                'unique_together': {('base', 'quote', 'exchange')},
+            },
+        ),
+    ]
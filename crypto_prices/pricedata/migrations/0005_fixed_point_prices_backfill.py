@@ -0,0 +1,76 @@
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Max
+
+from pricedata.fields import return_decimal_places, return_units
+
+
+BATCH_SIZE = 2000
+
+
+def fill_fixed_point_prices(apps, schema_editor):
+    """
+    Chooses the decimal places of every pair from its highest price,
+    then converts the bid and ask of every rate to units.
+    """
+    ExchangeRate = apps.get_model('pricedata', 'ExchangeRate')
+    PriceScale = apps.get_model('pricedata', 'PriceScale')
+
+    scales = {}
+    for pair in ExchangeRate.objects.order_by().values(
+            'base', 'quote', 'exchange').annotate(
+                max_bid=Max('bid'), max_ask=Max('ask')):
+        key = (pair['base'], pair['quote'], pair['exchange'])
+        scales[key] = return_decimal_places(max(pair['max_bid'], pair['max_ask']))
+    PriceScale.objects.bulk_create([
+        PriceScale(base_id=base_id, quote_id=quote_id, exchange_id=exchange_id,
+                   decimal_places=decimal_places)
+        for (base_id, quote_id, exchange_id), decimal_places in scales.items()
+    ], batch_size=BATCH_SIZE)
+
+    last_id = 0
+    while True:
+        exchange_rates = list(ExchangeRate.objects.filter(
+            id__gt=last_id).order_by('id').only(
+                'id', 'base', 'quote', 'exchange', 'bid', 'ask')[:BATCH_SIZE])
+        if not exchange_rates:
+            return
+        for exchange_rate in exchange_rates:
+            decimal_places = scales[(exchange_rate.base_id, exchange_rate.quote_id,
+                                     exchange_rate.exchange_id)]
+            exchange_rate.price_scale = decimal_places
+            exchange_rate.bid_units = return_units(exchange_rate.bid, decimal_places)
+            exchange_rate.ask_units = return_units(exchange_rate.ask, decimal_places)
+        ExchangeRate.objects.bulk_update(
+            exchange_rates, ['bid_units', 'ask_units', 'price_scale'])
+        last_id = exchange_rates[-1].id
+
+
+def fill_decimal_prices(apps, schema_editor):
+    ExchangeRate = apps.get_model('pricedata', 'ExchangeRate')
+    last_id = 0
+    while True:
+        exchange_rates = list(ExchangeRate.objects.filter(
+            id__gt=last_id).order_by('id').only(
+                'id', 'bid_units', 'ask_units', 'price_scale')[:BATCH_SIZE])
+        if not exchange_rates:
+            return
+        for exchange_rate in exchange_rates:
+            exchange_rate.bid = Decimal(exchange_rate.bid_units).scaleb(
+                -exchange_rate.price_scale)
+            exchange_rate.ask = Decimal(exchange_rate.ask_units).scaleb(
+                -exchange_rate.price_scale)
+        ExchangeRate.objects.bulk_update(exchange_rates, ['bid', 'ask'])
+        last_id = exchange_rates[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pricedata', '0004_fixed_point_prices'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_fixed_point_prices, fill_decimal_prices),
+    ]
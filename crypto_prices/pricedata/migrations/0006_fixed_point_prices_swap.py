@@ -0,0 +1,46 @@
+from django.db import migrations, models
+
+import pricedata.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pricedata', '0005_fixed_point_prices_backfill'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='exchangerate',
+            name='bid',
+        ),
+        migrations.RemoveField(
+            model_name='exchangerate',
+            name='ask',
+        ),
+        migrations.RenameField(
+            model_name='exchangerate',
+            old_name='bid_units',
+            new_name='bid',
+        ),
+        migrations.RenameField(
+            model_name='exchangerate',
+            old_name='ask_units',
+            new_name='ask',
+        ),
+        migrations.AlterField(
+            model_name='exchangerate',
+            name='bid',
+            field=pricedata.fields.FixedPointField(scale_field='price_scale'),
+        ),
+        migrations.AlterField(
+            model_name='exchangerate',
+            name='ask',
+            field=pricedata.fields.FixedPointField(scale_field='price_scale'),
+        ),
+        migrations.AlterField(
+            model_name='exchangerate',
+            name='price_scale',
+            field=models.PositiveSmallIntegerField(),
+        ),
+    ]
@@ -1,15 +1,224 @@
+import operator
+from functools import reduce
+
 from django.db import models
+from django.utils import timezone
+
 from cryptodata.models import Currency, Exchange
+from pricedata.fields import FixedPointField, fits_decimal_places, return_decimal_places
+
+
+# Pairs per latest_for_pairs query, each adds a subquery
+LATEST_FOR_PAIRS_CHUNK_SIZE = 100
+
+
+class ExchangeRateQuerySet(models.QuerySet):
+    """
+    Queries that can be answered from the (base, quote, exchange,
+    timestamp) index, so they stay fast as the history grows.
+    """
+
+    def for_pair(self, base, quote, exchange):
+        return self.filter(base=base, quote=quote, exchange=exchange)
+
+    def between(self, start, end):
+        """
+        Rates with start <= timestamp < end.
+        """
+        return self.filter(timestamp__gte=start, timestamp__lt=end)
+
+    def after(self, timestamp, id):
+        """
+        Rates after the rate with the given timestamp and id, in
+        (timestamp, id) order. For keyset pagination, order by
+        ('timestamp', 'id').
+        """
+        return self.filter(timestamp__gte=timestamp).exclude(
+            timestamp=timestamp, id__lte=id)
+
+    def latest_for_pair(self, base, quote, exchange):
+        """
+        Returns the most recent rate of the pair, or None.
+        """
+        return self.for_pair(base, quote, exchange).order_by(
+            '-timestamp', '-id').first()
+
+    def latest_for_pairs(self, keys):
+        """
+        Returns the most recent rate of each pair in keys, (base_id,
+        quote_id, exchange_id) tuples, as {key: rate}. Pairs without
+        rates are left out.
+
+        One query per LATEST_FOR_PAIRS_CHUNK_SIZE pairs, selecting the
+        ids with an index lookup per pair.
+        """
+        keys = list(keys)
+        latest_rates = {}
+        for start in range(0, len(keys), LATEST_FOR_PAIRS_CHUNK_SIZE):
+            latest_ids = [
+                models.Q(id=models.Subquery(self.for_pair(*key).order_by(
+                    '-timestamp', '-id').values('id')[:1]))
+                for key in keys[start:start + LATEST_FOR_PAIRS_CHUNK_SIZE]
+            ]
+            for exchange_rate in self.filter(reduce(operator.or_, latest_ids)):
+                key = (exchange_rate.base_id, exchange_rate.quote_id,
+                       exchange_rate.exchange_id)
+                latest_rates[key] = exchange_rate
+        return latest_rates
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        set_price_scales(objs)
+        return super().bulk_create(objs, *args, **kwargs)
 
 
 class ExchangeRate(models.Model):
     currency = models.ForeignKey(
         Currency, on_delete=models.CASCADE, related_name='currency')
     exchange = models.ForeignKey(Exchange, on_delete=models.CASCADE)
-    bid = models.DecimalField(max_digits=40, decimal_places=20)
-    ask = models.DecimalField(max_digits=40, decimal_places=20)
+    # Stored as integers, 10 ** -price_scale units, see FixedPointField.
+    # The scale can differ between rows of one pair, so only compare or
+    # aggregate them in SQL per price_scale.
+    bid = FixedPointField(scale_field='price_scale')
+    ask = FixedPointField(scale_field='price_scale')
+    # Decimal places of bid and ask, set from the pair's PriceScale
+    price_scale = models.PositiveSmallIntegerField()
     base = models.ForeignKey(
         Currency, on_delete=models.CASCADE, related_name='base')
     quote = models.ForeignKey(
         Currency, on_delete=models.CASCADE, related_name='quote')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Time of the rate as given by the exchange, time of saving if the
+    # exchange doesn't provide one.
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    objects = ExchangeRateQuerySet.as_manager()
+
+    class Meta:
+        get_latest_by = 'timestamp'
+        indexes = [
+            models.Index(
+                fields=['base', 'quote', 'exchange', 'timestamp'],
+                name='exchangerate_pair_time_idx'),
+            models.Index(
+                fields=['timestamp'], name='exchangerate_time_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        set_price_scales([self])
+        super().save(*args, **kwargs)
+
+
+def set_price_scales(exchange_rates):
+    """
+    Sets the price_scale of the rates that don't have one yet to the
+    decimal places of their pair. Pairs without a PriceScale get one,
+    based on their first price. If a price doesn't fit in 64 bits at
+    the scale of its pair (it grew more than PRICE_HEADROOM times since
+    the scale was chosen), the scale of the pair is lowered.
+    """
+    exchange_rates = [
+        exchange_rate for exchange_rate in exchange_rates
+        if exchange_rate.price_scale is None
+    ]
+    if not exchange_rates:
+        return
+    keys = {
+        (exchange_rate.base_id, exchange_rate.quote_id, exchange_rate.exchange_id)
+        for exchange_rate in exchange_rates
+    }
+    price_scales = {
+        (price_scale.base_id, price_scale.quote_id, price_scale.exchange_id): price_scale
+        for price_scale in PriceScale.objects.filter(
+            base__in={key[0] for key in keys}, quote__in={key[1] for key in keys},
+            exchange__in={key[2] for key in keys})
+    }
+    new_price_scales = []
+    lowered_price_scales = set()
+    for exchange_rate in exchange_rates:
+        key = (exchange_rate.base_id, exchange_rate.quote_id, exchange_rate.exchange_id)
+        price = max(abs(exchange_rate.bid), abs(exchange_rate.ask))
+        price_scale = price_scales.get(key)
+        if price_scale is None:
+            price_scale = PriceScale(
+                base_id=key[0], quote_id=key[1], exchange_id=key[2],
+                decimal_places=return_decimal_places(price))
+            price_scales[key] = price_scale
+            new_price_scales.append(price_scale)
+        elif not fits_decimal_places(price, price_scale.decimal_places):
+            price_scale.decimal_places = return_decimal_places(price)
+            lowered_price_scales.add(price_scale)
+        exchange_rate.price_scale = price_scale.decimal_places
+
+    # Another process may have added the same pairs meanwhile, their
+    # rates have the scale they're saved with, so that's fine
+    PriceScale.objects.bulk_create(new_price_scales, ignore_conflicts=True)
+    for price_scale in lowered_price_scales:
+        if price_scale.pk is not None:
+            price_scale.save(update_fields=['decimal_places'])
+
+
+class PriceScale(models.Model):
+    """
+    The number of decimal places new rates of one pair on one exchange
+    are saved with.
+    """
+    base = models.ForeignKey(
+        Currency, on_delete=models.CASCADE, related_name='+')
+    quote = models.ForeignKey(
+        Currency, on_delete=models.CASCADE, related_name='+')
+    exchange = models.ForeignKey(Exchange, on_delete=models.CASCADE)
+    decimal_places = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = [['base', 'quote', 'exchange']]
+
+
+class Candle(models.Model):
+    """
+    Open, high, low and close of the bid, ask and mid (the average of
+    bid and ask) of one pair on one exchange, over one period starting
+    at start. Computed from ExchangeRate by pricedata.candles.
+    """
+    PERIOD_CHOICES = (
+        ('1m', '1 minute'),
+        ('5m', '5 minutes'),
+        ('1h', '1 hour'),
+        ('1d', '1 day'),
+    )
+
+    base = models.ForeignKey(
+        Currency, on_delete=models.CASCADE, related_name='+')
+    quote = models.ForeignKey(
+        Currency, on_delete=models.CASCADE, related_name='+')
+    exchange = models.ForeignKey(Exchange, on_delete=models.CASCADE)
+    period = models.CharField(max_length=2, choices=PERIOD_CHOICES)
+    start = models.DateTimeField()
+    # Timestamps of the ticks the open and close values come from
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    tick_count = models.PositiveIntegerField()
+    bid_open = models.DecimalField(max_digits=40, decimal_places=20)
+    bid_high = models.DecimalField(max_digits=40, decimal_places=20)
+    bid_low = models.DecimalField(max_digits=40, decimal_places=20)
+    bid_close = models.DecimalField(max_digits=40, decimal_places=20)
+    ask_open = models.DecimalField(max_digits=40, decimal_places=20)
+    ask_high = models.DecimalField(max_digits=40, decimal_places=20)
+    ask_low = models.DecimalField(max_digits=40, decimal_places=20)
+    ask_close = models.DecimalField(max_digits=40, decimal_places=20)
+    mid_open = models.DecimalField(max_digits=40, decimal_places=20)
+    mid_high = models.DecimalField(max_digits=40, decimal_places=20)
+    mid_low = models.DecimalField(max_digits=40, decimal_places=20)
+    mid_close = models.DecimalField(max_digits=40, decimal_places=20)
+
+    class Meta:
+        ordering = ['start']
+        unique_together = [['base', 'quote', 'exchange', 'period', 'start']]
+
+
+class CandleRollupState(models.Model):
+    """
+    High-water mark of the candle rollup: the id of the last
+    ExchangeRate that has been added to the candles.
+    """
+    last_exchange_rate_id = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
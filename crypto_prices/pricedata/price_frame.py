@@ -0,0 +1,181 @@
+"""
+Loads ExchangeRate history into NumPy arrays, for analysis.
+
+No model instances are created: the rates are read as values_list
+tuples, per pair, in chunks, and copied into arrays that are allocated
+once for the complete result (the size comes from one count query).
+bid and ask are stored as integers with a per-row scale (see
+FixedPointField), they're converted to float64, or to int64 scaled by
+10 ** decimal_places, with NumPy, so no Decimal objects are created
+either.
+
+Requires numpy.
+"""
+import operator
+from functools import reduce
+
+import numpy
+
+from django.db.models import Count, Q
+
+from pricedata.fields import INT64_MAX, MAX_DECIMAL_PLACES
+from pricedata.models import ExchangeRate
+from pricedata.tick_archive import return_timestamp_ns
+
+
+LOAD_CHUNK_SIZE = 50000
+
+
+class PriceFrame:
+    """
+    The rates of one or more pairs, as columns:
+
+    timestamps  int64, ns since epoch
+    bids        float64, or int64 scaled by 10 ** decimal_places
+    asks        same as bids
+    mids        same as bids, (bid + ask) / 2 (rounded down if int64)
+    pair_ids    int32, index in pairs
+
+    pairs is a list of (base_id, quote_id, exchange_id) tuples. The rows
+    of each pair are contiguous and sorted on timestamp, pair_offsets[i]
+    to pair_offsets[i + 1] are the rows of pairs[i].
+    """
+
+    def __init__(self, pairs, pair_offsets, timestamps, bids, asks, decimal_places=None):
+        self.pairs = list(pairs)
+        self.pair_offsets = pair_offsets
+        self.timestamps = timestamps
+        self.bids = bids
+        self.asks = asks
+        self.decimal_places = decimal_places
+        if decimal_places is None:
+            self.mids = (bids + asks) / 2
+        else:
+            self.mids = (bids + asks) // 2
+        self.pair_ids = numpy.repeat(
+            numpy.arange(len(self.pairs), dtype=numpy.int32),
+            numpy.diff(pair_offsets))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def pair(self, key):
+        """
+        Returns a PriceFrame with only the rows of the pair, the arrays
+        are views on this frame's arrays.
+        """
+        pair_id = self.pairs.index(key)
+        first, last = self.pair_offsets[pair_id], self.pair_offsets[pair_id + 1]
+        return PriceFrame(
+            [key], numpy.array([0, last - first]), self.timestamps[first:last],
+            self.bids[first:last], self.asks[first:last], self.decimal_places)
+
+    def to_float(self, values):
+        """
+        Returns values (e.g. self.bids) as float64 prices.
+        """
+        if self.decimal_places is None:
+            return values
+        return values / 10 ** self.decimal_places
+
+
+def return_prices(units, price_scales, decimal_places=None):
+    """
+    Takes int64 arrays of stored prices and their scales, returns the
+    prices as float64, or as int64 scaled by 10 ** decimal_places
+    (rounded half up). Raises ValueError if they don't fit, or if
+    decimal_places isn't between 0 and MAX_DECIMAL_PLACES.
+    """
+    if decimal_places is None:
+        return units / numpy.power(10.0, price_scales)
+    if not 0 <= decimal_places <= MAX_DECIMAL_PLACES:
+        raise ValueError(
+            f"decimal_places should be between 0 and {MAX_DECIMAL_PLACES}")
+    shifts = decimal_places - price_scales
+    # 10 ** 19 and up don't fit in int64, numpy.power would overflow
+    if numpy.any(numpy.abs(shifts) > MAX_DECIMAL_PLACES):
+        raise ValueError(
+            f"Prices with scales {numpy.unique(price_scales).tolist()} can't "
+            f"be converted to {decimal_places} decimal places")
+    factors = numpy.power(10, numpy.abs(shifts), dtype=numpy.int64)
+    up = shifts >= 0
+    if numpy.any(numpy.abs(units[up]) > INT64_MAX // factors[up]):
+        raise ValueError(
+            f"Prices don't fit in 64 bits with {decimal_places} decimal places")
+    return numpy.where(
+        up, units * numpy.where(up, factors, 1),
+        (units + factors // 2) // numpy.where(up, 1, factors))
+
+
+def load_price_frame(queryset=None, pairs=None, decimal_places=None, chunk_size=LOAD_CHUNK_SIZE):
+    """
+    Returns a PriceFrame of the rates in queryset (all ExchangeRates by
+    default), e.g. ExchangeRate.objects.between(start, end).
+
+    pairs limits the result to these (base_id, quote_id, exchange_id)
+    tuples, all pairs in queryset are loaded otherwise. The queryset is
+    filtered on them before counting, so only their rows are read.
+
+    If decimal_places is given, bid and ask are returned as int64 fixed
+    point values, rounded to that many decimal places. float64
+    otherwise.
+    """
+    if queryset is None:
+        queryset = ExchangeRate.objects.all()
+    if pairs is not None:
+        pairs = list(pairs)
+        if not pairs:
+            queryset = queryset.none()
+        else:
+            queryset = queryset.filter(reduce(operator.or_, [
+                Q(base=base, quote=quote, exchange=exchange)
+                for base, quote, exchange in pairs
+            ]))
+
+    counts = {
+        (base_id, quote_id, exchange_id): count
+        for base_id, quote_id, exchange_id, count in queryset.order_by().values_list(
+            'base', 'quote', 'exchange').annotate(count=Count('id'))
+    }
+    pairs = sorted(key for key, count in counts.items() if count)
+
+    pair_offsets = numpy.zeros(len(pairs) + 1, dtype=numpy.int64)
+    pair_offsets[1:] = numpy.cumsum([counts[key] for key in pairs])
+    size = int(pair_offsets[-1])
+    price_dtype = numpy.float64 if decimal_places is None else numpy.int64
+    timestamps = numpy.empty(size, dtype=numpy.int64)
+    bids = numpy.empty(size, dtype=price_dtype)
+    asks = numpy.empty(size, dtype=price_dtype)
+
+    for pair_id, key in enumerate(pairs):
+        position = int(pair_offsets[pair_id])
+        end = int(pair_offsets[pair_id + 1])
+        pair_queryset = queryset.for_pair(*key).order_by('timestamp', 'id')
+        cursor = None
+        # Stop at the counted size, in case rates were added meanwhile
+        while position < end:
+            chunk_queryset = pair_queryset
+            if cursor is not None:
+                chunk_queryset = pair_queryset.after(*cursor)
+            rows = list(chunk_queryset.values_list(
+                'id', 'timestamp', 'bid', 'ask', 'price_scale')[:min(chunk_size, end - position)])
+            if not rows:
+                break
+            ids, chunk_timestamps, chunk_bids, chunk_asks, chunk_scales = zip(*rows)
+            count = len(rows)
+            timestamps[position:position + count] = numpy.fromiter(
+                map(return_timestamp_ns, chunk_timestamps), numpy.int64, count)
+            price_scales = numpy.array(chunk_scales, dtype=numpy.int64)
+            bids[position:position + count] = return_prices(
+                numpy.array(chunk_bids, dtype=numpy.int64), price_scales, decimal_places)
+            asks[position:position + count] = return_prices(
+                numpy.array(chunk_asks, dtype=numpy.int64), price_scales, decimal_places)
+            position += count
+            cursor = (chunk_timestamps[-1], ids[-1])
+
+        if position < end:
+            # Rates were deleted meanwhile, the arrays would have a gap
+            raise RuntimeError(
+                f"Rates of pair {key} changed while loading, load again")
+
+    return PriceFrame(pairs, pair_offsets, timestamps, bids, asks, decimal_places)
@@ -0,0 +1,128 @@
+import json
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from cryptodata.models import Currency, Exchange
+from pricedata.models import ExchangeRate
+
+try:
+    import numpy
+    from pricedata import analytics
+except ImportError:
+    numpy = None
+
+
+@unittest.skipIf(numpy is None, "numpy isn't installed")
+class AnalyticsTestCase(SimpleTestCase):
+    def test_rolling_volatility(self):
+        """
+        Tests that the running sums give the same result as computing
+        the std of every window.
+        """
+        returns = numpy.random.default_rng(1).normal(0, 0.01, 500)
+        volatility = analytics.return_rolling_volatility(returns, 20)
+        expected = [returns[i:i + 20].std() for i in range(len(returns) - 19)]
+        numpy.testing.assert_allclose(volatility, expected, rtol=1e-9)
+        self.assertEqual(len(analytics.return_rolling_volatility(returns[:5], 20)), 0)
+
+    def test_rolling_min_max(self):
+        values = numpy.array([3.0, 1.0, 4.0, 1.0, 5.0, 9.0, 2.0])
+        self.assertEqual(list(analytics.return_rolling_min(values, 3)), [1, 1, 1, 1, 2])
+        self.assertEqual(list(analytics.return_rolling_max(values, 3)), [4, 4, 5, 9, 9])
+
+    def test_rolling_min_max_blocks(self):
+        """
+        Tests the block algorithm against a min/max of every window,
+        for windows that do and don't divide the length, and int64.
+        """
+        values = numpy.random.default_rng(2).integers(0, 1000, 101)
+        for window in (1, 2, 7, 10, 101):
+            expected_min = [values[i:i + window].min() for i in range(len(values) - window + 1)]
+            expected_max = [values[i:i + window].max() for i in range(len(values) - window + 1)]
+            self.assertEqual(list(analytics.return_rolling_min(values, window)), expected_min)
+            self.assertEqual(list(analytics.return_rolling_max(values, window)), expected_max)
+
+    def test_stats_not_finite(self):
+        """
+        NaN and infinity, e.g. from a zero price, become None, so the
+        summary is valid JSON.
+        """
+        spreads, relative_spreads = analytics.return_spreads(
+            numpy.array([0.0, 1.0]), numpy.array([0.0, 2.0]))
+        stats = analytics.return_stats(relative_spreads)
+        self.assertIsNone(stats['mean'])
+        self.assertIsNone(stats['max'])
+        json.dumps(stats, allow_nan=False)
+
+    def test_price_differences(self):
+        """
+        Tests that every tick is compared with the last price of the
+        other exchange at or before it.
+        """
+        timestamps, differences = analytics.return_price_differences(
+            numpy.array([1, 5, 10, 12]), numpy.array([100.0, 101.0, 102.0, 103.0]),
+            numpy.array([2, 10]), numpy.array([99.0, 100.0]))
+        self.assertEqual(list(timestamps), [5, 10, 12])
+        self.assertEqual(list(differences), [2.0, 2.0, 3.0])
+
+
+@unittest.skipIf(numpy is None, "numpy isn't installed")
+class PriceAnalyticsTestCase(TestCase):
+    def setUp(self):
+        self.kraken = Exchange.objects.create(name='Kraken')
+        self.binance = Exchange.objects.create(name='Binance')
+        self.bitcoin = Currency.objects.create(
+            name='Bitcoin', ticker_symbol='BTC')
+        self.euro = Currency.objects.create(name='Euro', ticker_symbol='EUR')
+        start = datetime(2019, 5, 5, 17, 0, tzinfo=timezone.utc)
+        for exchange, offset in [(self.kraken, 0), (self.binance, 10)]:
+            for seconds in range(10):
+                ExchangeRate.objects.create(
+                    currency=self.bitcoin, exchange=exchange,
+                    base=self.bitcoin, quote=self.euro,
+                    bid=Decimal(100 + offset + seconds),
+                    ask=Decimal(102 + offset + seconds),
+                    timestamp=start + timedelta(seconds=seconds))
+        self.pairs = [
+            f'{self.bitcoin.id}-{self.euro.id}-{self.kraken.id}',
+            f'{self.bitcoin.id}-{self.euro.id}-{self.binance.id}',
+        ]
+
+    def test_view(self):
+        response = self.client.get(reverse('price_analytics'), {
+            'pairs': ','.join(self.pairs), 'window': 5})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data['pairs']), 2)
+        kraken = next(
+            pair for pair in data['pairs'] if pair['exchange'] == self.kraken.id)
+        self.assertEqual(kraken['tick_count'], 10)
+        self.assertEqual(kraken['spread']['mean'], 2.0)
+        self.assertEqual(kraken['rolling_min'], 106.0)
+        self.assertEqual(kraken['rolling_max'], 110.0)
+        self.assertIsNotNone(kraken['volatility'])
+
+        differences = data['exchange_differences']
+        self.assertEqual(len(differences), 1)
+        self.assertEqual(differences[0]['count'], 10)
+        self.assertEqual(abs(differences[0]['difference']['mean']), 10.0)
+
+    def test_view_invalid(self):
+        response = self.client.get(reverse('price_analytics'), {'pairs': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command(
+            'price_analytics', '--pair', self.pairs[0], '--window', '3',
+            stdout=stdout)
+        data = json.loads(stdout.getvalue())
+        self.assertEqual([pair['tick_count'] for pair in data['pairs']], [10])
+        self.assertEqual(data['exchange_differences'], [])
@@ -0,0 +1,102 @@
+import unittest
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from cryptodata.models import Currency, Exchange, TradingPair, TradingPairExchangePK
+from pricedata.latest_prices import latest_price_cache
+from pricedata.models import ExchangeRate
+
+try:
+    import numpy
+    from pricedata.arbitrage import ArbitrageScanner
+except ImportError:
+    numpy = None
+
+BTC, EUR, ETH, XRP = 1, 2, 3, 4
+KRAKEN, BINANCE = 1, 2
+
+
+@unittest.skipIf(numpy is None, "numpy isn't installed")
+class ArbitrageScannerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.scanner = ArbitrageScanner([
+            (BTC, EUR, KRAKEN), (ETH, BTC, KRAKEN), (ETH, EUR, KRAKEN),
+            (XRP, BTC, KRAKEN),
+            (BTC, EUR, BINANCE), (ETH, BTC, BINANCE),
+        ])
+
+    def test_triangles(self):
+        """
+        Tests that each triangle of an exchange is found once per
+        direction, and that pairs of other exchanges don't connect.
+        """
+        self.assertEqual(len(self.scanner.triangle_edges), 2)
+        offsets = self.scanner.edge_triangle_offsets
+        btc_eur, eur_btc = self.scanner.pair_edges[(BTC, EUR, KRAKEN)]
+        self.assertEqual(offsets[btc_eur + 1] - offsets[btc_eur], 1)
+        xrp_btc, _ = self.scanner.pair_edges[(XRP, BTC, KRAKEN)]
+        self.assertEqual(offsets[xrp_btc + 1] - offsets[xrp_btc], 0)
+
+    def test_update(self):
+        """
+        Tests that a cycle is only reported once all its rates are
+        known, and only while it's profitable.
+        """
+        self.assertEqual(self.scanner.update((BTC, EUR, KRAKEN), 10000, 10001), [])
+        self.assertEqual(self.scanner.update((ETH, BTC, KRAKEN), '0.02', '0.0201'), [])
+        opportunities = self.scanner.update((ETH, EUR, KRAKEN), 210, 211)
+        self.assertEqual(len(opportunities), 1)
+        self.assertEqual(opportunities[0]['exchange'], KRAKEN)
+        # EUR -> BTC -> ETH -> EUR, in some rotation
+        currencies = opportunities[0]['currencies']
+        start = currencies.index(EUR)
+        self.assertEqual(currencies[start:] + currencies[:start], [EUR, BTC, ETH])
+        self.assertAlmostEqual(opportunities[0]['profit'], 210 / (10001 * 0.0201) - 1)
+        self.assertEqual(self.scanner.scan(), opportunities)
+
+        self.assertEqual(self.scanner.update((ETH, EUR, KRAKEN), 200, 201), [])
+        self.assertEqual(self.scanner.scan(), [])
+
+    def test_fee_and_min_profit(self):
+        scanner = ArbitrageScanner(
+            [(BTC, EUR, KRAKEN), (ETH, BTC, KRAKEN), (ETH, EUR, KRAKEN)],
+            fee=0.01, min_profit=0.02)
+        scanner.update((BTC, EUR, KRAKEN), 10000, 10001)
+        scanner.update((ETH, BTC, KRAKEN), '0.02', '0.0201')
+        # Returns 4.47% before fees, about 1.37% after
+        self.assertEqual(scanner.update((ETH, EUR, KRAKEN), 210, 211), [])
+
+
+@unittest.skipIf(numpy is None, "numpy isn't installed")
+class ScanArbitrageCommandTestCase(TestCase):
+    def setUp(self):
+        latest_price_cache.clear()
+        self.addCleanup(latest_price_cache.clear)
+        exchange = Exchange.objects.create(name='Kraken')
+        currencies = {
+            symbol: Currency.objects.create(name=symbol, ticker_symbol=symbol)
+            for symbol in ['BTC', 'EUR', 'ETH']
+        }
+        for base, quote, bid, ask in [
+                ('BTC', 'EUR', '10000', '10001'),
+                ('ETH', 'BTC', '0.02', '0.0201'),
+                ('ETH', 'EUR', '210', '211')]:
+            trading_pair = TradingPair.objects.create(
+                currency1=currencies[base], currency2=currencies[quote])
+            TradingPairExchangePK.objects.create(
+                trading_pair=trading_pair, exchange=exchange, key=base + quote)
+            ExchangeRate.objects.create(
+                currency=currencies[base], exchange=exchange,
+                base=currencies[base], quote=currencies[quote],
+                bid=Decimal(bid), ask=Decimal(ask))
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command('scan_arbitrage', stdout=stdout)
+        output = stdout.getvalue()
+        self.assertIn('Kraken: ', output)
+        self.assertIn('4.4672%', output)
+        self.assertIn('1 opportunities in 2 cycles', output)
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.test import TestCase
+from django.utils import timezone
+
+from cryptodata.models import Currency, Exchange
+from pricedata.candles import rebuild_candles, update_candles
+from pricedata.models import Candle, ExchangeRate
+
+
+class CandlesTestCase(TestCase):
+    def setUp(self):
+        self.exchange = Exchange.objects.create(name='Kraken')
+        self.bitcoin = Currency.objects.create(
+            name='Bitcoin', ticker_symbol='BTC')
+        self.euro = Currency.objects.create(name='Euro', ticker_symbol='EUR')
+        self.start = datetime(2019, 5, 5, 17, 0, tzinfo=timezone.utc)
+
+    def add_rate(self, seconds, bid, ask):
+        ExchangeRate.objects.create(
+            currency=self.bitcoin, exchange=self.exchange,
+            base=self.bitcoin, quote=self.euro,
+            bid=Decimal(bid), ask=Decimal(ask),
+            timestamp=self.start + timedelta(seconds=seconds))
+
+    def return_candle(self, period, start):
+        return Candle.objects.get(
+            base=self.bitcoin, quote=self.euro, exchange=self.exchange,
+            period=period, start=start)
+
+    def test_update_candles(self):
+        """
+        Tests that ticks are rolled up into every period, and that a
+        second run only adds the new ticks, merging them into the
+        existing candles, also when they arrive out of order.
+        """
+        self.add_rate(10, '100', '102')
+        self.add_rate(20, '104', '106')
+        self.add_rate(70, '98', '99')
+        self.assertEqual(update_candles(), 3)
+
+        self.assertEqual(Candle.objects.filter(period='1m').count(), 2)
+        candle = self.return_candle('1m', self.start)
+        self.assertEqual(candle.tick_count, 2)
+        self.assertEqual(
+            (candle.bid_open, candle.bid_high, candle.bid_low, candle.bid_close),
+            (Decimal(100), Decimal(104), Decimal(100), Decimal(104)))
+        self.assertEqual(candle.mid_open, Decimal(101))
+
+        # Arrives late, but is the first tick of the first minute
+        self.add_rate(5, '110', '111')
+        self.add_rate(80, '90', '91')
+        with self.assertNumQueries(12):
+            self.assertEqual(update_candles(), 2)
+
+        candle = self.return_candle('1m', self.start)
+        self.assertEqual(candle.tick_count, 3)
+        self.assertEqual(candle.bid_open, Decimal(110))
+        self.assertEqual(candle.bid_high, Decimal(110))
+        self.assertEqual(candle.bid_close, Decimal(104))
+
+        candle = self.return_candle('1h', self.start)
+        self.assertEqual(candle.tick_count, 5)
+        self.assertEqual(
+            (candle.ask_open, candle.ask_high, candle.ask_low, candle.ask_close),
+            (Decimal(111), Decimal(111), Decimal(91), Decimal(91)))
+
+        self.assertEqual(update_candles(), 0)
+
+    def test_rebuild_candles(self):
+        self.add_rate(10, '100', '102')
+        update_candles()
+        Candle.objects.update(tick_count=10)
+        self.assertEqual(rebuild_candles(), 1)
+        day_start = self.start.replace(hour=0)
+        self.assertEqual(self.return_candle('1d', day_start).tick_count, 1)
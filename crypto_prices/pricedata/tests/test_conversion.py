@@ -0,0 +1,125 @@
+from decimal import Decimal
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from cryptodata.models import Currency, Exchange, TradingPair, TradingPairExchangePK
+from pricedata.conversion import ConversionIndex, build_conversion_index, conversion_service, return_pair_keys
+from pricedata.latest_prices import latest_price_cache
+from pricedata.models import ExchangeRate
+
+BTC, EUR, ETH, XYZ, USD = 1, 2, 3, 4, 5
+KRAKEN, BINANCE = 1, 2
+
+
+class ConversionIndexTestCase(SimpleTestCase):
+    def test_paths(self):
+        """
+        Tests that the path with the fewest pairs is chosen, pairs of
+        the preferred exchange when there's a choice, and that pairs
+        are inverted when the path goes from quote to base.
+        """
+        index = ConversionIndex(
+            [(BTC, EUR, BINANCE), (BTC, EUR, KRAKEN), (XYZ, BTC, BINANCE),
+             (ETH, BTC, KRAKEN), (ETH, EUR, KRAKEN), (XYZ, ETH, KRAKEN),
+             (EUR, USD, KRAKEN)],
+            [EUR], {KRAKEN: 0, BINANCE: 0.01})
+        paths = index.paths[EUR]
+        self.assertEqual(paths[EUR], ())
+        self.assertEqual(paths[BTC], (((BTC, EUR, KRAKEN), False),))
+        self.assertEqual(paths[USD], (((EUR, USD, KRAKEN), True),))
+        # Two pairs either way, through Kraken only is cheaper
+        self.assertEqual(paths[XYZ], (
+            ((XYZ, ETH, KRAKEN), False), ((ETH, EUR, KRAKEN), False)))
+
+
+class ConvertCurrenciesViewTestCase(TestCase):
+    def setUp(self):
+        latest_price_cache.clear()
+        conversion_service.invalidate()
+        self.addCleanup(latest_price_cache.clear)
+        self.addCleanup(conversion_service.invalidate)
+        self.exchange = Exchange.objects.create(name='Kraken')
+        self.currencies = {
+            symbol: Currency.objects.create(name=symbol, ticker_symbol=symbol)
+            for symbol in ['BTC', 'EUR', 'XYZ', 'ABC']
+        }
+        self.add_pair('BTC', 'EUR', '5000', '5002')
+        self.add_pair('XYZ', 'BTC', '0.0001', '0.0001')
+
+    def add_pair(self, base, quote, bid, ask):
+        trading_pair = TradingPair.objects.create(
+            currency1=self.currencies[base], currency2=self.currencies[quote])
+        TradingPairExchangePK.objects.create(
+            trading_pair=trading_pair, exchange=self.exchange, key=base + quote)
+        ExchangeRate.objects.create(
+            currency=self.currencies[base], exchange=self.exchange,
+            base=self.currencies[base], quote=self.currencies[quote],
+            bid=Decimal(bid), ask=Decimal(ask))
+
+    def convert(self, *symbols):
+        return self.client.get(reverse('convert_currencies'), {
+            'currencies': ','.join(
+                str(self.currencies[symbol].id) for symbol in symbols),
+            'to': self.currencies['EUR'].id,
+        })
+
+    def test_convert(self):
+        response = self.convert('XYZ', 'BTC', 'ABC')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        rates = {rate['currency']: rate for rate in data['rates']}
+        self.assertEqual(
+            Decimal(rates[self.currencies['XYZ'].id]['rate']), Decimal('0.5001'))
+        self.assertEqual(len(rates[self.currencies['XYZ'].id]['path']), 2)
+        self.assertEqual(data['missing'], [self.currencies['ABC'].id])
+
+        # The index is cached, conversions only read the prices
+        with self.assertNumQueries(0):
+            self.convert('XYZ', 'BTC')
+
+    def test_rebuild_on_pair_change(self):
+        self.convert('ABC')
+        self.add_pair('ABC', 'XYZ', '2', '2')
+        conversion_service._checked = None
+        data = self.convert('ABC').json()
+        self.assertEqual(Decimal(data['rates'][0]['rate']), Decimal('1.0002'))
+
+    def test_rebuild_on_pair_replaced(self):
+        """
+        Replacing a pair, with the count and max id of the pairs
+        unchanged, rebuilds the index too.
+        """
+        self.add_pair('ABC', 'BTC', '0.0002', '0.0002')
+        TradingPairExchangePK.objects.filter(key='ABCBTC').delete()
+        self.convert('ABC')
+        TradingPairExchangePK.objects.filter(key='XYZBTC').update(
+            trading_pair=TradingPair.objects.get(currency1=self.currencies['ABC']))
+        conversion_service._checked = None
+        data = self.convert('ABC', 'XYZ').json()
+        self.assertEqual([rate['currency'] for rate in data['rates']], [self.currencies['ABC'].id])
+
+    @override_settings(CONVERSION_EXCHANGE_PREFERENCE=['Kraken'])
+    def test_unlisted_exchange_penalty(self):
+        """
+        Exchanges missing from the preference come after the listed
+        ones.
+        """
+        binance = Exchange.objects.create(name='Binance')
+        trading_pair = TradingPair.objects.create(
+            currency1=self.currencies['BTC'], currency2=self.currencies['EUR'])
+        TradingPairExchangePK.objects.create(
+            trading_pair=trading_pair, exchange=binance, key='BTCEUR')
+        index = build_conversion_index(return_pair_keys())
+        self.assertEqual(
+            index.paths[self.currencies['EUR'].id][self.currencies['BTC'].id][0][0][2],
+            self.exchange.id)
+
+    def test_invalid(self):
+        response = self.client.get(reverse('convert_currencies'), {
+            'currencies': self.currencies['BTC'].id,
+            'to': self.currencies['XYZ'].id,
+        })
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('convert_currencies'), {'to': 1})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,71 @@
+from decimal import Decimal
+
+from django.test import SimpleTestCase, TestCase
+
+from cryptodata.models import Currency, Exchange
+from pricedata.fields import return_decimal_places, return_units
+from pricedata.models import ExchangeRate, PriceScale
+
+
+class FixedPointTestCase(SimpleTestCase):
+    def test_return_decimal_places(self):
+        self.assertEqual(return_decimal_places(Decimal('5123.1')), 12)
+        self.assertEqual(return_decimal_places(Decimal('0.00000001')), 18)
+        self.assertEqual(return_decimal_places(0), 18)
+        self.assertEqual(return_decimal_places(Decimal('1e20')), 0)
+
+    def test_return_units(self):
+        self.assertEqual(return_units(Decimal('1.25'), 1), 12)
+        self.assertEqual(return_units(Decimal('1.35'), 1), 14)
+        with self.assertRaises(ValueError):
+            return_units(Decimal('1e10'), 10)
+
+
+class FixedPointFieldTestCase(TestCase):
+    def setUp(self):
+        self.exchange = Exchange.objects.create(name='Kraken')
+        self.bitcoin = Currency.objects.create(
+            name='Bitcoin', ticker_symbol='BTC')
+        self.euro = Currency.objects.create(name='Euro', ticker_symbol='EUR')
+
+    def return_rate(self, bid, ask):
+        return ExchangeRate(
+            currency=self.bitcoin, exchange=self.exchange,
+            base=self.bitcoin, quote=self.euro, bid=bid, ask=ask)
+
+    def test_save_and_load(self):
+        """
+        Tests that prices are stored as integers at the scale of the
+        pair, and read back as Decimal.
+        """
+        exchange_rate = self.return_rate(Decimal('5123.1'), Decimal('5124.123456789'))
+        exchange_rate.save()
+        self.assertEqual(exchange_rate.price_scale, 12)
+        self.assertEqual(PriceScale.objects.get().decimal_places, 12)
+
+        exchange_rate = ExchangeRate.objects.get()
+        self.assertEqual(exchange_rate.bid, Decimal('5123.1'))
+        self.assertEqual(exchange_rate.ask, Decimal('5124.123456789'))
+        self.assertEqual(
+            ExchangeRate.objects.values_list('bid', flat=True).get(),
+            5123100000000000)
+        with self.assertRaises(TypeError):
+            ExchangeRate.objects.filter(bid__gt=Decimal(1)).exists()
+
+    def test_bulk_create(self):
+        """
+        Tests that bulk_create sets the scale of every rate, and that
+        the scale of a pair is lowered when a price doesn't fit anymore.
+        """
+        self.return_rate(Decimal(5000), Decimal(5001)).save()
+        exchange_rates = [
+            self.return_rate(Decimal(5100), Decimal(5101)),
+            self.return_rate(Decimal('1e13'), Decimal('1e13')),
+        ]
+        ExchangeRate.objects.bulk_create(exchange_rates)
+        self.assertEqual(
+            [exchange_rate.price_scale for exchange_rate in exchange_rates], [12, 2])
+        self.assertEqual(PriceScale.objects.get().decimal_places, 2)
+        self.assertEqual(
+            sorted(exchange_rate.bid for exchange_rate in ExchangeRate.objects.all()),
+            [Decimal(5000), Decimal(5100), Decimal('1e13')])
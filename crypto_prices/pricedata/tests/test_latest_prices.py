@@ -0,0 +1,103 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from cryptodata.models import Currency, Exchange
+from pricedata import latest_prices
+from pricedata.latest_prices import LatestPriceCache, latest_price_cache
+from pricedata.models import ExchangeRate
+
+
+class LatestPriceCacheTestCase(SimpleTestCase):
+    def test_ttl_and_eviction(self):
+        cache = LatestPriceCache(ttl=10, max_size=2)
+        now = timezone.now()
+        with mock.patch.object(latest_prices.time, 'monotonic', return_value=100):
+            cache.set((1, 2, 1), (Decimal(1), Decimal(2), now))
+            cache.set((1, 3, 1), (Decimal(3), Decimal(4), now))
+            # Makes (1, 3, 1) the least recently used pair
+            self.assertIsNotNone(cache.get((1, 2, 1)))
+            cache.set((1, 4, 1), (Decimal(5), Decimal(6), now))
+            self.assertIsNone(cache.get((1, 3, 1)))
+            self.assertIsNotNone(cache.get((1, 2, 1)))
+
+        with mock.patch.object(latest_prices.time, 'monotonic', return_value=111):
+            self.assertIsNone(cache.get((1, 2, 1)))
+
+    def test_update_from_rates(self):
+        cache = LatestPriceCache(ttl=10, max_size=10)
+        now = timezone.now()
+        rates = [
+            ExchangeRate(base_id=1, quote_id=2, exchange_id=1, bid=Decimal(2),
+                         ask=Decimal(3), timestamp=now),
+            ExchangeRate(base_id=1, quote_id=2, exchange_id=1, bid=Decimal(1),
+                         ask=Decimal(2), timestamp=now - timedelta(seconds=1)),
+        ]
+        cache.update_from_rates(rates)
+        self.assertEqual(cache.get((1, 2, 1)), (Decimal(2), Decimal(3), now))
+
+
+class LatestPricesViewTestCase(TestCase):
+    def setUp(self):
+        latest_price_cache.clear()
+        self.addCleanup(latest_price_cache.clear)
+        self.exchange = Exchange.objects.create(name='Kraken')
+        self.bitcoin = Currency.objects.create(
+            name='Bitcoin', ticker_symbol='BTC')
+        self.euro = Currency.objects.create(name='Euro', ticker_symbol='EUR')
+        for bid in ['5100', '5123.1']:
+            ExchangeRate.objects.create(
+                currency=self.bitcoin, exchange=self.exchange,
+                base=self.bitcoin, quote=self.euro,
+                bid=Decimal(bid), ask=Decimal('5124'))
+        self.pair = f'{self.bitcoin.id}-{self.euro.id}-{self.exchange.id}'
+        self.unknown_pair = f'{self.euro.id}-{self.bitcoin.id}-{self.exchange.id}'
+
+    def test_latest_prices(self):
+        """
+        Tests that the latest price is returned, and that the second
+        request is answered from the cache.
+        """
+        url = reverse('latest_prices')
+        params = {'pairs': f'{self.pair},{self.unknown_pair}'}
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data['prices']), 1)
+        self.assertEqual(Decimal(data['prices'][0]['bid']), Decimal('5123.1'))
+        self.assertEqual(data['prices'][0]['base'], self.bitcoin.id)
+        self.assertEqual(data['missing'], [self.unknown_pair])
+
+        # Pairs without rates are cached as well
+        with self.assertNumQueries(0):
+            response = self.client.get(url, params)
+        self.assertEqual(len(response.json()['prices']), 1)
+
+    def test_get_many_queries(self):
+        """
+        Pairs that aren't cached are read together, with one query per
+        LATEST_FOR_PAIRS_CHUNK_SIZE (100) pairs.
+        """
+        key = (self.bitcoin.id, self.euro.id, self.exchange.id)
+        keys = [key] + [(self.bitcoin.id, self.euro.id, exchange_id) for exchange_id in range(1000, 1249)]
+        with self.assertNumQueries(3):
+            prices = latest_price_cache.get_many(keys)
+        self.assertEqual(list(prices), [key])
+        self.assertEqual(prices[key][0], Decimal('5123.1'))
+
+    def test_latest_prices_invalid(self):
+        url = reverse('latest_prices')
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(
+            self.client.get(url, {'pairs': '1-2'}).status_code, 400)
+        self.assertEqual(
+            self.client.get(url, {'pairs': 'BTC-EUR-1'}).status_code, 400)
+        # Would overflow SQLite's int64 in the query
+        self.assertEqual(self.client.get(url, {
+            'pairs': '1-2-1,99999999999999999999999-1-1'}).status_code, 400)
+        self.assertEqual(
+            self.client.get(url, {'pairs': '0-2-1'}).status_code, 400)
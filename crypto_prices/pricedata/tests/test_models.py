@@ -0,0 +1,55 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from cryptodata.models import Currency, Exchange
+from pricedata.models import ExchangeRate
+
+
+class ExchangeRateQuerySetTestCase(TestCase):
+    def setUp(self):
+        self.exchange = Exchange.objects.create(name='Kraken')
+        self.bitcoin = Currency.objects.create(
+            name='Bitcoin', ticker_symbol='BTC')
+        self.euro = Currency.objects.create(name='Euro', ticker_symbol='EUR')
+        self.start = timezone.now() - timedelta(hours=1)
+        for minute in range(5):
+            ExchangeRate.objects.create(
+                currency=self.bitcoin, exchange=self.exchange,
+                base=self.bitcoin, quote=self.euro,
+                bid=Decimal(100 + minute), ask=Decimal(101 + minute),
+                timestamp=self.start + timedelta(minutes=minute))
+
+    def test_latest_for_pair(self):
+        latest = ExchangeRate.objects.latest_for_pair(
+            self.bitcoin, self.euro, self.exchange)
+        self.assertEqual(latest.bid, Decimal(104))
+        self.assertEqual(latest.timestamp, self.start + timedelta(minutes=4))
+        self.assertIsNone(ExchangeRate.objects.latest_for_pair(
+            self.euro, self.bitcoin, self.exchange))
+
+    def test_between(self):
+        rates = ExchangeRate.objects.for_pair(
+            self.bitcoin, self.euro, self.exchange).between(
+                self.start + timedelta(minutes=1),
+                self.start + timedelta(minutes=3))
+        self.assertEqual(
+            [rate.bid for rate in rates.order_by('timestamp')],
+            [Decimal(101), Decimal(102)])
+
+    def test_latest_for_pair_uses_index(self):
+        """
+        Tests that the latest rate is read from the pair/time index,
+        instead of by scanning the table.
+        """
+        queryset = ExchangeRate.objects.for_pair(
+            self.bitcoin, self.euro, self.exchange).order_by(
+                '-timestamp', '-id')[:1]
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('exchangerate_pair_time_idx', plan)
@@ -0,0 +1,117 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import TestCase
+
+from cryptodata.models import Currency, Exchange, TradingPair, TradingPairExchangePK
+from pricedata.management.commands.utils import poll_exchange_rates_utils
+from pricedata.management.commands.utils.poll_exchange_rates_utils import ExchangeRatePoller, parse_tickers, return_pair_keys
+
+
+class PollExchangeRatesTestCase(TestCase):
+    def setUp(self):
+        self.binance = Exchange.objects.create(name='Binance')
+        self.kraken = Exchange.objects.create(name='Kraken')
+        self.bitcoin = Currency.objects.create(
+            name='Bitcoin', ticker_symbol='BTC')
+        self.ether = Currency.objects.create(name='Ether', ticker_symbol='ETH')
+        pair = TradingPair.objects.create(
+            currency1=self.ether, currency2=self.bitcoin)
+        TradingPairExchangePK.objects.create(
+            trading_pair=pair, exchange=self.binance, key='ETHBTC')
+        TradingPairExchangePK.objects.create(
+            trading_pair=pair, exchange=self.kraken, key='XETHXXBT')
+
+        self.raw_data = {
+            'Binance': [
+                {'symbol': 'ETHBTC', 'bidPrice': '0.03120000',
+                 'askPrice': '0.03121000'},
+                {'symbol': 'LTCBTC', 'bidPrice': '0.01', 'askPrice': '0.02'},
+            ],
+            'Kraken': {'error': [], 'result': {
+                'XETHXXBT': {'a': ['0.03125', '1', '1.0'],
+                             'b': ['0.03119', '2', '2.0']},
+            }},
+        }
+
+    def test_parse_tickers(self):
+        self.assertEqual(parse_tickers('Kraken', self.raw_data['Kraken']), [
+            ('XETHXXBT', Decimal('0.03119'), Decimal('0.03125'), None)])
+
+        rates = parse_tickers('Bittrex', {'result': [
+            {'MarketName': 'BTC-ETH', 'Bid': 0.0312, 'Ask': 0.03121,
+             'TimeStamp': '2019-05-05T17:37:01.1'},
+            {'MarketName': 'BTC-NEW', 'Bid': None, 'Ask': None,
+             'TimeStamp': '2019-05-05T17:37:01.1'},
+        ]})
+        self.assertEqual(len(rates), 1)
+        self.assertEqual(rates[0][1], Decimal('0.0312'))
+        self.assertEqual(rates[0][3].isoformat(),
+                         '2019-05-05T17:37:01.100000+00:00')
+
+    def test_poll_once(self):
+        """
+        Tests that one round polls every exchange, saves the rates of
+        known pairs, and that unchanged rates aren't saved again.
+        """
+        pair_keys = return_pair_keys(['Binance', 'Kraken'])
+        self.assertEqual(pair_keys['Kraken'], {
+            'XETHXXBT': (self.kraken.id, self.ether.id, self.bitcoin.id)})
+
+        saved_rates = []
+        poller = ExchangeRatePoller(
+            pair_keys, {'Binance': 1, 'Kraken': 1}, queue_size=1)
+        with mock.patch.object(
+                poll_exchange_rates_utils, 'fetch_tickers',
+                lambda exchange_name, keys: self.raw_data[exchange_name]), \
+                mock.patch.object(poller, 'save_rates', saved_rates.extend):
+            poller.run(once=True)
+            poller.run(once=True)
+
+        self.assertEqual(len(saved_rates), 2)
+        kraken_rate = [
+            rate for rate in saved_rates
+            if rate.exchange_id == self.kraken.id][0]
+        self.assertEqual(kraken_rate.base_id, self.ether.id)
+        self.assertEqual(kraken_rate.quote_id, self.bitcoin.id)
+        self.assertEqual(kraken_rate.ask, Decimal('0.03125'))
+
+    def test_save_failed(self):
+        """
+        A batch that fails to save is reported and polled again,
+        instead of stopping the writer.
+        """
+        errors = []
+        saved_rates = []
+        poller = ExchangeRatePoller(
+            return_pair_keys(['Binance', 'Kraken']), {'Binance': 1, 'Kraken': 1},
+            on_error=errors.append)
+        save_rates = mock.Mock(side_effect=DatabaseError('database is locked'))
+        with mock.patch.object(
+                poll_exchange_rates_utils, 'fetch_tickers',
+                lambda exchange_name, keys: self.raw_data[exchange_name]), \
+                mock.patch.object(poller, 'save_rates', save_rates):
+            poller.run(once=True)
+            self.assertEqual(poller.failed_count, 2)
+            self.assertTrue(errors)
+            self.assertIn('database is locked', errors[0])
+
+            save_rates.side_effect = saved_rates.extend
+            poller.run(once=True)
+        self.assertEqual(len(saved_rates), 2)
+
+    def test_writer_error(self):
+        """
+        Any other error of the writer stops the pollers, which would
+        otherwise wait forever for room in the full queue.
+        """
+        poller = ExchangeRatePoller(
+            return_pair_keys(['Binance', 'Kraken']), {'Binance': 0.01, 'Kraken': 0.01},
+            queue_size=1)
+        with mock.patch.object(
+                poll_exchange_rates_utils, 'fetch_tickers',
+                lambda exchange_name, keys: self.raw_data[exchange_name]), \
+                mock.patch.object(poller, 'save_rates', mock.Mock(side_effect=RuntimeError)):
+            with self.assertRaises(RuntimeError):
+                poller.run()
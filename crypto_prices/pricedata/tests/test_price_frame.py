@@ -0,0 +1,94 @@
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from cryptodata.models import Currency, Exchange
+from pricedata.models import ExchangeRate
+from pricedata.tick_archive import return_timestamp_ns
+
+try:
+    import numpy
+    from pricedata.price_frame import load_price_frame, return_prices
+except ImportError:
+    numpy = None
+
+
+@unittest.skipIf(numpy is None, "numpy isn't installed")
+class PriceFrameTestCase(TestCase):
+    def setUp(self):
+        self.kraken = Exchange.objects.create(name='Kraken')
+        self.binance = Exchange.objects.create(name='Binance')
+        self.bitcoin = Currency.objects.create(
+            name='Bitcoin', ticker_symbol='BTC')
+        self.euro = Currency.objects.create(name='Euro', ticker_symbol='EUR')
+        self.start = datetime(2019, 5, 5, 17, 0, tzinfo=timezone.utc)
+        self.kraken_key = (self.bitcoin.id, self.euro.id, self.kraken.id)
+        self.binance_key = (self.bitcoin.id, self.euro.id, self.binance.id)
+        for seconds in range(5):
+            self.add_rate(self.kraken, seconds, Decimal('100.12345678') + seconds, Decimal(101 + seconds))
+        for seconds in range(3):
+            self.add_rate(self.binance, seconds, Decimal(200), Decimal(203))
+
+    def add_rate(self, exchange, seconds, bid, ask):
+        ExchangeRate.objects.create(
+            currency=self.bitcoin, exchange=exchange,
+            base=self.bitcoin, quote=self.euro, bid=bid, ask=ask,
+            timestamp=self.start + timedelta(seconds=seconds))
+
+    def test_load_price_frame(self):
+        """
+        Tests that the rates of all pairs are loaded in chunks, grouped
+        per pair and sorted on time.
+        """
+        frame = load_price_frame(chunk_size=2)
+        self.assertEqual(len(frame), 8)
+        self.assertEqual(frame.pairs, sorted([self.kraken_key, self.binance_key]))
+        kraken_id = frame.pairs.index(self.kraken_key)
+        self.assertEqual(list(frame.pair_ids).count(kraken_id), 5)
+
+        kraken = frame.pair(self.kraken_key)
+        self.assertEqual(kraken.timestamps[0], return_timestamp_ns(self.start))
+        self.assertTrue((numpy.diff(kraken.timestamps) == 10 ** 9).all())
+        self.assertAlmostEqual(kraken.bids[4], 104.12345678)
+        self.assertEqual(list(frame.pair(self.binance_key).mids), [201.5] * 3)
+
+    def test_fixed_point(self):
+        frame = load_price_frame(
+            ExchangeRate.objects.for_pair(*self.kraken_key), decimal_places=8)
+        self.assertEqual(frame.bids.dtype, numpy.int64)
+        self.assertEqual(frame.bids[0], 10012345678)
+        self.assertEqual(frame.mids[0], 10056172839)
+        self.assertAlmostEqual(frame.to_float(frame.bids)[0], 100.12345678)
+
+    def test_return_prices(self):
+        units = numpy.array([5, 123456789], dtype=numpy.int64)
+        self.assertEqual(
+            return_prices(units, numpy.array([0, 18]), decimal_places=18).tolist(),
+            [5 * 10 ** 18, 123456789])
+        self.assertEqual(
+            return_prices(units, numpy.array([0, 8]), decimal_places=0).tolist(), [5, 1])
+        # Would overflow int64 in numpy.power instead of raising
+        with self.assertRaises(ValueError):
+            return_prices(units, numpy.array([0, 0]), decimal_places=19)
+        with self.assertRaises(ValueError):
+            return_prices(units, numpy.array([0, 20]), decimal_places=0)
+        # Doesn't fit in int64
+        with self.assertRaises(ValueError):
+            return_prices(numpy.array([10], dtype=numpy.int64), numpy.array([0]), decimal_places=18)
+
+    def test_pairs(self):
+        with CaptureQueriesContext(connection) as queries:
+            frame = load_price_frame(
+                ExchangeRate.objects.between(self.start, self.start + timedelta(seconds=2)),
+                pairs=[self.binance_key, (self.euro.id, self.bitcoin.id, self.kraken.id)])
+        self.assertEqual(frame.pairs, [self.binance_key])
+        self.assertEqual(len(frame), 2)
+        # The count only reads the rows of the pairs
+        self.assertIn(f'"exchange_id" = {self.binance.id}', queries[0]['sql'])
+
+        self.assertEqual(len(load_price_frame(pairs=[])), 0)
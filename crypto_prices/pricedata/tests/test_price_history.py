@@ -0,0 +1,83 @@
+import json
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from cryptodata.models import Currency, Exchange
+from pricedata import views
+from pricedata.models import ExchangeRate
+
+
+class PriceHistoryViewTestCase(TestCase):
+    def setUp(self):
+        self.exchange = Exchange.objects.create(name='Kraken')
+        self.bitcoin = Currency.objects.create(
+            name='Bitcoin', ticker_symbol='BTC')
+        self.euro = Currency.objects.create(name='Euro', ticker_symbol='EUR')
+        self.start = datetime(2019, 5, 5, 17, 0, tzinfo=timezone.utc)
+        # Two rates per timestamp, to test pages ending within a timestamp
+        for second in range(5):
+            for bid in [100 + second, 200 + second]:
+                ExchangeRate.objects.create(
+                    currency=self.bitcoin, exchange=self.exchange,
+                    base=self.bitcoin, quote=self.euro,
+                    bid=Decimal(bid), ask=Decimal(bid + 1),
+                    timestamp=self.start + timedelta(seconds=second, microseconds=500))
+        self.url = reverse('price_history')
+        self.pair = f'{self.bitcoin.id}-{self.euro.id}-{self.exchange.id}'
+
+    def test_price_history_pages(self):
+        """
+        Tests that following the cursors returns every rate in the
+        range exactly once, in (timestamp, id) order.
+        """
+        params = {
+            'pair': self.pair,
+            'start': (self.start + timedelta(seconds=1)).isoformat(),
+            'limit': 3,
+        }
+        bids = []
+        pages = 0
+        while True:
+            data = self.client.get(self.url, params).json()
+            bids += [Decimal(rate['bid']) for rate in data['rates']]
+            pages += 1
+            if data['next'] is None:
+                break
+            params['cursor'] = data['next']
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(bids, [
+            Decimal(bid) for second in range(1, 5)
+            for bid in [100 + second, 200 + second]])
+
+    def test_price_history_ndjson(self):
+        params = {
+            'pair': self.pair,
+            'end': (self.start + timedelta(seconds=4)).isoformat(),
+            'format': 'ndjson',
+        }
+        with mock.patch.object(views, 'HISTORY_CHUNK_SIZE', 3):
+            response = self.client.get(self.url, params)
+            content = b''.join(response.streaming_content).decode()
+
+        rates = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rates), 8)
+        self.assertEqual(Decimal(rates[0]['bid']), Decimal(100))
+        self.assertEqual(
+            [rate['id'] for rate in rates],
+            sorted(rate['id'] for rate in rates))
+
+    def test_price_history_invalid(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        response = self.client.get(
+            self.url, {'pair': self.pair, 'start': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        for limit in [0, -1]:
+            response = self.client.get(self.url, {'pair': self.pair, 'limit': limit})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {'error': "limit should be at least 1"})
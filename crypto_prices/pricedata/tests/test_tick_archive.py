@@ -0,0 +1,86 @@
+import tempfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from cryptodata.models import Currency, Exchange
+from pricedata.models import ExchangeRate
+from pricedata.tick_archive import TickArchive, return_timestamp_ns, write_tick_archive
+
+
+class TickArchiveTestCase(TestCase):
+    def setUp(self):
+        self.exchange = Exchange.objects.create(name='Kraken')
+        self.bitcoin = Currency.objects.create(
+            name='Bitcoin', ticker_symbol='BTC')
+        self.euro = Currency.objects.create(name='Euro', ticker_symbol='EUR')
+        self.start = datetime(2019, 5, 5, 17, 0, tzinfo=timezone.utc)
+        self.key = (self.bitcoin.id, self.euro.id, self.exchange.id)
+        for seconds in range(10):
+            ExchangeRate.objects.create(
+                currency=self.bitcoin, exchange=self.exchange,
+                base=self.bitcoin, quote=self.euro,
+                bid=Decimal(100 + seconds), ask=Decimal('100.5') + seconds,
+                timestamp=self.start + timedelta(seconds=seconds, microseconds=7))
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_return_timestamp_ns(self):
+        self.assertEqual(
+            return_timestamp_ns(datetime(1970, 1, 1, 0, 0, 1, 5, tzinfo=timezone.utc)),
+            1000005000)
+        self.assertEqual(
+            return_timestamp_ns(datetime(1969, 12, 31, 23, 59, 59, 999999, tzinfo=timezone.utc)),
+            -1000)
+
+    def test_write_and_read(self):
+        """
+        Tests that the archive, written in several chunks, contains all
+        ticks in order, and that slicing on time returns the right
+        ticks.
+        """
+        index = write_tick_archive(self.directory.name, chunk_size=3)
+        self.assertEqual(len(index['pairs']), 1)
+        self.assertEqual(index['pairs'][0]['count'], 10)
+
+        start_ns = return_timestamp_ns(self.start)
+        with TickArchive(self.directory.name) as archive:
+            ticks = archive.open_pair(self.key)
+            self.assertEqual(len(ticks), 10)
+            self.assertEqual(ticks.timestamps[0], start_ns + 7000)
+            self.assertEqual(ticks.asks[9], 109.5)
+
+            timestamps, bids, asks = ticks.slice(
+                start_ns + 2 * 10 ** 9, start_ns + 5 * 10 ** 9)
+            self.assertEqual(list(bids), [102.0, 103.0, 104.0])
+            self.assertEqual(len(timestamps), 3)
+            self.assertEqual(list(ticks.slice(start_ns + 8 * 10 ** 9)[1]), [108.0, 109.0])
+
+        # Slices outlive the archive, the files are unmapped when
+        # they're gone
+        self.assertEqual(list(asks), [102.5, 103.5, 104.5])
+
+    def test_close(self):
+        write_tick_archive(self.directory.name)
+        archive = TickArchive(self.directory.name)
+        archive.open_pair(self.key)
+        mmaps = list(archive._mmaps)
+        archive.close()
+        self.assertTrue(all(column_mmap.closed for column_mmap in mmaps))
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command(
+            'export_tick_archive', self.directory.name,
+            '--pair', '-'.join(str(part) for part in self.key), stdout=stdout)
+        self.assertIn('10 rates of 1 pairs exported', stdout.getvalue())
+        with TickArchive(self.directory.name) as archive:
+            self.assertEqual(list(archive.pairs), [self.key])
+
+        for pair in ['1-2', 'BTC-EUR-1', '0-2-1']:
+            with self.assertRaises(CommandError):
+                call_command('export_tick_archive', self.directory.name, '--pair', pair)
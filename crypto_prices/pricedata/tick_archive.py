@@ -0,0 +1,271 @@
+"""
+Binary archive of ExchangeRate history, for fast access by backtests.
+
+An archive is a directory with an index.json file and, for each pair,
+one file per column, with fixed-width little-endian values, sorted on
+timestamp:
+
+    <base_id>-<quote_id>-<exchange_id>.timestamp    int64, ns since epoch
+    <base_id>-<quote_id>-<exchange_id>.bid          float64
+    <base_id>-<quote_id>-<exchange_id>.ask          float64
+
+index.json format:
+{
+    "version": 1,
+    "columns": {"timestamp": "<i8", "bid": "<f8", "ask": "<f8"},
+    "pairs": [
+        {
+            "base": 1, "quote": 2, "exchange": 1,
+            "name": "1-2-1",
+            "count": 123456,
+            "first_timestamp": 1557077821100000000,
+            "last_timestamp": 1557164221100000000
+        },
+        ...
+    ]
+}
+
+TickArchive opens the column files with mmap, so nothing is read
+until it's used, and slices are views on the mapped files instead of
+copies. Views stay valid after the archive is closed; a file is unmapped
+once the last view on it is gone.
+"""
+import bisect
+import json
+import mmap
+import os
+import sys
+from array import array
+from datetime import datetime
+
+from django.utils import timezone
+
+from pricedata.models import ExchangeRate
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ARCHIVE_VERSION = 1
+INDEX_FILE_NAME = 'index.json'
+COLUMNS = {
+    'timestamp': ('q', '<i8'),
+    'bid': ('d', '<f8'),
+    'ask': ('d', '<f8'),
+}
+EXPORT_CHUNK_SIZE = 50000
+
+
+def return_pair_name(key):
+    return '-'.join(str(part) for part in key)
+
+
+def return_timestamp_ns(timestamp):
+    """
+    Returns the nanoseconds since epoch of an aware datetime, exactly
+    (without going through a float).
+    """
+    delta = timestamp - EPOCH
+    return ((delta.days * 86400 + delta.seconds) * 1000000000
+            + delta.microseconds * 1000)
+
+
+def write_tick_archive(directory, pairs=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Writes the history of the given pairs, (base_id, quote_id,
+    exchange_id) tuples, to a tick archive in directory. Writes all
+    pairs with at least one rate if pairs is None.
+
+    The rates are read in chunks of chunk_size (timestamp, bid, ask)
+    tuples, so memory use doesn't depend on the history size.
+
+    Returns the index (see the module docstring).
+    """
+    os.makedirs(directory, exist_ok=True)
+    if pairs is None:
+        pairs = ExchangeRate.objects.order_by().values_list(
+            'base', 'quote', 'exchange').distinct()
+
+    pairs_index = []
+    for key in sorted(pairs):
+        pair_index = write_pair_columns(directory, key, chunk_size)
+        if pair_index['count']:
+            pairs_index.append(pair_index)
+
+    index = {
+        'version': ARCHIVE_VERSION,
+        'columns': {column: dtype for column, (_, dtype) in COLUMNS.items()},
+        'pairs': pairs_index,
+    }
+    with open(os.path.join(directory, INDEX_FILE_NAME), 'w') as index_file:
+        json.dump(index, index_file, indent=4)
+    return index
+
+
+def write_pair_columns(directory, key, chunk_size):
+    name = return_pair_name(key)
+    queryset = ExchangeRate.objects.for_pair(*key)
+    column_files = {
+        column: open(os.path.join(directory, f'{name}.{column}'), 'wb')
+        for column in COLUMNS
+    }
+    pair_index = {
+        'base': key[0], 'quote': key[1], 'exchange': key[2], 'name': name,
+        'count': 0, 'first_timestamp': None, 'last_timestamp': None,
+    }
+    try:
+        cursor = None
+        while True:
+            chunk_queryset = queryset
+            if cursor is not None:
+                chunk_queryset = queryset.after(*cursor)
+            rates = list(chunk_queryset.order_by('timestamp', 'id').values_list(
+                'id', 'timestamp', 'bid', 'ask', 'price_scale')[:chunk_size])
+            if not rates:
+                break
+
+            # bid and ask are stored as units, dividing ints gives the
+            # nearest float
+            columns = {
+                'timestamp': array('q', (return_timestamp_ns(rate[1]) for rate in rates)),
+                'bid': array('d', (rate[2] / 10 ** rate[4] for rate in rates)),
+                'ask': array('d', (rate[3] / 10 ** rate[4] for rate in rates)),
+            }
+            for column, values in columns.items():
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                values.tofile(column_files[column])
+
+            if pair_index['first_timestamp'] is None:
+                pair_index['first_timestamp'] = return_timestamp_ns(rates[0][1])
+            pair_index['last_timestamp'] = return_timestamp_ns(rates[-1][1])
+            pair_index['count'] += len(rates)
+            cursor = (rates[-1][1], rates[-1][0])
+    finally:
+        for column_file in column_files.values():
+            column_file.close()
+
+    if not pair_index['count']:
+        for column in COLUMNS:
+            os.remove(os.path.join(directory, f'{name}.{column}'))
+    return pair_index
+
+
+class PairTicks:
+    """
+    The ticks of one pair, as memoryviews on the mapped column files:
+    timestamps (int64 ns), bids and asks (float64).
+    """
+
+    def __init__(self, pair_index, timestamps, bids, asks):
+        self.pair_index = pair_index
+        self.timestamps = timestamps
+        self.bids = bids
+        self.asks = asks
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def return_range(self, start_ns=None, end_ns=None):
+        """
+        Returns the (first, last + 1) positions of the ticks with
+        start_ns <= timestamp < end_ns, using binary search.
+        """
+        first = 0 if start_ns is None else bisect.bisect_left(
+            self.timestamps, start_ns)
+        last = len(self) if end_ns is None else bisect.bisect_left(
+            self.timestamps, end_ns)
+        return first, last
+
+    def slice(self, start_ns=None, end_ns=None):
+        """
+        Returns the ticks with start_ns <= timestamp < end_ns as
+        (timestamps, bids, asks), views on the archive, not copies. They
+        stay valid after the archive is closed.
+        """
+        first, last = self.return_range(start_ns, end_ns)
+        return (self.timestamps[first:last], self.bids[first:last],
+                self.asks[first:last])
+
+
+class TickArchive:
+    """
+    Read access to a tick archive, see the module docstring.
+
+    Use as a context manager, or call close() when done. The PairTicks
+    can't be used after closing, slices taken from them can.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE_NAME)) as index_file:
+            self.index = json.load(index_file)
+        if self.index['version'] != ARCHIVE_VERSION:
+            raise ValueError(
+                f"Unsupported tick archive version: {self.index['version']}")
+        self.pairs = {
+            (pair['base'], pair['quote'], pair['exchange']): pair
+            for pair in self.index['pairs']
+        }
+        self._mmaps = []
+        self._views = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def return_column_path(self, key, column):
+        return os.path.join(
+            self.directory, f"{self.pairs[key]['name']}.{column}")
+
+    def open_pair(self, key):
+        """
+        Returns the PairTicks of the pair (base_id, quote_id,
+        exchange_id). Raises KeyError if it isn't in the archive.
+        """
+        pair_index = self.pairs[key]
+        columns = []
+        for column, (typecode, _) in COLUMNS.items():
+            with open(self.return_column_path(key, column), 'rb') as column_file:
+                column_mmap = mmap.mmap(
+                    column_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mmaps.append(column_mmap)
+            if sys.byteorder == 'big':
+                # Can't cast without converting, copy once
+                values = array(typecode, column_mmap)
+                values.byteswap()
+                view = memoryview(values)
+            else:
+                view = memoryview(column_mmap).cast(typecode)
+            self._views.append(view)
+            columns.append(view)
+        return PairTicks(pair_index, *columns)
+
+    def open_pair_numpy(self, key):
+        """
+        Returns the pair's (timestamps, bids, asks) as numpy.memmap
+        arrays. Requires numpy.
+        """
+        import numpy
+
+        return tuple(
+            numpy.memmap(self.return_column_path(key, column),
+                         dtype=dtype, mode='r')
+            for column, (_, dtype) in COLUMNS.items()
+        )
+
+    def close(self):
+        # Files with live slices (BufferError) are unmapped when the
+        # last slice is garbage collected, they keep a reference
+        for view in self._views:
+            try:
+                view.release()
+            except BufferError:
+                pass
+        for column_mmap in self._mmaps:
+            try:
+                column_mmap.close()
+            except BufferError:
+                pass
+        self._views = []
+        self._mmaps = []
@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import views
+
+urlpatterns = [
+    path('latest/', views.latest_prices, name='latest_prices'),
+    path('history/', views.price_history, name='price_history'),
+    path('analytics/', views.price_analytics, name='price_analytics'),
+    path('convert/', views.convert_currencies, name='convert_currencies'),
+]
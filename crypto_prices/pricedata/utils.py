@@ -0,0 +1,29 @@
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from pricedata.fields import INT64_MAX
+
+
+def parse_pair(value):
+    """
+    Takes a pair in the format base_id-quote_id-exchange_id, returns
+    (base_id, quote_id, exchange_id). Raises ValueError if invalid,
+    also for ids that don't fit in the db's 64 bit integers.
+    """
+    key = tuple(int(part) for part in value.split('-'))
+    if len(key) != 3 or not all(1 <= id <= INT64_MAX for id in key):
+        raise ValueError(f"Invalid pair: {value}")
+    return key
+
+
+def parse_timestamp(value):
+    """
+    Takes an ISO 8601 datetime, returns it as an aware datetime (UTC
+    if it has no timezone). Raises ValueError if invalid.
+    """
+    timestamp = parse_datetime(value)
+    if timestamp is None:
+        raise ValueError(f"Invalid datetime: {value}")
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp, timezone.utc)
+    return timestamp
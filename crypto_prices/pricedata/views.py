@@ -1,3 +1,314 @@
-from django.shortcuts import render
+import json
+from datetime import datetime
 
-# Create your views here.
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+
+from pricedata.conversion import conversion_service
+from pricedata.fields import return_decimal
+from pricedata.latest_prices import latest_price_cache
+from pricedata.models import ExchangeRate
+from pricedata.utils import parse_pair, parse_timestamp
+
+
+MAX_PAIRS_PER_REQUEST = 1000
+MAX_CURRENCIES_PER_REQUEST = 1000
+HISTORY_PAGE_SIZE = 1000
+MAX_HISTORY_PAGE_SIZE = 10000
+# Rates per query when streaming
+HISTORY_CHUNK_SIZE = 5000
+MAX_ANALYTICS_PAIRS = 20
+ANALYTICS_WINDOW = 100
+
+
+def latest_prices(request):
+    """
+    Returns the latest bid and ask of many pairs at once.
+
+    The pairs are given as a comma separated list of
+    base_id-quote_id-exchange_id, e.g.:
+    /prices/latest/?pairs=1-2-1,1-3-2
+
+    Response format:
+    {
+        "prices": [
+            {
+                "base": 1,
+                "quote": 2,
+                "exchange": 1,
+                "bid": "5123.100000000000",
+                "ask": "5124.000000000000",
+                "timestamp": "2019-05-05T17:37:01.100000+00:00"
+            },
+            ...
+        ],
+        "missing": ["1-3-2"]
+    }
+    """
+    pairs = [pair for pair in request.GET.get('pairs', '').split(',') if pair]
+    if len(pairs) > MAX_PAIRS_PER_REQUEST:
+        return JsonResponse(
+            {'error': f"At most {MAX_PAIRS_PER_REQUEST} pairs per request"},
+            status=400)
+    try:
+        keys = [parse_pair(pair) for pair in pairs]
+    except ValueError:
+        keys = []
+    if not keys:
+        return JsonResponse(
+            {'error': "pairs should be base_id-quote_id-exchange_id, "
+                      "comma separated"},
+            status=400)
+
+    prices = latest_price_cache.get_many(keys)
+    return JsonResponse({
+        'prices': [
+            {
+                'base': key[0],
+                'quote': key[1],
+                'exchange': key[2],
+                'bid': str(bid),
+                'ask': str(ask),
+                'timestamp': timestamp.isoformat(),
+            }
+            for key, (bid, ask, timestamp) in prices.items()
+        ],
+        'missing': ['-'.join(map(str, key)) for key in keys if key not in prices],
+    })
+
+
+def price_history(request):
+    """
+    Returns the rates of one pair, oldest first.
+
+    Parameters:
+    - pair: base_id-quote_id-exchange_id (required)
+    - start, end: ISO 8601 datetimes, start <= timestamp < end (optional)
+    - format: 'json' (default) for one page of rates, or 'ndjson' to
+      stream all rates in the range, one json object per line
+    - limit: rates per page, json format only
+    - cursor: the 'next' value of the previous page, json format only
+
+    Pages are selected with a (timestamp, id) keyset instead of an
+    offset, so every page (and every chunk of a stream) is one
+    index range read, however deep into the history it is.
+
+    Response format (json):
+    {
+        "rates": [
+            {
+                "id": 123,
+                "timestamp": "2019-05-05T17:37:01.100000+00:00",
+                "bid": "5123.100000000000",
+                "ask": "5124.000000000000"
+            },
+            ...
+        ],
+        "next": "1557077821100000-123"  # null on the last page
+    }
+    """
+    try:
+        queryset = return_history_queryset(request.GET)
+        cursor = parse_cursor(request.GET.get('cursor'))
+        limit = min(
+            int(request.GET.get('limit', HISTORY_PAGE_SIZE)),
+            MAX_HISTORY_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError("limit should be at least 1")
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    if request.GET.get('format') == 'ndjson':
+        return StreamingHttpResponse(
+            iter_ndjson_rates(queryset), content_type='application/x-ndjson')
+
+    rates = return_rates_page(queryset, cursor, limit)
+    next_cursor = None
+    if len(rates) == limit:
+        next_cursor = format_cursor(rates[-1][1], rates[-1][0])
+    return JsonResponse({
+        'rates': [format_rate(rate) for rate in rates],
+        'next': next_cursor,
+    })
+
+
+def return_history_queryset(params):
+    """
+    Returns the ExchangeRates selected by the pair, start and end
+    request parameters. Raises ValueError if they're invalid.
+    """
+    base_id, quote_id, exchange_id = parse_pair(params.get('pair', ''))
+    queryset = ExchangeRate.objects.filter(
+        base=base_id, quote=quote_id, exchange=exchange_id)
+    if params.get('start'):
+        queryset = queryset.filter(timestamp__gte=parse_timestamp(params['start']))
+    if params.get('end'):
+        queryset = queryset.filter(timestamp__lt=parse_timestamp(params['end']))
+    return queryset
+
+
+def format_cursor(timestamp, id):
+    """
+    Cursor format: <microseconds since epoch>-<id>
+    """
+    return f'{round(timestamp.timestamp() * 1000000)}-{id}'
+
+
+def parse_cursor(value):
+    """
+    Returns the (timestamp, id) of a cursor, or None if no cursor.
+    """
+    if not value:
+        return None
+    microseconds, id = (int(part) for part in value.split('-'))
+    timestamp = datetime.fromtimestamp(microseconds // 1000000, timezone.utc)
+    return timestamp.replace(microsecond=microseconds % 1000000), id
+
+
+def return_rates_page(queryset, cursor, limit):
+    """
+    Returns up to limit (id, timestamp, bid, ask) tuples, after the
+    cursor if given.
+    """
+    if cursor is not None:
+        queryset = queryset.after(*cursor)
+    return [
+        (id, timestamp, return_decimal(bid, price_scale),
+         return_decimal(ask, price_scale))
+        for id, timestamp, bid, ask, price_scale in queryset.order_by(
+            'timestamp', 'id').values_list(
+                'id', 'timestamp', 'bid', 'ask', 'price_scale')[:limit]
+    ]
+
+
+def format_rate(rate):
+    id, timestamp, bid, ask = rate
+    return {
+        'id': id,
+        'timestamp': timestamp.isoformat(),
+        'bid': str(bid),
+        'ask': str(ask),
+    }
+
+
+def iter_ndjson_rates(queryset):
+    """
+    Yields all rates of queryset as lines of json, reading them
+    HISTORY_CHUNK_SIZE rates at a time.
+    """
+    cursor = None
+    while True:
+        rates = return_rates_page(queryset, cursor, HISTORY_CHUNK_SIZE)
+        if rates:
+            yield ''.join(
+                json.dumps(format_rate(rate)) + '\n' for rate in rates)
+        if len(rates) < HISTORY_CHUNK_SIZE:
+            return
+        cursor = (rates[-1][1], rates[-1][0])
+
+
+def price_analytics(request):
+    """
+    Returns spread, return and volatility statistics of one or more
+    pairs, and the price differences between exchanges of the same
+    pair. See pricedata.analytics for the response format.
+
+    Parameters:
+    - pairs: comma separated list of base_id-quote_id-exchange_id
+    - start, end: ISO 8601 datetimes, start <= timestamp < end (optional)
+    - window: ticks per rolling window (default 100)
+    """
+    # Imported here, so the other views work without numpy
+    from pricedata.analytics import summarize_frame
+    from pricedata.price_frame import load_price_frame
+
+    try:
+        keys = [
+            parse_pair(pair)
+            for pair in request.GET.get('pairs', '').split(',') if pair
+        ]
+        if not keys:
+            raise ValueError(
+                "pairs should be base_id-quote_id-exchange_id, comma separated")
+        if len(keys) > MAX_ANALYTICS_PAIRS:
+            raise ValueError(f"At most {MAX_ANALYTICS_PAIRS} pairs per request")
+        window = int(request.GET.get('window', ANALYTICS_WINDOW))
+        if window < 1:
+            raise ValueError("window should be at least 1")
+        queryset = ExchangeRate.objects.all()
+        if request.GET.get('start'):
+            queryset = queryset.filter(
+                timestamp__gte=parse_timestamp(request.GET['start']))
+        if request.GET.get('end'):
+            queryset = queryset.filter(
+                timestamp__lt=parse_timestamp(request.GET['end']))
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    frame = load_price_frame(queryset, pairs=keys)
+    return JsonResponse(summarize_frame(frame, window))
+
+
+def convert_currencies(request):
+    """
+    Returns the price of many currencies in one quote currency (see
+    settings.CONVERSION_QUOTE_CURRENCIES), also of currencies without a
+    direct pair, through a chain of pairs (see pricedata.conversion).
+
+    Parameters:
+    - currencies: comma separated list of currency ids
+    - to: id of the quote currency
+
+    e.g. /prices/convert/?currencies=5,6&to=2
+
+    Response format:
+    {
+        "rates": [
+            {
+                "currency": 5,
+                "rate": "0.00012345000000000000",
+                "path": ["5-1-1", "1-2-1"]  # pairs, base-quote-exchange
+            },
+            ...
+        ],
+        "missing": [6]
+    }
+    """
+    try:
+        currency_ids = [
+            int(currency_id)
+            for currency_id in request.GET.get('currencies', '').split(',')
+            if currency_id
+        ]
+        quote_id = int(request.GET.get('to', ''))
+    except ValueError:
+        currency_ids = []
+    if not currency_ids:
+        return JsonResponse(
+            {'error': "currencies should be comma separated currency ids, "
+                      "to a currency id"},
+            status=400)
+    if len(currency_ids) > MAX_CURRENCIES_PER_REQUEST:
+        return JsonResponse(
+            {'error': f"At most {MAX_CURRENCIES_PER_REQUEST} currencies per request"},
+            status=400)
+
+    try:
+        rates = conversion_service.convert_many(currency_ids, quote_id)
+    except KeyError:
+        return JsonResponse(
+            {'error': f"Can't convert to currency {quote_id}"}, status=400)
+    return JsonResponse({
+        'rates': [
+            {
+                'currency': currency_id,
+                'rate': str(rate),
+                'path': ['-'.join(map(str, key)) for key, _ in path],
+            }
+            for currency_id, (rate, path) in rates.items()
+        ],
+        'missing': [
+            currency_id for currency_id in currency_ids
+            if currency_id not in rates
+        ],
+    })